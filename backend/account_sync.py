@@ -0,0 +1,237 @@
+# finance-app-master/account_sync.py
+"""
+Синхронизация счетов подключения с банком.
+
+Обновление пропускается, если подключение успешно синхронизировалось не раньше
+ACCOUNTS_FRESHNESS_SECONDS назад (если не передан force). Одновременные
+обновления одного подключения в процессе объединяются: банк опрашивается один раз,
+остальные запросы получают тот же результат. Если запрос, который ведет обновление,
+отменяется, ожидающие не отменяются вместе с ним: один из них запускает обновление заново.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+import models
+from utils import get_bank_token, bank_http_client
+from rate_limit import BankRateLimited
+from balance_history import record_balance_snapshots, extract_typed_balances
+from events import publish_sync_result
+
+logger = logging.getLogger("uvicorn")
+
+ACCOUNTS_FRESHNESS_SECONDS = float(os.getenv("ACCOUNTS_FRESHNESS_SECONDS", "60"))
+
+# Меняется при изменении набора колонок, которые заполняются из данных банка:
+# тогда все счета один раз перезаписываются при следующем обновлении
+CONTENT_HASH_VERSION = 2
+
+# connection_id -> обновление, которое сейчас выполняется (результат None - владелец отменен)
+_inflight: Dict[int, asyncio.Future] = {}
+
+
+def account_content_hash(acc_data: dict, balances: Optional[list], sync_status: str) -> str:
+    """Хэш полей счета, которые обновляются при синхронизации, и его балансов."""
+    payload = {
+        "status": acc_data.get("status"),
+        "currency": acc_data.get("currency"),
+        "nickname": acc_data.get("nickname"),
+        "account": acc_data.get("account"),
+        "balance": balances,
+        "sync_status": sync_status,
+        "version": CONTENT_HASH_VERSION,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def data_age_seconds(last_synced_at: Optional[datetime]) -> Optional[float]:
+    if last_synced_at is None:
+        return None
+    return round((datetime.now(timezone.utc) - last_synced_at).total_seconds(), 1)
+
+
+def is_fresh(conn: models.ConnectedBank) -> bool:
+    age = data_age_seconds(conn.last_synced_at)
+    return conn.sync_status == "ok" and age is not None and age < ACCOUNTS_FRESHNESS_SECONDS
+
+
+async def sync_connection_accounts(db: Session, conn: models.ConnectedBank, bank_config: models.Bank) -> dict:
+    """
+    Запрашивает счета и балансы подключения у банка, сохраняет их и снимки балансов.
+    Коммитит изменения и отмечает время и статус синхронизации.
+    """
+    bank_access_token = await get_bank_token(conn.bank_name, db)
+    headers = {
+        "Authorization": f"Bearer {bank_access_token}",
+        "X-Requesting-Bank": bank_config.client_id,
+        "X-Consent-Id": conn.consent_id,
+        "Accept": "application/json"
+    }
+    params = {"client_id": conn.bank_client_id}
+
+    accounts_list = []
+    async with bank_http_client(conn.bank_name, user_id=conn.user_id) as client:
+        try:
+            accounts_url = f"{bank_config.base_url}/accounts"
+            accounts_response = await client.get(accounts_url, headers=headers, params=params)
+            accounts_response.raise_for_status()
+            accounts_list = accounts_response.json().get("data", {}).get("account", [])
+        except BankRateLimited:
+            # Без списка счетов обновлять нечего: клиент получит 503 с Retry-After
+            raise
+        except (httpx.RequestError, httpx.HTTPStatusError) as e:
+            raise HTTPException(status_code=502, detail=f"Failed to fetch accounts from {conn.bank_name}: {e}")
+
+        synced_at = datetime.now(timezone.utc)
+        updated_count = 0
+        unchanged_count = 0
+        created_count = 0
+        refreshed_accounts = []
+        # Все счета подключения одним запросом вместо запроса на каждый счет
+        existing_accounts = {
+            account.api_account_id: account
+            for account in db.query(models.Account).filter(models.Account.connection_id == conn.id).all()
+        }
+        for acc_data in accounts_list:
+            api_acc_id = acc_data.get("accountId")
+            if not api_acc_id:
+                continue
+
+            balances_list = []
+            # Счет без балансов сохраняем, но помечаем как синхронизированный частично;
+            # так же и при BankRateLimited (подкласс httpx.RequestError) - остальные счета обновятся
+            account_sync_status = "ok"
+            try:
+                balances_url = f"{bank_config.base_url}/accounts/{api_acc_id}/balances"
+                balances_response = await client.get(balances_url, headers=headers, params=params)
+                balances_response.raise_for_status()
+                balances_list = balances_response.json().get("data", {}).get("balance", [])
+            except (httpx.RequestError, httpx.HTTPStatusError):
+                account_sync_status = "partial"
+
+            db_account = existing_accounts.get(api_acc_id)
+
+            if db_account:
+                # Если балансы не пришли, сравниваем с теми, что уже сохранены
+                balances_for_hash = balances_list if account_sync_status == "ok" else db_account.balance_data
+                content_hash = account_content_hash(acc_data, balances_for_hash, account_sync_status)
+                if db_account.content_hash == content_hash:
+                    # Ничего не изменилось: не создаем новую версию строки и JSONB в Postgres
+                    unchanged_count += 1
+                    continue
+                db_account.status = acc_data.get("status")
+                db_account.currency = acc_data.get("currency")
+                db_account.nickname = acc_data.get("nickname")
+                db_account.owner_data = acc_data.get("account")
+                if account_sync_status == "ok":
+                    db_account.balance_data = balances_list
+                    for column, value in extract_typed_balances(balances_list).items():
+                        setattr(db_account, column, value)
+                db_account.content_hash = content_hash
+                updated_count += 1
+            else:
+                db_account = models.Account(
+                    connection_id=conn.id,
+                    api_account_id=api_acc_id,
+                    status=acc_data.get("status"),
+                    currency=acc_data.get("currency"),
+                    account_type=acc_data.get("accountType"),
+                    account_subtype=acc_data.get("accountSubType"),
+                    nickname=acc_data.get("nickname"),
+                    opening_date=acc_data.get("openingDate"),
+                    owner_data=acc_data.get("account"),
+                    balance_data=balances_list,
+                    content_hash=account_content_hash(acc_data, balances_list, account_sync_status),
+                    **extract_typed_balances(balances_list)
+                )
+                db.add(db_account)
+                created_count += 1
+            db_account.last_synced_at = synced_at
+            db_account.sync_status = account_sync_status
+            refreshed_accounts.append((db_account, balances_list))
+
+    # flush нужен, чтобы у новых счетов появились id для истории балансов
+    db.flush()
+    snapshots_count = record_balance_snapshots(
+        db, {db_account.id: balances for db_account, balances in refreshed_accounts if balances}
+    )
+    conn.last_synced_at = synced_at
+    conn.sync_status = "ok"
+    # Подписчики получают только изменившиеся счета; событие уходит после коммита
+    publish_sync_result(db, conn, [db_account for db_account, _ in refreshed_accounts])
+    db.commit()
+
+    return {
+        "created": created_count,
+        "updated": updated_count,
+        "unchanged": unchanged_count,
+        "balance_snapshots": snapshots_count,
+        "last_synced_at": synced_at,
+    }
+
+
+def _mark_sync_failed(db: Session, conn: models.ConnectedBank) -> None:
+    db.rollback()
+    try:
+        conn.sync_status = "error"
+        publish_sync_result(db, conn, [])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to store sync status for connection {conn.id}: {e}")
+
+
+async def refresh_connection_accounts(
+    db: Session,
+    conn: models.ConnectedBank,
+    bank_config: models.Bank,
+    force: bool = False,
+) -> dict:
+    """
+    Обновляет счета подключения с учетом окна свежести и объединения запросов.
+    source в результате: "bank" - данные только что получены, "stored" - взяты из БД
+    (свежие), "shared" - результат обновления, запущенного другим запросом.
+    """
+    if not force and is_fresh(conn):
+        return {
+            "source": "stored", "created": 0, "updated": 0, "unchanged": 0, "balance_snapshots": 0,
+            "last_synced_at": conn.last_synced_at,
+        }
+
+    inflight = _inflight.get(conn.id)
+    while inflight is not None:
+        result = await asyncio.shield(inflight)
+        if result is not None:
+            return {**result, "source": "shared"}
+        # Запрос, выполнявший обновление, отменен (клиент отключился, истек таймаут прогрева);
+        # его сессия закрывается вместе с ним, поэтому обновление повторяет один из ожидавших
+        inflight = _inflight.get(conn.id)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[conn.id] = future
+    try:
+        result = await sync_connection_accounts(db, conn, bank_config)
+        result["source"] = "bank"
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.set_result(None)
+        raise
+    except Exception as e:
+        _mark_sync_failed(db, conn)
+        future.set_exception(e)
+        # Исключение забирают ожидающие запросы; без них - гасим предупреждение asyncio
+        future.exception()
+        raise
+    finally:
+        if _inflight.get(conn.id) is future:
+            del _inflight[conn.id]
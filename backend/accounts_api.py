@@ -1,14 +1,21 @@
 # finance-app-master/accounts_api.py
-import httpx
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
-from typing import Optional, List
-from datetime import date
+from typing import Optional, List, Literal
+from datetime import date, datetime
 import models
-from database import get_db
+from database import get_db, get_read_db
 from deps import user_is_admin_or_self, get_current_user
-from utils import get_bank_token
-from schemas import AccountListResponse, AccountSchema, AccountUpdate
+from account_sync import refresh_connection_accounts, data_age_seconds
+from balance_history import downsample_history
+from currency import RateTable, get_rate_table, from_minor_units
+from encoding import encoded_response, MSGPACK_RESPONSES
+from schemas import (
+    AccountListResponse, AccountSchema, AccountUpdate,
+    BalanceHistoryResponse, BalanceSeries, BalancePoint,
+    NetWorthResponse, CurrencyBalanceTotal
+)
 
 router = APIRouter(
     prefix="/users/{user_id}/accounts",
@@ -19,12 +26,14 @@ router = APIRouter(
 async def refresh_and_save_accounts(
     user_id: int,
     connection_id: int,
+    force: bool = Query(False, description="Запросить банк, даже если данные еще свежие"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
-    Принудительно запрашивает данные о счетах и балансах у банка
-    для конкретного подключения и сохраняет/обновляет их в базе данных.
+    Запрашивает данные о счетах и балансах у банка для конкретного подключения
+    и сохраняет/обновляет их в базе данных. Если подключение синхронизировалось
+    недавно (ACCOUNTS_FRESHNESS_SECONDS), банк не опрашивается, пока не передан force=true.
     """
     conn = db.query(models.ConnectedBank).filter(
         models.ConnectedBank.id == connection_id,
@@ -38,87 +47,39 @@ async def refresh_and_save_accounts(
     if not bank_config:
          raise HTTPException(status_code=500, detail="Bank configuration not found.")
 
-    bank_access_token = await get_bank_token(conn.bank_name, db)
-    headers = {
-        "Authorization": f"Bearer {bank_access_token}",
-        "X-Requesting-Bank": bank_config.client_id,
-        "X-Consent-Id": conn.consent_id,
-        "Accept": "application/json"
-    }
-    params = {"client_id": conn.bank_client_id}
-    
-    accounts_list = []
-    async with httpx.AsyncClient() as client:
-        try:
-            accounts_url = f"{bank_config.base_url}/accounts"
-            accounts_response = await client.get(accounts_url, headers=headers, params=params)
-            accounts_response.raise_for_status()
-            accounts_list = accounts_response.json().get("data", {}).get("account", [])
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            raise HTTPException(status_code=502, detail=f"Failed to fetch accounts from {conn.bank_name}: {e}")
-
-        updated_count = 0
-        created_count = 0
-        for acc_data in accounts_list:
-            api_acc_id = acc_data.get("accountId")
-            if not api_acc_id:
-                continue
-
-            balances_list = []
-            try:
-                balances_url = f"{bank_config.base_url}/accounts/{api_acc_id}/balances"
-                balances_response = await client.get(balances_url, headers=headers, params=params)
-                balances_response.raise_for_status()
-                balances_list = balances_response.json().get("data", {}).get("balance", [])
-            except (httpx.RequestError, httpx.HTTPStatusError):
-                pass 
-
-            db_account = db.query(models.Account).filter_by(api_account_id=api_acc_id, connection_id=conn.id).first()
-
-            if db_account:
-                db_account.status = acc_data.get("status")
-                db_account.currency = acc_data.get("currency")
-                db_account.nickname = acc_data.get("nickname")
-                db_account.owner_data = acc_data.get("account")
-                db_account.balance_data = balances_list
-                updated_count += 1
-            else: 
-                new_db_account = models.Account(
-                    connection_id=conn.id,
-                    api_account_id=api_acc_id,
-                    status=acc_data.get("status"),
-                    currency=acc_data.get("currency"),
-                    account_type=acc_data.get("accountType"),
-                    account_subtype=acc_data.get("accountSubType"),
-                    nickname=acc_data.get("nickname"),
-                    opening_date=acc_data.get("openingDate"),
-                    owner_data=acc_data.get("account"),
-                    balance_data=balances_list
-                )
-                db.add(new_db_account)
-                created_count += 1
-    
-    db.commit()
+    result = await refresh_connection_accounts(db, conn, bank_config, force=force)
 
     return {
         "status": "success",
         "message": f"Accounts for connection {connection_id} refreshed.",
-        "created": created_count,
-        "updated": updated_count
+        "source": result["source"],
+        "created": result["created"],
+        "updated": result["updated"],
+        "unchanged": result["unchanged"],
+        "balance_snapshots": result["balance_snapshots"],
+        "last_synced_at": result["last_synced_at"],
+        "data_age_seconds": data_age_seconds(result["last_synced_at"])
     }
 
 
-@router.get("/", response_model=AccountListResponse, summary="Получить сохраненные счета из БД с фильтрацией")
+@router.get(
+    "/",
+    response_model=AccountListResponse,
+    responses=MSGPACK_RESPONSES,
+    summary="Получить сохраненные счета из БД с фильтрацией"
+)
 def get_saved_accounts(
     user_id: int,
+    request: Request,
     bank_name: Optional[str] = Query(None, description="Фильтр по имени банка (vbank, abank, etc.)"),
     api_account_id: Optional[str] = Query(None, description="Фильтр по ID счета из API банка"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
     """
     Возвращает список счетов пользователя, сохраненных в базе данных.
     Доступна фильтрация по названию банка и ID счета.
+    С заголовком Accept: application/msgpack ответ отдается в MessagePack.
     """
     query = db.query(models.Account).join(models.ConnectedBank).filter(models.ConnectedBank.user_id == user_id)
 
@@ -130,9 +91,121 @@ def get_saved_accounts(
 
     accounts_from_db = query.all()
     
-    return AccountListResponse(count=len(accounts_from_db), accounts=accounts_from_db)
+    return encoded_response(request, AccountListResponse(count=len(accounts_from_db), accounts=accounts_from_db))
   
 
+@router.get("/net-worth", response_model=NetWorthResponse, summary="Итоговый баланс пользователя по всем счетам")
+def get_net_worth(
+    user_id: int,
+    base_currency: Optional[str] = Query(None, min_length=3, max_length=3, description="Пересчитать итог в валюту (по таблице курсов)"),
+    db: Session = Depends(get_read_db),
+    rate_table: RateTable = Depends(get_rate_table),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Суммирует сохраненные остатки счетов по валютам одним агрегирующим запросом.
+    Остатки обновляются при обновлении счетов из банка.
+    """
+    account = models.Account
+    rows = db.execute(
+        select(
+            account.balance_currency,
+            func.coalesce(func.sum(account.current_balance_minor), 0).label("current"),
+            func.coalesce(func.sum(account.available_balance_minor), 0).label("available"),
+            func.count().label("accounts_count"),
+            func.min(account.balance_as_of).label("as_of"),
+        )
+        .join(models.ConnectedBank, account.connection_id == models.ConnectedBank.id)
+        .where(models.ConnectedBank.user_id == user_id, account.balance_currency.isnot(None))
+        .group_by(account.balance_currency)
+        .order_by(account.balance_currency)
+    ).all()
+
+    by_currency = [
+        CurrencyBalanceTotal(
+            currency=row.balance_currency,
+            current=from_minor_units(row.current, row.balance_currency),
+            available=from_minor_units(row.available, row.balance_currency),
+            accounts_count=row.accounts_count,
+        )
+        for row in rows
+    ]
+
+    converted = None
+    missing_rates: List[str] = []
+    if base_currency:
+        base_currency = base_currency.upper()
+        total_current = total_available = counted = 0
+        for row in rows:
+            current = rate_table.convert_minor(row.current, row.balance_currency, base_currency)
+            available = rate_table.convert_minor(row.available, row.balance_currency, base_currency)
+            if current is None or available is None:
+                missing_rates.append(row.balance_currency)
+                continue
+            total_current += current
+            total_available += available
+            counted += row.accounts_count
+        converted = CurrencyBalanceTotal(
+            currency=base_currency,
+            current=from_minor_units(total_current, base_currency),
+            available=from_minor_units(total_available, base_currency),
+            accounts_count=counted,
+        )
+
+    moments = [row.as_of for row in rows if row.as_of]
+    return NetWorthResponse(
+        accounts_count=sum(row.accounts_count for row in rows),
+        by_currency=by_currency,
+        base_currency=base_currency,
+        converted=converted,
+        missing_rates=missing_rates,
+        as_of=min(moments) if moments else None,
+    )
+
+
+@router.get(
+    "/{account_id}/balance-history",
+    response_model=BalanceHistoryResponse,
+    summary="История баланса счета с агрегацией по дням/неделям/месяцам"
+)
+def get_balance_history(
+    user_id: int,
+    account_id: int,
+    granularity: Literal["day", "week", "month"] = Query("day", description="Шаг агрегации"),
+    from_date: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
+    to_date: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
+    balance_type: Optional[str] = Query(None, description="Тип баланса (InterimAvailable, InterimBooked, ...). По умолчанию - все"),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Возвращает баланс на конец каждого периода по сохраненным снимкам.
+    Снимки пишутся при каждом обновлении счетов, но только если значение изменилось.
+    """
+    db_account = db.query(models.Account).join(models.ConnectedBank).filter(
+        models.Account.id == account_id,
+        models.ConnectedBank.user_id == user_id
+    ).first()
+    if not db_account:
+        raise HTTPException(status_code=404, detail="Account not found or access denied.")
+
+    try:
+        history = downsample_history(db, account_id, granularity, from_date, to_date, balance_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    series = [
+        BalanceSeries(
+            balance_type=type_name,
+            points=[
+                BalancePoint(period_start=moment, amount=from_minor_units(minor, currency), currency=currency)
+                for moment, minor, currency in points
+            ]
+        )
+        for type_name, points in sorted(history.items())
+    ]
+    return BalanceHistoryResponse(account_id=account_id, granularity=granularity, series=series)
+
+
 # 2. ДОБАВЛЯЕМ НОВЫЙ МЕТОД ДЛЯ ОБНОВЛЕНИЯ
 @router.put("/{account_id}", response_model=AccountSchema, summary="Обновить детали счета (даты)")
 def update_account_details(
@@ -0,0 +1,46 @@
+# finance-app-master/admin_api.py
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+
+import models
+from deps import get_current_admin_user
+from profiling import get_profile, list_profiles
+from loop_monitor import LOOP_BLOCK_THRESHOLD, recent_blocks
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/profiles", summary="Список последних профилей запросов (Только для администраторов)")
+def get_profiles(current_admin: models.User = Depends(get_current_admin_user)):
+    """
+    Профили запросов, выполненных с заголовком `X-Profile: 1` от имени администратора.
+    Хранятся в памяти процесса, самые новые - первыми.
+    """
+    profiles = list_profiles()
+    return {"count": len(profiles), "profiles": profiles}
+
+
+@router.get("/profiles/{profile_id}", summary="Детали профиля запроса (Только для администраторов)")
+def get_profile_details(profile_id: str, current_admin: models.User = Depends(get_current_admin_user)):
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {**profile.summary(), "call_profile": profile.stats_text}
+
+
+@router.get("/profiles/{profile_id}/stats", response_class=PlainTextResponse, summary="Вывод cProfile для профиля (Только для администраторов)")
+def get_profile_stats(profile_id: str, current_admin: models.User = Depends(get_current_admin_user)):
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.stats_text)
+
+
+@router.get("/loop-blocks", summary="Последние блокировки event loop (Только для администраторов)")
+def get_loop_blocks(current_admin: models.User = Depends(get_current_admin_user)):
+    """
+    Callback'и, которые держали event loop этого воркера дольше LOOP_BLOCK_THRESHOLD_MS:
+    маршрут, задача, длительность и стек в момент обнаружения. Самые новые - первыми.
+    """
+    blocks = recent_blocks()
+    return {"threshold_ms": LOOP_BLOCK_THRESHOLD * 1000, "count": len(blocks), "blocks": blocks}
@@ -0,0 +1,196 @@
+# finance-app-master/admission.py
+"""
+Ограничение числа одновременно обрабатываемых запросов (в пределах процесса).
+
+Маршруты разбиты на группы: bank - запросы, которые ходят в банки и могут
+держать соединение десятки секунд; export - потоковые выгрузки; local - все
+остальное. У каждой группы свой лимит одновременных запросов и ограниченная
+очередь ожидания. Запрос, которому не хватило места в очереди или который не
+дождался своей очереди за max_wait секунд, сразу получает 503 с Retry-After.
+Поэтому всплеск запросов транзакций не занимает воркер целиком. Health-check,
+аутентификация, /users/me и метрики не ограничиваются.
+
+Настройка: ADMISSION_ENABLED, ADMISSION_LIMITS - JSON с переопределениями по группам:
+    {"bank": {"concurrency": 16, "queue": 32, "max_wait": 5}}
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT, ADMISSION_REJECTED
+
+logger = logging.getLogger("uvicorn")
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_LIMITS = {
+    "bank": {"concurrency": 32, "queue": 64, "max_wait": 10.0},
+    "export": {"concurrency": 4, "queue": 8, "max_wait": 5.0},
+    "local": {"concurrency": 256, "queue": 512, "max_wait": 2.0},
+}
+
+EXEMPT = "exempt"
+# (группа, методы или None для всех, шаблон пути). Первое совпадение определяет группу
+ROUTE_GROUPS = [
+    (EXEMPT, None, re.compile(r"^/(health|metrics|docs|redoc|openapi\.json)$")),
+    (EXEMPT, None, re.compile(r"^/(auth|static)/")),
+    (EXEMPT, None, re.compile(r"^/users/me$")),
+    ("bank", None, re.compile(r"^/users/\d+/banks/\d+/accounts/[^/]+/(transactions|turnover)$")),
+    ("bank", None, re.compile(r"^/users/\d+/turnover/?$")),
+    ("bank", None, re.compile(r"^/users/\d+/dashboard/?$")),
+    ("bank", {"POST"}, re.compile(r"^/users/\d+/accounts/\d+/refresh$")),
+    ("bank", {"POST", "DELETE"}, re.compile(r"^/users/\d+/connections(/\d+)?/?$")),
+    ("export", None, re.compile(r"^/users/\d+/export/?$")),
+]
+
+
+def _load_limits() -> Dict[str, Dict[str, float]]:
+    limits = {group: dict(values) for group, values in DEFAULT_LIMITS.items()}
+    raw = os.getenv("ADMISSION_LIMITS")
+    if not raw:
+        return limits
+    try:
+        overrides = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"ADMISSION_LIMITS is not valid JSON, ignoring: {e}")
+        return limits
+    for group, values in overrides.items():
+        limits.setdefault(group, dict(DEFAULT_LIMITS["local"])).update(values)
+    return limits
+
+
+def route_group(method: str, path: str) -> str:
+    if method == "OPTIONS":
+        return EXEMPT
+    for group, methods, pattern in ROUTE_GROUPS:
+        if (methods is None or method in methods) and pattern.match(path):
+            return group
+    return "local"
+
+
+class AdmissionGroup:
+    """Лимит одновременных запросов с ограниченной FIFO-очередью ожидания."""
+    def __init__(self, name: str, concurrency: int, queue: int, max_wait: float):
+        self.name = name
+        self.concurrency = max(int(concurrency), 1)
+        self.queue_limit = max(int(queue), 0)
+        self.max_wait = float(max_wait)
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    def _admit(self) -> None:
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight, group=self.name)
+
+    async def acquire(self) -> Optional[str]:
+        """Ждет места. Возвращает None, если запрос допущен, иначе причину отказа."""
+        if self.in_flight < self.concurrency and not self.waiters:
+            self._admit()
+            return None
+        if len(self.waiters) >= self.queue_limit:
+            ADMISSION_REJECTED.inc(group=self.name, reason="queue_full")
+            return "queue_full"
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiters.append(future)
+        ADMISSION_QUEUE_DEPTH.set(len(self.waiters), group=self.name)
+        start = time.monotonic()
+        # Не asyncio.wait_for: в Python 3.11 он теряет отмену, если место уже передано
+        timer = loop.call_later(self.max_wait, self._expire, future)
+        try:
+            rejection = await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.result() is None:
+                # Место уже передано нам - возвращаем его следующему
+                self.release()
+            else:
+                self._forget(future)
+            raise
+        finally:
+            timer.cancel()
+        if rejection is not None:
+            ADMISSION_REJECTED.inc(group=self.name, reason=rejection)
+            return rejection
+        ADMISSION_WAIT.observe(time.monotonic() - start, group=self.name)
+        return None
+
+    def _expire(self, future: asyncio.Future) -> None:
+        if not future.done():
+            self._forget(future)
+            future.set_result("timeout")
+
+    def _forget(self, future: asyncio.Future) -> None:
+        try:
+            self.waiters.remove(future)
+        except ValueError:
+            pass
+        ADMISSION_QUEUE_DEPTH.set(len(self.waiters), group=self.name)
+
+    def release(self) -> None:
+        # Место передается первому ожидающему без уменьшения счетчика
+        while self.waiters:
+            future = self.waiters.popleft()
+            ADMISSION_QUEUE_DEPTH.set(len(self.waiters), group=self.name)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self.in_flight, group=self.name)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "concurrency": self.concurrency,
+            "queue": self.queue_limit,
+        }
+
+
+GROUPS: Dict[str, AdmissionGroup] = {
+    name: AdmissionGroup(name, **values) for name, values in _load_limits().items()
+}
+
+
+def admission_snapshot() -> Dict[str, dict]:
+    return {name: group.snapshot() for name, group in GROUPS.items()}
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        group = GROUPS.get(route_group(scope["method"], scope["path"]))
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = await group.acquire()
+        if rejection is not None:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later."},
+                status_code=503,
+                headers={"Retry-After": str(group.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
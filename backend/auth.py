@@ -1,5 +1,5 @@
 # auth.py
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from jose import JWTError
@@ -11,7 +11,9 @@ from models import User
 from security import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash
 from schemas import UserLogin, Token, UserCreate,UserResponse, TokenWithUser
 from datetime import timedelta
+from typing import Optional
 from utils import log_request, logger
+from warmup import WARMUP_ON_LOGIN, start_warmup
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -38,6 +40,7 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
 @router.post("/login", response_model=TokenWithUser) # <-- ИЗМЕНЕНИЕ 1: используем новую модель
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
+    warm_up: Optional[bool] = Query(None, description="Прогреть данные банков в фоне (по умолчанию - WARMUP_ON_LOGIN)"),
     db: Session = Depends(get_db)
 ):
     email = form_data.username
@@ -55,6 +58,8 @@ async def login(
     access_token = create_access_token(
         data={"sub": user_obj.email}, expires_delta=access_token_expires
     )
+    if WARMUP_ON_LOGIN if warm_up is None else warm_up:
+        start_warmup(user_obj.id)
     # v-- ИЗМЕНЕНИЕ 2: добавляем user_id в ответ --v
     return {
         "access_token": access_token,
@@ -0,0 +1,250 @@
+# finance-app-master/balance_history.py
+import os
+import re
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+
+import models
+from currency import to_minor_units
+
+GRANULARITIES = ("day", "week", "month")
+# Максимум периодов в одном ряду истории (10 лет по дням)
+BALANCE_HISTORY_MAX_POINTS = int(os.getenv("BALANCE_HISTORY_MAX_POINTS", "3660"))
+
+# Границы колонок balance_snapshots и accounts: значение вне них сорвало бы коммит всего обновления
+BALANCE_TYPE_MAX_LENGTH = 32          # balance_type String(32)
+MAX_AMOUNT_MINOR = 2 ** 63 - 1        # amount_minor / *_balance_minor BigInteger
+CURRENCY_CODE = re.compile(r"^[A-Za-z]{3}$")  # currency String(3), код ISO 4217
+
+
+def parse_balance(balance: dict) -> Optional[Tuple[str, int, Optional[str]]]:
+    """
+    Достает из элемента balance_data тип, сумму со знаком (в минимальных единицах) и валюту.
+    Возвращает None для записей, которые не удалось разобрать.
+    """
+    if not isinstance(balance, dict):
+        return None
+    balance_type = balance.get("type")
+    amount = balance.get("amount")
+    if not isinstance(amount, dict):
+        return None
+    currency = amount.get("currency")
+    if not isinstance(balance_type, str) or not balance_type or len(balance_type) > BALANCE_TYPE_MAX_LENGTH:
+        return None
+    if currency is not None and not (isinstance(currency, str) and CURRENCY_CODE.match(currency)):
+        return None
+    if amount.get("amount") is None:
+        return None
+    try:
+        minor = to_minor_units(amount["amount"], currency)
+    except (ValueError, ArithmeticError):
+        return None
+    # Для валют с 3 знаками после запятой MAX_AMOUNT не помещается в BigInteger
+    if abs(minor) > MAX_AMOUNT_MINOR:
+        return None
+    if (balance.get("creditDebitIndicator") or "").lower() == "debit":
+        minor = -minor
+    return balance_type, minor, currency
+
+
+# Какие типы балансов считать текущим и доступным остатком (по убыванию приоритета)
+CURRENT_BALANCE_TYPES = ("InterimBooked", "ClosingBooked", "OpeningBooked")
+AVAILABLE_BALANCE_TYPES = ("InterimAvailable", "ClosingAvailable", "Expected", "ForwardAvailable")
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def extract_typed_balances(balances_list: Optional[list]) -> dict:
+    """
+    Значения для типизированных колонок счета (current/available в минимальных единицах,
+    валюта, момент актуальности) из списка balance_data.
+    """
+    parsed: Dict[str, Tuple[int, Optional[str], Optional[datetime]]] = {}
+    for balance in balances_list or []:
+        result = parse_balance(balance)
+        if result and result[0] not in parsed:
+            parsed[result[0]] = (result[1], result[2], _parse_datetime(balance.get("dateTime")))
+
+    def pick(types):
+        return next((parsed[t] for t in types if t in parsed), None)
+
+    current, available = pick(CURRENT_BALANCE_TYPES), pick(AVAILABLE_BALANCE_TYPES)
+    chosen = [value for value in (current, available) if value]
+    moments = [value[2] for value in chosen if value[2]]
+    return {
+        "current_balance_minor": current[0] if current else None,
+        "available_balance_minor": available[0] if available else None,
+        "balance_currency": chosen[0][1] if chosen else None,
+        "balance_as_of": max(moments) if moments else None,
+    }
+
+
+def latest_snapshots(db: Session, account_ids: Iterable[int]) -> Dict[Tuple[int, str], Tuple[int, Optional[str]]]:
+    """Последнее сохраненное значение по каждой паре (счет, тип баланса) - одним запросом."""
+    account_ids = list(account_ids)
+    if not account_ids:
+        return {}
+    snap = models.BalanceSnapshot
+    rows = db.execute(
+        select(snap.account_id, snap.balance_type, snap.amount_minor, snap.currency)
+        .where(snap.account_id.in_(account_ids))
+        .distinct(snap.account_id, snap.balance_type)
+        .order_by(snap.account_id, snap.balance_type, snap.captured_at.desc())
+    ).all()
+    return {(r.account_id, r.balance_type): (r.amount_minor, r.currency) for r in rows}
+
+
+def record_balance_snapshots(
+    db: Session,
+    balances_by_account: Dict[int, list],
+    captured_at: Optional[datetime] = None,
+) -> int:
+    """
+    Добавляет в сессию снимки балансов, значение которых изменилось с прошлого обновления.
+    Коммит остается за вызывающим кодом. Возвращает количество добавленных снимков.
+    """
+    captured_at = captured_at or datetime.now(timezone.utc)
+    previous = latest_snapshots(db, balances_by_account.keys())
+    new_snapshots = []
+    for account_id, balances_list in balances_by_account.items():
+        for balance in balances_list or []:
+            parsed = parse_balance(balance)
+            if not parsed:
+                continue
+            balance_type, minor, currency = parsed
+            if previous.get((account_id, balance_type)) == (minor, currency):
+                continue
+            # Защита от дублей одного типа внутри одного ответа банка
+            previous[(account_id, balance_type)] = (minor, currency)
+            new_snapshots.append(models.BalanceSnapshot(
+                account_id=account_id,
+                balance_type=balance_type,
+                amount_minor=minor,
+                currency=currency,
+                captured_at=captured_at,
+            ))
+    db.add_all(new_snapshots)
+    return len(new_snapshots)
+
+
+def truncate_to_bucket(moment: datetime, granularity: str) -> datetime:
+    """Python-аналог date_trunc для UTC-времени (неделя начинается с понедельника, как в Postgres)."""
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        return moment - timedelta(days=moment.weekday())
+    if granularity == "month":
+        return moment.replace(day=1)
+    return moment
+
+
+def next_bucket(moment: datetime, granularity: str) -> datetime:
+    if granularity == "week":
+        return moment + timedelta(days=7)
+    if granularity == "month":
+        return moment.replace(year=moment.year + 1, month=1) if moment.month == 12 else moment.replace(month=moment.month + 1)
+    return moment + timedelta(days=1)
+
+
+def bucket_count(start: datetime, end: datetime, granularity: str) -> int:
+    """Число периодов от start до end включительно (оба - начала периодов)."""
+    if end < start:
+        return 0
+    if granularity == "month":
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    days = (end - start).days
+    return days // 7 + 1 if granularity == "week" else days + 1
+
+
+def downsample_history(
+    db: Session,
+    account_id: int,
+    granularity: str,
+    from_dt: Optional[datetime] = None,
+    to_dt: Optional[datetime] = None,
+    balance_type: Optional[str] = None,
+) -> Dict[str, List[Tuple[datetime, int, Optional[str]]]]:
+    """
+    Возвращает ряды {тип баланса: [(начало периода, сумма, валюта), ...]}.
+    Последнее значение в каждом периоде выбирается в SQL (DISTINCT ON по date_trunc),
+    периоды без изменений заполняются предыдущим значением.
+    Ряд начинается не раньше первого снимка и заканчивается не позже текущего
+    момента; если периодов больше BALANCE_HISTORY_MAX_POINTS - ValueError.
+    """
+    snap = models.BalanceSnapshot
+    now = datetime.now(timezone.utc)
+    to_utc = (to_dt or now)
+    to_utc = to_utc.replace(tzinfo=timezone.utc) if to_utc.tzinfo is None else to_utc.astimezone(timezone.utc)
+    # Будущих снимков нет: ряд не продлевается дальше текущего момента
+    to_utc = min(to_utc, now)
+    from_utc = None
+    if from_dt:
+        from_utc = from_dt.replace(tzinfo=timezone.utc) if from_dt.tzinfo is None else from_dt.astimezone(timezone.utc)
+
+    bucket = func.date_trunc(granularity, func.timezone("UTC", snap.captured_at)).label("bucket")
+    query = (
+        select(snap.balance_type, bucket, snap.amount_minor, snap.currency)
+        .where(snap.account_id == account_id, snap.captured_at <= to_utc)
+        .distinct(snap.balance_type, bucket)
+        .order_by(snap.balance_type, bucket, snap.captured_at.desc())
+    )
+    if from_utc:
+        query = query.where(snap.captured_at >= from_utc)
+    if balance_type:
+        query = query.where(snap.balance_type == balance_type)
+    rows = db.execute(query).all()
+
+    # Значения, действовавшие на начало периода, чтобы ряд не начинался с пустоты
+    carried: Dict[str, Tuple[int, Optional[str]]] = {}
+    if from_utc:
+        prior = (
+            select(snap.balance_type, snap.amount_minor, snap.currency)
+            .where(snap.account_id == account_id, snap.captured_at < from_utc)
+            .distinct(snap.balance_type)
+            .order_by(snap.balance_type, snap.captured_at.desc())
+        )
+        if balance_type:
+            prior = prior.where(snap.balance_type == balance_type)
+        carried = {r.balance_type: (r.amount_minor, r.currency) for r in db.execute(prior).all()}
+
+    by_type: Dict[str, Dict[datetime, Tuple[int, Optional[str]]]] = {}
+    for r in rows:
+        by_type.setdefault(r.balance_type, {})[r.bucket] = (r.amount_minor, r.currency)
+    for type_name in carried:
+        by_type.setdefault(type_name, {})
+
+    end_bucket = truncate_to_bucket(to_utc.replace(tzinfo=None), granularity)
+    starts: Dict[str, datetime] = {}
+    for type_name, points in by_type.items():
+        if type_name in carried:
+            # Значение на начало периода известно - ряд начинается с from_dt
+            starts[type_name] = truncate_to_bucket(from_utc.replace(tzinfo=None), granularity)
+        else:
+            starts[type_name] = min(points)
+        if bucket_count(starts[type_name], end_bucket, granularity) > BALANCE_HISTORY_MAX_POINTS:
+            raise ValueError(
+                f"Requested range has more than {BALANCE_HISTORY_MAX_POINTS} {granularity} periods; "
+                f"narrow the range or use a coarser granularity."
+            )
+
+    series: Dict[str, List[Tuple[datetime, int, Optional[str]]]] = {}
+    for type_name, points in by_type.items():
+        current = starts[type_name]
+        last_value = carried.get(type_name)
+        result = []
+        while current <= end_bucket:
+            last_value = points.get(current, last_value)
+            if last_value is not None:
+                result.append((current.replace(tzinfo=timezone.utc), last_value[0], last_value[1]))
+            current = next_bucket(current, granularity)
+        series[type_name] = result
+    return series
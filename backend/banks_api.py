@@ -1,26 +1,38 @@
 # finance-app-master/banks_api.py
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
 from sqlalchemy.orm import Session
 import models
-from database import get_db
+from database import get_db, get_read_db
 from schemas import BankListResponse, BankResponse
-import shutil
-import os
-from typing import List
+from typing import List, Optional
 from starlette.requests import Request
 from deps import get_current_user, get_current_admin_user
+from icons import ICON_DIR, store_icon, pick_icon
 
 router = APIRouter(prefix="/banks", tags=["banks"])
 
-ICON_DIR = "static/icons"
-os.makedirs(ICON_DIR, exist_ok=True)
+
+def bank_to_response(bank: models.Bank, icon_base_url: str, icon_size: Optional[int] = None) -> dict:
+    """Банк для ответа API: с URL иконки подходящего размера и всех ее вариантов."""
+    icon_filename = pick_icon(bank.icon_filename, bank.icon_variants, icon_size)
+    return {
+        "id": bank.id,
+        "name": bank.name,
+        "base_url": bank.base_url,
+        "auto_approve": bank.auto_approve,
+        "icon_url": f"{icon_base_url}{icon_filename}" if icon_filename else None,
+        "icon_variants": {
+            size: f"{icon_base_url}{name}" for size, name in (bank.icon_variants or {}).items()
+        } or None,
+    }
+
 
 @router.post(
     "/{bank_id}/icon",
     summary="Загрузить иконку для банка (Только для администраторов)",
     tags=["banks"]
 )
-def upload_bank_icon(
+async def upload_bank_icon(
     bank_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -29,6 +41,7 @@ def upload_bank_icon(
     """
     Загружает файл иконки для указанного банка.
     Доступно только для администраторов.
+    Файл сохраняется под именем по хэшу содержимого, рядом готовятся уменьшенные копии.
     """
     bank = db.query(models.Bank).filter(models.Bank.id == bank_id).first()
     if not bank:
@@ -47,20 +60,21 @@ def upload_bank_icon(
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid file type, please upload an image.")
 
-    file_extension = os.path.splitext(file.filename)[1]
-    filename = f"{bank.name}{file_extension}"
-    file_path = os.path.join(ICON_DIR, filename)
-
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        stored = await store_icon(file)
     finally:
-        file.file.close()
+        await file.close()
 
+    filename = stored.pop("original")
     bank.icon_filename = filename
+    bank.icon_variants = stored or None
     db.commit()
 
-    return {"filename": filename, "path": f"/{file_path}"}
+    return {
+        "filename": filename,
+        "path": f"/{ICON_DIR}/{filename}",
+        "variants": {size: f"/{ICON_DIR}/{name}" for size, name in stored.items()}
+    }
 
 
 @router.get(
@@ -70,23 +84,16 @@ def upload_bank_icon(
 )
 def get_available_banks(
     request: Request,
-    db: Session = Depends(get_db),
+    icon_size: Optional[int] = Query(None, ge=1, description="Желаемый размер иконки в пикселях"),
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
     Возвращает список всех поддерживаемых банков.
     Доступно для любого авторизованного пользователя.
+    icon_url указывает на наименьшую готовую копию иконки не меньше icon_size.
     """
     banks_from_db = db.query(models.Bank).all()
-    
-    banks_with_urls = []
-    for bank in banks_from_db:
-        bank_data = bank.__dict__
-        if bank.icon_filename:
-            icon_url = f"{request.base_url}static/icons/{bank.icon_filename}"
-            bank_data['icon_url'] = icon_url
-        else:
-            bank_data['icon_url'] = None
-        banks_with_urls.append(bank_data)
-
-    return {"count": len(banks_with_urls), "banks": banks_with_urls}
\ No newline at end of file
+    icon_base_url = f"{request.base_url}{ICON_DIR}/"
+    banks_with_urls = [bank_to_response(bank, icon_base_url, icon_size) for bank in banks_from_db]
+    return {"count": len(banks_with_urls), "banks": banks_with_urls}
@@ -1,14 +1,13 @@
 # finance-app-master/connections_api.py
-import httpx
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 
 import models
-from database import get_db
+from database import get_db, get_read_db
 from deps import user_is_admin_or_self
-from utils import get_bank_token, fetch_accounts, revoke_bank_consent, log_response
+from utils import get_bank_token, fetch_accounts, revoke_bank_consent, bank_http_client
 
 router = APIRouter(
     prefix="/users/{user_id}/connections",
@@ -22,7 +21,7 @@ class ConnectionRequest(BaseModel):
 @router.get("/", summary="Получить список всех подключений пользователя")
 async def list_connections(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     bank_name: Optional[str] = None,
     bank_client_id: Optional[str] = None,
     current_user: models.User = Depends(user_is_admin_or_self)
@@ -56,8 +55,7 @@ async def initiate_connection(
     consent_url = f"{config.base_url}/account-consents/request"
     headers = {"Authorization": f"Bearer {bank_access_token}", "Content-Type": "application/json", "X-Requesting-Bank": config.client_id}
     consent_body = {"client_id": bank_client_id, "permissions": ["ReadAccountsDetail", "ReadBalances", "ReadTransactionsDetail"], "reason": f"Агрегация счетов для {bank_client_id}", "requesting_bank": "FinApp"}
-    async with httpx.AsyncClient() as client: response = await client.post(consent_url, headers=headers, json=consent_body)
-    log_response(response)
+    async with bank_http_client(bank_name, user_id=current_user.id) as client: response = await client.post(consent_url, headers=headers, json=consent_body)
     if response.status_code != 200: raise HTTPException(status_code=500, detail=f"Failed to create consent request: {response.text}")
     consent_data = response.json()
     if consent_data.get("auto_approved"):
@@ -93,15 +91,14 @@ async def check_consent_status(
     else:
         check_url = f"{config.base_url}/account-consents/{connection.consent_id}"
         headers = {"Authorization": f"Bearer {bank_access_token}", "x-fapi-interaction-id": config.client_id}
-    async with httpx.AsyncClient() as client: response = await client.get(check_url, headers=headers)
-    log_response(response)
+    async with bank_http_client(connection.bank_name, user_id=connection.user_id) as client: response = await client.get(check_url, headers=headers)
     if response.status_code != 200: raise HTTPException(status_code=500, detail=f"Failed to check consent status: {response.text}")
     consent_data = response.json().get("data", {})
     api_status = consent_data.get("status", "unknown").lower()
     if api_status == "authorized":
         if connection.status == "awaitingauthorization": connection.consent_id = consent_data['consentId']
         connection.status = "active"; db.commit()
-        accounts_data = await fetch_accounts(bank_access_token, connection.consent_id, connection.bank_client_id, config)
+        accounts_data = await fetch_accounts(bank_access_token, connection.consent_id, connection.bank_client_id, config, user_id=connection.user_id)
         try:
             name = accounts_data.get("data", {}).get("account", [{}])[0].get("account", [{}])[0].get("name")
             if name and connection.full_name != name: connection.full_name = name; db.commit()
@@ -0,0 +1,120 @@
+# finance-app-master/currency.py
+import os
+import json
+import logging
+from abc import ABC, abstractmethod
+from decimal import Decimal, ROUND_HALF_EVEN, InvalidOperation
+from typing import Dict, Optional
+
+logger = logging.getLogger("uvicorn")
+
+# Количество знаков после запятой для валют по ISO 4217.
+# Для всех валют, которых нет в таблице, используется 2.
+CURRENCY_EXPONENTS: Dict[str, int] = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0,
+    "KRW": 0, "PYG": 0, "RWF": 0, "UGX": 0, "UYI": 0, "VND": 0, "VUV": 0,
+    "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+DEFAULT_EXPONENT = 2
+# Суммы по модулю не больше, чем вмещает transactions.amount (Numeric(20, 4)):
+# большие значения банк прислать не может, а их суммы теряют точность Decimal
+MAX_AMOUNT = Decimal(10) ** 16
+
+
+def currency_exponent(currency: Optional[str]) -> int:
+    return CURRENCY_EXPONENTS.get((currency or "").upper(), DEFAULT_EXPONENT)
+
+
+def parse_amount(amount) -> Decimal:
+    """Сумма из API банка как Decimal. ValueError - не число, NaN/Infinity или вне MAX_AMOUNT."""
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount!r}")
+    if not value.is_finite() or abs(value) >= MAX_AMOUNT:
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return value
+
+
+def to_minor_units(amount, currency: Optional[str]) -> int:
+    """
+    Переводит сумму (строку из API банка или Decimal) в целое число минимальных единиц валюты.
+    Дробные остатки меньше минимальной единицы округляются по банковскому правилу.
+    """
+    value = parse_amount(amount)
+    return int(value.scaleb(currency_exponent(currency)).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_minor_units(minor: int, currency: Optional[str]) -> Decimal:
+    exponent = currency_exponent(currency)
+    return Decimal(minor).scaleb(-exponent).quantize(Decimal(1).scaleb(-exponent))
+
+
+class RateTable(ABC):
+    """
+    Базовый интерфейс таблицы курсов. Реализация должна вернуть курс,
+    по которому 1 единица `source` превращается в `target`, или None, если курс неизвестен.
+    """
+    @abstractmethod
+    def get_rate(self, source: str, target: str) -> Optional[Decimal]:
+        ...
+
+    def convert_minor(self, minor: int, source: str, target: str) -> Optional[int]:
+        source, target = source.upper(), target.upper()
+        if source == target:
+            return minor
+        rate = self.get_rate(source, target)
+        if rate is None:
+            return None
+        shift = currency_exponent(target) - currency_exponent(source)
+        converted = (Decimal(minor) * rate).scaleb(shift)
+        return int(converted.to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+class StaticRateTable(RateTable):
+    """
+    Локальная таблица курсов относительно одной опорной валюты:
+    {"RUB": "1", "USD": "92.50"} означает 1 USD = 92.50 RUB.
+    """
+    def __init__(self, rates: Dict[str, object]):
+        self.rates: Dict[str, Decimal] = {code.upper(): Decimal(str(rate)) for code, rate in rates.items()}
+
+    def get_rate(self, source: str, target: str) -> Optional[Decimal]:
+        source_rate = self.rates.get(source.upper())
+        target_rate = self.rates.get(target.upper())
+        if not source_rate or not target_rate:
+            return None
+        return source_rate / target_rate
+
+
+def load_rate_table_from_env() -> StaticRateTable:
+    """
+    Загружает курсы из CURRENCY_RATES (JSON-строка) или из файла CURRENCY_RATES_FILE.
+    Если ничего не задано, таблица пустая и конвертация недоступна.
+    """
+    raw = os.getenv("CURRENCY_RATES")
+    path = os.getenv("CURRENCY_RATES_FILE")
+    try:
+        if raw:
+            return StaticRateTable(json.loads(raw))
+        if path:
+            with open(path, encoding="utf-8") as f:
+                return StaticRateTable(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load currency rates: {e}")
+    return StaticRateTable({})
+
+
+_rate_table: RateTable = load_rate_table_from_env()
+
+
+def set_rate_table(table: RateTable) -> None:
+    """Подменяет таблицу курсов (например, на реализацию с внешним источником)."""
+    global _rate_table
+    _rate_table = table
+
+
+def get_rate_table() -> RateTable:
+    """Зависимость FastAPI, возвращающая текущую таблицу курсов."""
+    return _rate_table
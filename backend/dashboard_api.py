@@ -0,0 +1,256 @@
+# finance-app-master/dashboard_api.py
+"""
+Данные главного экрана одним запросом: каталог банков, подключения, счета,
+последние транзакции и обороты по каждому счету.
+
+Чтение из БД идет в пуле потоков (у каждого раздела своя сессия), запросы
+в банки - параллельно по всем счетам. У каждого раздела свой таймаут: раздел,
+не уложившийся в него, возвращается как null со статусом timeout, а из банков
+отдаются счета, успевшие ответить (статус partial). Пользователь
+аутентифицируется один раз на весь экран.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+import models
+from banks_api import bank_to_response
+from database import SessionLocal, get_db, open_read_session
+from deps import user_is_admin_or_self
+from icons import ICON_DIR
+from schemas import (
+    DashboardAccount, DashboardConnection, DashboardResponse, DashboardSectionError,
+    StoredTransaction, TransactionDetail
+)
+from transaction_store import store_transactions
+from transactions_api import _get_all_transactions_for_period
+from turnover_api import TurnoverBucket, accumulate_turnover, _bucket_to_schema
+from utils import get_bank_token
+
+logger = logging.getLogger("uvicorn")
+
+DASHBOARD_DB_TIMEOUT = float(os.getenv("DASHBOARD_DB_TIMEOUT", "3"))
+DASHBOARD_BANK_TIMEOUT = float(os.getenv("DASHBOARD_BANK_TIMEOUT", "8"))
+
+router = APIRouter(
+    prefix="/users/{user_id}/dashboard",
+    tags=["dashboard"]
+)
+
+
+def _load_banks(user_id: int, icon_base_url: str, icon_size: Optional[int]) -> List[dict]:
+    db = open_read_session(user_id)
+    try:
+        return [bank_to_response(bank, icon_base_url, icon_size) for bank in db.query(models.Bank).all()]
+    finally:
+        db.close()
+
+
+def _load_user_accounts(user_id: int) -> Tuple[List[models.ConnectedBank], List[Tuple[models.ConnectedBank, models.Account]], Dict[str, models.Bank]]:
+    """
+    Подключения, пары (подключение, счет) и конфиги банков. Счета загружаются сразу,
+    чтобы объекты можно было читать после закрытия сессии.
+    """
+    db = open_read_session(user_id)
+    try:
+        connections = (
+            db.query(models.ConnectedBank)
+            .options(joinedload(models.ConnectedBank.accounts))
+            .filter(models.ConnectedBank.user_id == user_id)
+            .all()
+        )
+        accounts = [(conn, account) for conn in connections for account in conn.accounts]
+        bank_names = {conn.bank_name for conn in connections}
+        bank_configs = {
+            bank.name: bank for bank in db.query(models.Bank).filter(models.Bank.name.in_(bank_names)).all()
+        }
+        return connections, accounts, bank_configs
+    finally:
+        db.close()
+
+
+def _to_stored(account_id: int, transaction: TransactionDetail) -> StoredTransaction:
+    return StoredTransaction(
+        account_id=account_id,
+        transactionId=transaction.transactionId,
+        amount=transaction.amount,
+        creditDebitIndicator=transaction.creditDebitIndicator,
+        status=transaction.status,
+        bookingDateTime=transaction.bookingDateTime,
+        valueDateTime=transaction.valueDateTime,
+        transactionInformation=transaction.transactionInformation,
+        bankTransactionCode=transaction.bankTransactionCode.code if transaction.bankTransactionCode else None,
+    )
+
+
+async def _fetch_account_activity(
+    db: Session,
+    connection: models.ConnectedBank,
+    account: models.Account,
+    bank_config: models.Bank,
+    from_dt: datetime,
+) -> List[TransactionDetail]:
+    token = await get_bank_token(connection.bank_name, db)
+    return await _get_all_transactions_for_period(
+        bank_access_token=token,
+        bank_config=bank_config,
+        connection=connection,
+        api_account_id=account.api_account_id,
+        from_dt=from_dt,
+        to_dt=None,
+    )
+
+
+def _persist_activity(user_id: int, fetched: Dict[int, List[TransactionDetail]]) -> None:
+    """Сохраняет полученные транзакции после отправки ответа (для поиска и выгрузки)."""
+    db = SessionLocal()
+    db.info["user_id"] = user_id
+    try:
+        for account_id, transactions in fetched.items():
+            store_transactions(db, account_id, user_id, transactions)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.warning(f"Failed to store dashboard transactions for user {user_id}: {e}")
+    finally:
+        db.close()
+
+
+@router.get("/", response_model=DashboardResponse, summary="Данные главного экрана одним запросом")
+async def get_dashboard(
+    user_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    days: int = Query(30, ge=1, le=366, description="Период для оборотов и последних транзакций, дней"),
+    transactions_limit: int = Query(5, ge=0, le=50, description="Сколько последних транзакций вернуть по каждому счету"),
+    icon_size: Optional[int] = Query(None, ge=1, description="Желаемый размер иконки банка в пикселях"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Собирает данные главного экрана. Поле sections содержит статус каждого раздела
+    (banks, accounts, activity): ok, partial, timeout или error. Если раздел не
+    получен, соответствующее поле равно null, а причина есть в errors.
+    """
+    sections: Dict[str, str] = {}
+    errors: List[DashboardSectionError] = []
+    from_dt = datetime.now(timezone.utc) - timedelta(days=days)
+    icon_base_url = f"{request.base_url}{ICON_DIR}/"
+
+    async def run_section(name: str, awaitable, timeout: float):
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=timeout)
+            sections[name] = "ok"
+            return result
+        except asyncio.TimeoutError:
+            sections[name] = "timeout"
+            errors.append(DashboardSectionError(section=name, detail=f"No response within {timeout:g} s."))
+        except (HTTPException, SQLAlchemyError) as e:
+            sections[name] = "error"
+            detail = e.detail if isinstance(e, HTTPException) else "Database error."
+            errors.append(DashboardSectionError(section=name, detail=str(detail)))
+            logger.warning(f"Dashboard section {name} failed for user {user_id}: {e}")
+        return None
+
+    # Каталог банков не зависит от остальных разделов и читается параллельно с ними
+    banks_task = asyncio.create_task(run_section(
+        "banks", run_in_threadpool(_load_banks, user_id, icon_base_url, icon_size), DASHBOARD_DB_TIMEOUT
+    ))
+    loaded = await run_section("accounts", run_in_threadpool(_load_user_accounts, user_id), DASHBOARD_DB_TIMEOUT)
+
+    connections_out: Optional[List[DashboardConnection]] = None
+    accounts_out: Optional[List[DashboardAccount]] = None
+    if loaded is not None:
+        connections, accounts, bank_configs = loaded
+        connections_out = [DashboardConnection.model_validate(conn) for conn in connections]
+        accounts_out = []
+        account_tasks: Dict[asyncio.Task, DashboardAccount] = {}
+        for conn, account in accounts:
+            item = DashboardAccount(
+                id=account.id,
+                connection_id=account.connection_id,
+                bank_name=conn.bank_name,
+                api_account_id=account.api_account_id,
+                nickname=account.nickname,
+                account_type=account.account_type,
+                currency=account.currency,
+                status=account.status,
+                current_balance_minor=account.current_balance_minor,
+                available_balance_minor=account.available_balance_minor,
+                balance_currency=account.balance_currency,
+                balance_as_of=account.balance_as_of,
+                sync_status=account.sync_status,
+                last_synced_at=account.last_synced_at,
+            )
+            accounts_out.append(item)
+            bank_config = bank_configs.get(conn.bank_name)
+            if conn.status != "active" or not conn.consent_id or bank_config is None:
+                continue
+            task = asyncio.create_task(_fetch_account_activity(db, conn, account, bank_config, from_dt))
+            account_tasks[task] = item
+
+        if account_tasks:
+            # Общий срок на все банки: что успело прийти - отдаем, остальное отменяем
+            done, pending = await asyncio.wait(account_tasks, timeout=DASHBOARD_BANK_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            fetched: Dict[int, List[TransactionDetail]] = {}
+            for task, item in account_tasks.items():
+                if task in pending:
+                    errors.append(DashboardSectionError(
+                        section="activity", account_id=item.id,
+                        detail=f"No response within {DASHBOARD_BANK_TIMEOUT:g} s.",
+                    ))
+                    continue
+                error = task.exception()
+                if error is not None:
+                    detail = error.detail if isinstance(error, HTTPException) else str(error)
+                    errors.append(DashboardSectionError(section="activity", account_id=item.id, detail=str(detail)))
+                    continue
+                transactions = task.result()
+                buckets: Dict[str, TurnoverBucket] = {}
+                try:
+                    accumulate_turnover(transactions, buckets, fallback_currency=item.currency)
+                    turnover = [_bucket_to_schema(currency, buckets[currency]) for currency in sorted(buckets)]
+                except (ValueError, ArithmeticError) as e:
+                    # Некорректная сумма из банка портит только этот счет, а не весь ответ
+                    errors.append(DashboardSectionError(
+                        section="activity", account_id=item.id, detail=f"Invalid transaction amount: {e}",
+                    ))
+                    continue
+                fetched[item.id] = transactions
+                item.turnover = turnover
+                latest = sorted(transactions, key=lambda t: t.bookingDateTime, reverse=True)[:transactions_limit]
+                item.recent_transactions = [_to_stored(item.id, t) for t in latest]
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            if len(fetched) == len(account_tasks):
+                sections["activity"] = "ok"
+            else:
+                sections["activity"] = "partial" if fetched else ("timeout" if len(pending) == len(account_tasks) else "error")
+            if fetched:
+                background_tasks.add_task(_persist_activity, user_id, fetched)
+        else:
+            sections["activity"] = "ok"
+
+    else:
+        # Без списка счетов нечего запрашивать у банков
+        sections["activity"] = sections["accounts"]
+
+    banks = await banks_task
+    return DashboardResponse(
+        sections=sections,
+        banks=banks,
+        connections=connections_out,
+        accounts=accounts_out,
+        errors=errors,
+        period_from=from_dt,
+    )
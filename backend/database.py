@@ -1,22 +1,176 @@
 # database.py
+import logging
 import os
+import threading
+import time
+from typing import Dict, Optional
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from metrics import DB_POOL_CHECKOUT_WAIT, REPLICA_LAG, DB_READ_ROUTE
 
 load_dotenv()
 
+logger = logging.getLogger("uvicorn")
+
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Реплика только для чтения. Если не задана, чтение идет в основную БД
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+# При большем отставании реплики чтение переключается на основную БД
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "1"))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, который измеряет время ожидания свободного соединения."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
 
-engine = create_engine(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool)
+replica_engine = (
+    create_engine(REPLICA_DATABASE_URL, poolclass=InstrumentedQueuePool)
+    if REPLICA_DATABASE_URL else engine
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сессии только для чтения: на реплике и (при отставании реплики) на основной БД
+ReadSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=replica_engine.execution_options(postgresql_readonly=True)
+)
+PrimaryReadSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine.execution_options(postgresql_readonly=True)
+)
 Base = declarative_base()
 
+
+# --- Read-your-writes ---
+# user_id -> время (time.time()) последнего коммита с изменениями данных пользователя.
+# Хранится в процессе: при нескольких воркерах гарантия действует в пределах воркера.
+_recent_writes: Dict[int, float] = {}
+_recent_writes_lock = threading.Lock()
+
+
+def mark_user_write(user_id: Optional[int]) -> None:
+    """Отмечает, что данные пользователя только что изменились (для фоновых задач без запроса)."""
+    if user_id is None:
+        return
+    with _recent_writes_lock:
+        _recent_writes[user_id] = time.time()
+        # Старые отметки больше не влияют на маршрутизацию
+        if len(_recent_writes) > 10000:
+            horizon = time.time() - REPLICA_MAX_LAG_SECONDS * 2
+            for key in [k for k, v in _recent_writes.items() if v < horizon]:
+                del _recent_writes[key]
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _remember_write(session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_user_write(session):
+    if session.info.pop("has_writes", False):
+        mark_user_write(session.info.get("user_id"))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_write(session):
+    session.info.pop("has_writes", None)
+
+
+_lag_lock = threading.Lock()
+_lag_checked_at = 0.0
+_lag_seconds: Optional[float] = None
+
+_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def replica_lag_seconds() -> Optional[float]:
+    """
+    Отставание реплики в секундах (кэшируется на REPLICA_LAG_CHECK_INTERVAL).
+    0 - реплика догнала основную БД, None - проверить не удалось.
+    """
+    global _lag_checked_at, _lag_seconds
+    if replica_engine is engine:
+        return 0.0
+    now = time.monotonic()
+    if now - _lag_checked_at < REPLICA_LAG_CHECK_INTERVAL:
+        return _lag_seconds
+    with _lag_lock:
+        if now - _lag_checked_at < REPLICA_LAG_CHECK_INTERVAL:
+            return _lag_seconds
+        try:
+            with replica_engine.connect() as conn:
+                value = conn.execute(_LAG_QUERY).scalar()
+            # NULL - это не реплика (например, при локальной проверке на одной БД)
+            _lag_seconds = max(0.0, float(value)) if value is not None else 0.0
+        except Exception as e:
+            logger.warning(f"Replica lag check failed: {e}")
+            _lag_seconds = None
+        _lag_checked_at = now
+        if _lag_seconds is not None:
+            REPLICA_LAG.set(_lag_seconds)
+        return _lag_seconds
+
+
+def should_read_from_primary(user_id: Optional[int]) -> bool:
+    """
+    Читаем с основной БД, если реплика недоступна или сильно отстает, либо если
+    пользователь изменил данные позже, чем реплика успела их применить (с запасом в 1 с).
+    """
+    if replica_engine is engine:
+        return True
+    lag = replica_lag_seconds()
+    if lag is None or lag > REPLICA_MAX_LAG_SECONDS:
+        return True
+    if user_id is None:
+        return False
+    last_write = _recent_writes.get(user_id)
+    return last_write is not None and time.time() - last_write < lag + 1.0
+
+
+def _path_user_id(request: Request) -> Optional[int]:
+    try:
+        return int(request.path_params["user_id"])
+    except (KeyError, ValueError):
+        return None
+
+
 # Функция для получения сессии БД
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
+    # Чьи данные меняет запрос - для read-your-writes при чтении с реплики
+    db.info["user_id"] = _path_user_id(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def open_read_session(user_id: Optional[int]) -> Session:
+    """Сессия только для чтения: реплика, если она успевает за основной БД, иначе основная БД."""
+    primary = should_read_from_primary(user_id)
+    DB_READ_ROUTE.inc(target="primary" if primary else "replica")
+    return (PrimaryReadSessionLocal if primary else ReadSessionLocal)()
+
+
+def get_read_db(request: Request):
+    """Зависимость FastAPI с сессией из open_read_session."""
+    db = open_read_session(_path_user_id(request))
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
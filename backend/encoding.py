@@ -0,0 +1,226 @@
+# finance-app-master/encoding.py
+"""
+Сжатие ответов и выбор формата тела по заголовкам запроса.
+
+CompressionMiddleware сжимает ответы текстовых и JSON-типов алгоритмом из
+Accept-Encoding: zstd и br, если установлены zstandard / brotli, иначе gzip.
+Ответы меньше COMPRESSION_MIN_SIZE отдаются как есть, без затрат на сжатие.
+Потоковые ответы (StreamingResponse) сжимаются по частям: каждая часть сразу
+уходит клиенту, ответ целиком не буферизуется.
+
+encoded_response() отдает модель в MessagePack, если клиент предпочитает его
+в Accept (и установлен msgpack), иначе в JSON.
+"""
+import os
+import zlib
+from typing import Dict, Optional
+
+import anyio
+from fastapi import Request, Response
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard - необязательная зависимость
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:  # без msgpack ответы всегда в JSON
+    msgpack = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+# Части больше этого размера сжимаются в пуле потоков, чтобы не занимать event loop
+COMPRESSION_THREAD_THRESHOLD = int(os.getenv("COMPRESSION_THREAD_THRESHOLD", str(256 * 1024)))
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/msgpack",
+    "application/xml", "application/javascript", "image/svg+xml",
+)
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def parse_qvalues(header: str) -> Dict[str, float]:
+    """'gzip, br;q=0.8' -> {'gzip': 1.0, 'br': 0.8}. Некорректный q считается нулем."""
+    values: Dict[str, float] = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        values[name] = max(q, values.get(name, 0.0))
+    return values
+
+
+def available_encodings() -> tuple:
+    """Поддерживаемые алгоритмы в порядке предпочтения сервера."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return tuple(encodings)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Алгоритм с наибольшим q из Accept-Encoding; при равенстве - по предпочтению сервера."""
+    qvalues = parse_qvalues(accept_encoding)
+    default_q = qvalues.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = qvalues.get(encoding, default_q)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Сжимает часть потока и сбрасывает буфер, чтобы клиент мог ее сразу распаковать."""
+        if self.encoding == "zstd":
+            return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.flush()
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "zstd":
+            return self._obj.compress(data) + self._obj.flush()
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.finish()
+        return self._obj.compress(data) + self._obj.flush()
+
+
+async def _run(func, data: bytes) -> bytes:
+    if len(data) >= COMPRESSION_THREAD_THRESHOLD:
+        return await anyio.to_thread.run_sync(func, data)
+    return func(data)
+
+
+class _CompressingSender:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+            if compressible:
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+            content_length = headers.get("content-length")
+            if (
+                not compressible
+                or "content-encoding" in headers
+                or message["status"] in (204, 304)
+                or (content_length is not None and int(content_length) < self.minimum_size)
+            ):
+                self.passthrough = True
+                await self.send(message)
+            else:
+                # Заголовки отправим, когда станет ясно, будем ли сжимать
+                self.start_message = message
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding)
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            del headers["Content-Length"]
+            if not more_body:
+                compressed = await _run(self.compressor.finish, body)
+                headers["Content-Length"] = str(len(compressed))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            await self.send(self.start_message)
+
+        if more_body:
+            compressed = await _run(self.compressor.chunk, body)
+        else:
+            compressed = await _run(self.compressor.finish, body)
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, encoding, self.minimum_size))
+
+
+def wants_msgpack(accept: str) -> bool:
+    """Клиент явно указал MessagePack в Accept и предпочитает его JSON."""
+    if msgpack is None:
+        return False
+    qvalues = parse_qvalues(accept)
+    msgpack_q = max(qvalues.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    json_q = qvalues.get("application/json", 0.0)
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+
+def encoded_response(request: Request, payload: BaseModel) -> Response:
+    """Ответ с моделью в MessagePack или JSON - в зависимости от заголовка Accept."""
+    headers = {"Vary": "Accept"}
+    if wants_msgpack(request.headers.get("accept", "")):
+        content = msgpack.packb(payload.model_dump(mode="json", by_alias=True))
+        return Response(content=content, media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+    return Response(content=payload.model_dump_json(by_alias=True), media_type="application/json", headers=headers)
+
+
+# Описание альтернативного формата для OpenAPI
+MSGPACK_RESPONSES = {200: {"content": {MSGPACK_MEDIA_TYPE: {}}}}
@@ -0,0 +1,232 @@
+# finance-app-master/events.py
+"""
+Push-уведомления клиентам об изменениях счетов (WebSocket, см. events_api).
+
+Событие регистрируется в сессии БД через publish() и уходит подписчикам только
+после коммита этой сессии. При EVENTS_BACKEND=postgres события идут через
+NOTIFY в той же транзакции, и каждый воркер получает их через LISTEN. Так
+подписчик получит событие, на каком бы воркере ни произошло обновление.
+EVENTS_BACKEND=memory раздает события только внутри процесса.
+
+У каждого подключения своя ограниченная очередь. Если клиент не успевает читать,
+очередь очищается и ему отправляется одно событие resync: клиенту нужно
+перечитать данные целиком, а сервер не копит память на медленных клиентов.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from metrics import REGISTRY, Counter, Gauge
+
+logger = logging.getLogger("uvicorn")
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "postgres").lower()
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_CHANNEL = "finapp_events"
+# NOTIFY ограничивает payload 8000 байтами
+NOTIFY_MAX_PAYLOAD = 7900
+
+EVENTS_CONNECTIONS = REGISTRY.register(Gauge(
+    "finapp_events_connections", "Open push (WebSocket) connections.",
+))
+EVENTS_DELIVERED = REGISTRY.register(Counter(
+    "finapp_events_delivered_total", "Events queued for push connections.",
+))
+EVENTS_OVERFLOWS = REGISTRY.register(Counter(
+    "finapp_events_overflows_total", "Push connection queues that overflowed and were replaced by a resync event.",
+))
+
+RESYNC_EVENT = {"type": "resync"}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_event(payload: dict) -> str:
+    return json.dumps(payload, default=_json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+class Subscriber:
+    __slots__ = ("user_id", "queue")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+    def offer(self, message: str) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(encode_event(RESYNC_EVENT))
+            EVENTS_OVERFLOWS.inc()
+
+
+class EventHub:
+    """Подписчики процесса по пользователям. Все методы, кроме dispatch_threadsafe, - из потока event loop."""
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        EVENTS_CONNECTIONS.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers and subscriber in subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+            EVENTS_CONNECTIONS.dec()
+
+    def dispatch(self, user_id: int, message: str) -> None:
+        for subscriber in self._subscribers.get(user_id, ()):
+            subscriber.offer(message)
+            EVENTS_DELIVERED.inc()
+
+    def dispatch_threadsafe(self, user_id: int, message: str) -> None:
+        loop = self._loop
+        if loop is None or user_id not in self._subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.dispatch(user_id, message)
+        else:
+            loop.call_soon_threadsafe(self.dispatch, user_id, message)
+
+
+HUB = EventHub()
+
+
+def publish(db: Session, user_id: int, payload: dict) -> None:
+    """Регистрирует событие для пользователя. Уйдет подписчикам после коммита сессии db."""
+    db.info.setdefault("pending_events", []).append((user_id, payload))
+
+
+def _notify_payload(user_id: int, payload: dict) -> str:
+    message = encode_event({"u": user_id, "e": payload})
+    if len(message.encode("utf-8")) > NOTIFY_MAX_PAYLOAD:
+        # Слишком большое событие заменяем подсказкой перечитать данные
+        message = encode_event({"u": user_id, "e": {**RESYNC_EVENT, "reason": payload.get("type")}})
+    return message
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def _send_notifications(session):
+    if EVENTS_BACKEND != "postgres":
+        return
+    for user_id, payload in session.info.pop("pending_events", []):
+        # NOTIFY в той же транзакции доставляется только при успешном коммите
+        session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                        {"channel": EVENTS_CHANNEL, "payload": _notify_payload(user_id, payload)})
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _dispatch_local(session):
+    for user_id, payload in session.info.pop("pending_events", []):
+        HUB.dispatch_threadsafe(user_id, encode_event(payload))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _drop_pending(session):
+    session.info.pop("pending_events", None)
+
+
+# --- LISTEN для EVENTS_BACKEND=postgres ---
+_listener_thread: Optional[threading.Thread] = None
+_listener_stop = threading.Event()
+
+
+def _listen_forever() -> None:
+    while not _listener_stop.is_set():
+        connection = None
+        try:
+            connection = engine.raw_connection()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+            while not _listener_stop.is_set():
+                if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    try:
+                        data = json.loads(notification.payload)
+                        HUB.dispatch_threadsafe(int(data["u"]), encode_event(data["e"]))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"Malformed event notification: {e}")
+        except Exception as e:
+            logger.error(f"Event listener error, reconnecting: {e}")
+            _listener_stop.wait(2.0)
+        finally:
+            if connection is not None:
+                try:
+                    connection.invalidate()
+                except Exception:
+                    pass
+
+
+def start_event_listener() -> None:
+    """Запускает поток LISTEN (только для EVENTS_BACKEND=postgres)."""
+    global _listener_thread
+    if EVENTS_BACKEND != "postgres" or _listener_thread is not None:
+        return
+    _listener_stop.clear()
+    _listener_thread = threading.Thread(target=_listen_forever, name="event-listener", daemon=True)
+    _listener_thread.start()
+
+
+def stop_event_listener() -> None:
+    global _listener_thread
+    if _listener_thread is not None:
+        _listener_stop.set()
+        _listener_thread.join(timeout=5)
+        _listener_thread = None
+
+
+def account_delta(account) -> dict:
+    """Компактное описание изменившегося счета для push-события."""
+    return {
+        "id": account.id,
+        "sync_status": account.sync_status,
+        "current_balance_minor": account.current_balance_minor,
+        "available_balance_minor": account.available_balance_minor,
+        "balance_currency": account.balance_currency,
+        "balance_as_of": account.balance_as_of,
+    }
+
+
+def publish_sync_result(db: Session, connection, accounts: List) -> None:
+    """Событие о завершении синхронизации подключения со списком изменившихся счетов."""
+    publish(db, connection.user_id, {
+        "type": "sync",
+        "connection_id": connection.id,
+        "sync_status": connection.sync_status,
+        "last_synced_at": connection.last_synced_at,
+        "accounts": [account_delta(account) for account in accounts],
+    })
@@ -0,0 +1,111 @@
+# finance-app-master/events_api.py
+"""
+WebSocket-канал событий пользователя: /users/{user_id}/events.
+
+Браузерный WebSocket не умеет отправлять заголовки, поэтому токен передается
+в списке подпротоколов: new WebSocket(url, ["bearer", token]) - сервер принимает
+соединение с подпротоколом "bearer". Другие клиенты могут прислать заголовок
+Authorization: Bearer. Query-параметр token оставлен для старых клиентов: URL
+попадает в журналы доступа, поэтому значение в них маскируется (см.
+outbound_logging.install_access_log_redaction). Сервер присылает JSON-сообщения:
+* {"type": "sync", "connection_id", "sync_status", "last_synced_at", "accounts": [...]}
+  после обновления подключения, accounts - только изменившиеся счета;
+* {"type": "resync"} - часть событий потеряна, нужно перечитать счета целиком;
+* {"type": "ping"} - раз в EVENTS_PING_SECONDS, если других событий не было.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from deps import get_current_user
+from events import HUB, encode_event
+
+logger = logging.getLogger("uvicorn")
+
+EVENTS_PING_SECONDS = float(os.getenv("EVENTS_PING_SECONDS", "30"))
+
+PING_MESSAGE = encode_event({"type": "ping"})
+
+# Подпротокол, за которым в Sec-WebSocket-Protocol следует JWT
+BEARER_SUBPROTOCOL = "bearer"
+
+router = APIRouter(
+    prefix="/users/{user_id}/events",
+    tags=["events"]
+)
+
+
+def _authorize(token: str, user_id: int) -> bool:
+    """Те же проверки, что и у user_is_admin_or_self. Сессия БД закрывается сразу после проверки."""
+    db = SessionLocal()
+    try:
+        user = get_current_user(db=db, token=token)
+        return user.is_admin or user.id == user_id
+    except HTTPException:
+        return False
+    finally:
+        db.close()
+
+
+def _token_from(websocket: WebSocket, token: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(токен, подпротокол для ответа). Подпротокол возвращается, только если токен пришел в нем."""
+    subprotocols = websocket.scope.get("subprotocols") or []
+    if BEARER_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(BEARER_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], BEARER_SUBPROTOCOL
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip(), None
+    return token, None
+
+
+async def _drain_incoming(websocket: WebSocket) -> None:
+    """Читает входящие сообщения (клиенту писать нечего), чтобы вовремя заметить закрытие."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def _send_events(websocket: WebSocket, queue: asyncio.Queue) -> None:
+    while True:
+        try:
+            message = await asyncio.wait_for(queue.get(), timeout=EVENTS_PING_SECONDS)
+        except asyncio.TimeoutError:
+            message = PING_MESSAGE
+        await websocket.send_text(message)
+
+
+@router.websocket("")
+async def user_events(websocket: WebSocket, user_id: int, token: Optional[str] = None):
+    token, subprotocol = _token_from(websocket, token)
+    if not token or not await run_in_threadpool(_authorize, token, user_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Токен из подпротоколов назад не отправляется, подтверждается только "bearer"
+    await websocket.accept(subprotocol=subprotocol)
+    subscriber = HUB.subscribe(user_id)
+    tasks = [
+        asyncio.create_task(_drain_incoming(websocket)),
+        asyncio.create_task(_send_events(websocket, subscriber.queue)),
+    ]
+    try:
+        # Соединение живет, пока клиент не закроет его или отправка не упадет
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, (WebSocketDisconnect, RuntimeError, OSError)):
+                logger.warning(f"Event stream for user {user_id} failed: {error}")
+    finally:
+        # Отписываемся до await: при отмене обработчика await в finally тоже может быть прерван
+        HUB.unsubscribe(subscriber)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
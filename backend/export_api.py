@@ -0,0 +1,228 @@
+# finance-app-master/export_api.py
+"""
+Выгрузка данных пользователя (счета, снимки балансов, транзакции) в CSV или Parquet.
+
+Данные читаются серверным курсором порциями по EXPORT_BATCH_SIZE строк и сразу
+отдаются клиенту по частям, поэтому память не зависит от объема выгрузки.
+Генератор ответа синхронный: StreamingResponse выполняет его в пуле потоков,
+и кодирование не блокирует event loop.
+"""
+import csv
+import io
+import os
+from datetime import date, datetime, time, timezone
+from typing import Iterator, List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+import models
+from database import ReadSessionLocal
+from deps import user_is_admin_or_self
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet - необязательная зависимость
+    pa = None
+    pq = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+router = APIRouter(
+    prefix="/users/{user_id}/export",
+    tags=["export"]
+)
+
+# Колонки выгрузки: (имя, тип для Parquet)
+DATASET_COLUMNS = {
+    "accounts": [
+        ("account_id", "int64"), ("bank_name", "string"), ("api_account_id", "string"),
+        ("status", "string"), ("currency", "string"), ("account_type", "string"),
+        ("account_subtype", "string"), ("nickname", "string"), ("opening_date", "string"),
+    ],
+    "balances": [
+        ("account_id", "int64"), ("balance_type", "string"), ("amount_minor", "int64"),
+        ("currency", "string"), ("captured_at", "timestamp"),
+    ],
+    "transactions": [
+        ("account_id", "int64"), ("transaction_id", "string"), ("booking_date_time", "timestamp"),
+        ("value_date_time", "timestamp"), ("amount", "string"), ("currency", "string"),
+        ("credit_debit_indicator", "string"), ("status", "string"),
+        ("transaction_information", "string"), ("bank_transaction_code", "string"),
+    ],
+}
+
+
+def _user_account_ids(user_id: int):
+    return (
+        select(models.Account.id)
+        .join(models.ConnectedBank, models.Account.connection_id == models.ConnectedBank.id)
+        .where(models.ConnectedBank.user_id == user_id)
+    )
+
+
+def build_export_query(dataset: str, user_id: int, from_dt: Optional[datetime], to_dt: Optional[datetime]):
+    """Запрос Core (без ORM-объектов) с колонками в порядке DATASET_COLUMNS."""
+    if dataset == "accounts":
+        return (
+            select(
+                models.Account.id.label("account_id"), models.ConnectedBank.bank_name,
+                models.Account.api_account_id, models.Account.status, models.Account.currency,
+                models.Account.account_type, models.Account.account_subtype,
+                models.Account.nickname, models.Account.opening_date,
+            )
+            .join(models.ConnectedBank, models.Account.connection_id == models.ConnectedBank.id)
+            .where(models.ConnectedBank.user_id == user_id)
+            .order_by(models.Account.id)
+        )
+
+    if dataset == "balances":
+        snapshot = models.BalanceSnapshot
+        query = select(
+            snapshot.account_id, snapshot.balance_type, snapshot.amount_minor,
+            snapshot.currency, snapshot.captured_at,
+        ).where(snapshot.account_id.in_(_user_account_ids(user_id)))
+        if from_dt:
+            query = query.where(snapshot.captured_at >= from_dt)
+        if to_dt:
+            query = query.where(snapshot.captured_at <= to_dt)
+        return query.order_by(snapshot.account_id, snapshot.captured_at)
+
+    transaction = models.Transaction
+    query = select(
+        transaction.account_id, transaction.transaction_id, transaction.booking_date_time,
+        transaction.value_date_time, transaction.amount, transaction.currency,
+        transaction.credit_debit_indicator, transaction.status,
+        transaction.transaction_information, transaction.bank_transaction_code,
+    ).where(transaction.user_id == user_id)
+    if from_dt:
+        query = query.where(transaction.booking_date_time >= from_dt)
+    if to_dt:
+        query = query.where(transaction.booking_date_time <= to_dt)
+    return query.order_by(transaction.account_id, transaction.booking_date_time)
+
+
+def iter_batches(query) -> Iterator[List[Tuple]]:
+    """
+    Читает результат серверным курсором (stream_results) порциями по EXPORT_BATCH_SIZE.
+    Сессия (на реплике, если она настроена) открывается внутри генератора,
+    т.к. он живет дольше обработчика запроса.
+    """
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(query.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def stream_csv(columns: List[str], batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([_csv_value(v) for v in row] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл только для записи: ParquetWriter пишет в него, а мы забираем накопленные байты."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(dataset: str):
+    types = {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(name, types[kind]) for name, kind in DATASET_COLUMNS[dataset]])
+
+
+def stream_parquet(dataset: str, batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    """Каждая порция строк становится отдельной row group файла Parquet."""
+    schema = _arrow_schema(dataset)
+    string_columns = {name for name, kind in DATASET_COLUMNS[dataset] if kind == "string"}
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            columns = list(zip(*batch))
+            arrays = []
+            for index, field in enumerate(schema):
+                values = columns[index]
+                if field.name in string_columns:
+                    values = [None if v is None else str(v) for v in values]
+                arrays.append(pa.array(values, type=field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+@router.get("/", summary="Выгрузить данные пользователя (CSV или Parquet)")
+def export_user_data(
+    user_id: int,
+    dataset: Literal["transactions", "accounts", "balances"] = Query("transactions", description="Что выгружать"),
+    format: Literal["csv", "parquet"] = Query("csv", description="Формат файла"),
+    from_date: Optional[date] = Query(None, description="Начало периода (для транзакций и балансов)"),
+    to_date: Optional[date] = Query(None, description="Конец периода включительно"),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Потоковая выгрузка. Транзакции берутся из сохраненных в БД
+    (они сохраняются при каждом запросе транзакций из банка).
+    """
+    if format == "parquet" and pa is None:
+        raise HTTPException(status_code=400, detail="Parquet export is not available: pyarrow is not installed.")
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date must not be after to_date.")
+
+    from_dt = datetime.combine(from_date, time.min, tzinfo=timezone.utc) if from_date else None
+    to_dt = datetime.combine(to_date, time.max, tzinfo=timezone.utc) if to_date else None
+    batches = iter_batches(build_export_query(dataset, user_id, from_dt, to_dt))
+
+    filename = f"user{user_id}_{dataset}.{format}"
+    if format == "csv":
+        body = stream_csv([name for name, _ in DATASET_COLUMNS[dataset]], batches)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = stream_parquet(dataset, batches)
+        media_type = "application/vnd.apache.parquet"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
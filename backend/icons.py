@@ -0,0 +1,151 @@
+# finance-app-master/icons.py
+"""
+Хранение иконок банков.
+
+Файлы именуются по sha256 содержимого, поэтому никогда не меняются по одному адресу
+и могут кэшироваться клиентами бессрочно (Cache-Control: immutable). Загрузка пишется
+на диск по частям вне event loop и ограничена ICON_MAX_BYTES. Если установлен Pillow,
+для мобильного приложения заранее готовятся уменьшенные PNG (ICON_VARIANT_SIZES).
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow - необязательная зависимость, без нее хранится только оригинал
+    Image = None
+
+logger = logging.getLogger("uvicorn")
+
+ICON_DIR = "static/icons"
+ICON_MAX_BYTES = int(os.getenv("ICON_MAX_BYTES", str(1024 * 1024)))
+ICON_VARIANT_SIZES = tuple(int(size) for size in os.getenv("ICON_VARIANT_SIZES", "48,96,192").split(","))
+ICON_DEFAULT_SIZE = int(os.getenv("ICON_DEFAULT_SIZE", "96"))
+ICON_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/svg+xml": ".svg",
+}
+# Имя файла, созданного этим модулем: <hash>.<ext> или <hash>-<size>.png
+HASHED_NAME = re.compile(r"^[0-9a-f]{16}(-\d+)?\.[a-z]+$")
+
+os.makedirs(ICON_DIR, exist_ok=True)
+
+
+def _extension(file: UploadFile) -> str:
+    extension = CONTENT_TYPE_EXTENSIONS.get(file.content_type)
+    if extension:
+        return extension
+    return os.path.splitext(file.filename or "")[1].lower() or ".img"
+
+
+async def _stream_to_temp(file: UploadFile) -> tuple:
+    """Пишет загрузку во временный файл, считая sha256. Возвращает (путь, hex-хэш)."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=ICON_DIR, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(ICON_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > ICON_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Icon is too large, the limit is {ICON_MAX_BYTES} bytes.")
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    if size == 0:
+        os.unlink(temp_path)
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    return temp_path, digest.hexdigest()
+
+
+def _make_variants(source_path: str, stem: str, extension: str) -> Dict[str, str]:
+    """
+    Уменьшенные PNG-копии (квадрат не больше size x size). Пропускается без Pillow и для SVG.
+    Заодно проверяет, что загрузка - читаемое изображение; при ошибке созданные копии удаляются.
+    """
+    if Image is None or extension == ".svg":
+        return {}
+    created = []
+    try:
+        with Image.open(source_path) as image:
+            image.load()
+            variants = {}
+            for size in ICON_VARIANT_SIZES:
+                filename = f"{stem}-{size}.png"
+                path = os.path.join(ICON_DIR, filename)
+                if not os.path.exists(path):
+                    variant = image.convert("RGBA")
+                    variant.thumbnail((size, size), Image.LANCZOS)
+                    created.append(path)
+                    variant.save(path, format="PNG", optimize=True)
+                variants[str(size)] = filename
+            return variants
+    except (OSError, ValueError) as e:
+        for path in created:
+            if os.path.exists(path):
+                os.unlink(path)
+        logger.info(f"Rejected icon upload {stem}: {e}")
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable image.")
+
+
+async def store_icon(file: UploadFile) -> Dict[str, str]:
+    """
+    Сохраняет иконку под именем по хэшу содержимого и готовит варианты размеров.
+    Возвращает {"original": имя файла, "<size>": имя варианта, ...}.
+    """
+    temp_path, digest = await _stream_to_temp(file)
+    stem = digest[:16]
+    extension = _extension(file)
+    filename = f"{stem}{extension}"
+    path = os.path.join(ICON_DIR, filename)
+    try:
+        # Варианты строятся из временного файла: нечитаемая загрузка не попадает
+        # под постоянное имя, которое отдается с бессрочным кэшированием
+        variants = await run_in_threadpool(_make_variants, temp_path, stem, extension)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    if os.path.exists(path):
+        # Такая иконка уже есть - содержимое совпадает по определению
+        os.unlink(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return {"original": filename, **variants}
+
+
+def pick_icon(icon_filename: Optional[str], icon_variants: Optional[dict], size: Optional[int] = None) -> Optional[str]:
+    """Имя файла иконки: наименьший вариант не меньше size (по умолчанию ICON_DEFAULT_SIZE), иначе оригинал."""
+    variants = {int(key): value for key, value in (icon_variants or {}).items() if key.isdigit()}
+    wanted = size or ICON_DEFAULT_SIZE
+    suitable = sorted(key for key in variants if key >= wanted)
+    if suitable:
+        return variants[suitable[0]]
+    return icon_filename
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles, отдающий файлы с хэшем в имени с бессрочным кэшированием."""
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if HASHED_NAME.match(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
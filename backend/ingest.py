@@ -0,0 +1,163 @@
+# finance-app-master/ingest.py
+"""
+Массовая запись строк в Postgres с upsert по уникальному ключу.
+
+Два способа:
+* multi-row INSERT ... ON CONFLICT - один скомпилированный запрос, строки уходят
+  пачками (insertmanyvalues), размер пачки подбирается по лимиту Postgres
+  в 65535 параметров на запрос;
+* COPY во временную таблицу и один INSERT ... SELECT ... ON CONFLICT - для больших
+  объемов (от INGEST_COPY_THRESHOLD строк), если драйвер поддерживает COPY.
+
+Существующая строка обновляется, только если значения действительно изменились
+(IS DISTINCT FROM), иначе Postgres не создает новую версию строки.
+"""
+import csv
+import io
+import os
+import uuid
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import Table, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from metrics import REGISTRY, Counter
+
+PG_MAX_BIND_PARAMS = 65535
+INGEST_MAX_BATCH_ROWS = int(os.getenv("INGEST_MAX_BATCH_ROWS", "5000"))
+INGEST_COPY_THRESHOLD = int(os.getenv("INGEST_COPY_THRESHOLD", "20000"))
+
+INGEST_ROWS = REGISTRY.register(Counter(
+    "finapp_ingest_rows_total", "Rows passed to bulk ingestion by table and method.",
+    ("table", "method"),
+))
+
+_COPY_NULL = "\\N"
+
+
+def batch_size_for(columns_count: int, max_rows: int = INGEST_MAX_BATCH_ROWS) -> int:
+    """Сколько строк помещается в один запрос, не превышая лимит параметров Postgres."""
+    return max(1, min(max_rows, PG_MAX_BIND_PARAMS // max(columns_count, 1)))
+
+
+def dedupe_rows(rows: Iterable[dict], key_columns: Sequence[str]) -> List[dict]:
+    """
+    Оставляет последнюю строку для каждого ключа. ON CONFLICT DO UPDATE не может
+    изменить одну строку дважды в одном запросе, поэтому дубли нужно убрать заранее.
+    """
+    unique: Dict[tuple, dict] = {}
+    for row in rows:
+        unique[tuple(row[column] for column in key_columns)] = row
+    return list(unique.values())
+
+
+def _update_columns(columns: Sequence[str], key_columns: Sequence[str], update_columns: Optional[Sequence[str]]) -> List[str]:
+    if update_columns is not None:
+        return list(update_columns)
+    return [column for column in columns if column not in key_columns]
+
+
+def _upsert_statement(table: Table, columns: Sequence[str], key_columns: Sequence[str], update_columns: List[str]):
+    stmt = insert(table)
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=list(key_columns))
+    return stmt.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={column: stmt.excluded[column] for column in update_columns},
+        where=or_(*[table.c[column].is_distinct_from(stmt.excluded[column]) for column in update_columns]),
+    )
+
+
+def upsert_rows(
+    db: Session,
+    table: Table,
+    rows: List[dict],
+    key_columns: Sequence[str],
+    update: bool = True,
+    update_columns: Optional[Sequence[str]] = None,
+    use_copy: Optional[bool] = None,
+) -> int:
+    """
+    Вставляет строки, а при конфликте по key_columns обновляет их (update=True)
+    или пропускает (update=False). update_columns - какие колонки обновлять
+    (по умолчанию все, кроме ключа). Все строки должны иметь одинаковый набор ключей.
+    Коммит остается за вызывающим кодом. Возвращает число переданных строк.
+    """
+    rows = dedupe_rows(rows, key_columns)
+    if not rows:
+        return 0
+    columns = list(rows[0])
+    update_columns = _update_columns(columns, key_columns, update_columns) if update else []
+
+    if use_copy is None:
+        use_copy = len(rows) >= INGEST_COPY_THRESHOLD
+    if use_copy and _supports_copy(db):
+        copy_upsert(db, table, rows, columns, key_columns, update_columns)
+        INGEST_ROWS.inc(len(rows), table=table.name, method="copy")
+        return len(rows)
+
+    stmt = _upsert_statement(table, columns, key_columns, update_columns)
+    db.execute(
+        stmt.execution_options(insertmanyvalues_page_size=batch_size_for(len(columns))),
+        rows,
+    )
+    INGEST_ROWS.inc(len(rows), table=table.name, method="insert")
+    return len(rows)
+
+
+def _supports_copy(db: Session) -> bool:
+    return db.get_bind().dialect.driver == "psycopg2"
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return _COPY_NULL
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_upsert(
+    db: Session,
+    table: Table,
+    rows: List[dict],
+    columns: Sequence[str],
+    key_columns: Sequence[str],
+    update_columns: Sequence[str] = (),
+) -> None:
+    """
+    COPY строк во временную таблицу (удаляется при коммите) и перенос в целевую
+    одним INSERT ... SELECT ... ON CONFLICT. Работает через psycopg2 (copy_expert).
+    Временная таблица содержит только нужные колонки, без значений по умолчанию,
+    чтобы не расходовать последовательность id.
+    """
+    temp_name = f"tmp_ingest_{uuid.uuid4().hex[:12]}"
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    key_list = ", ".join(f'"{column}"' for column in key_columns)
+    if update_columns:
+        assignments = ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in update_columns)
+        changed = " OR ".join(f'{table.name}."{column}" IS DISTINCT FROM EXCLUDED."{column}"' for column in update_columns)
+        conflict = f"DO UPDATE SET {assignments} WHERE {changed}"
+    else:
+        conflict = "DO NOTHING"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+
+    cursor = db.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(f'CREATE TEMP TABLE {temp_name} ON COMMIT DROP AS SELECT {column_list} FROM "{table.name}" WITH NO DATA')
+        cursor.copy_expert(
+            f"COPY {temp_name} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')", buffer
+        )
+        cursor.execute(
+            f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM {temp_name} '
+            f"ON CONFLICT ({key_list}) {conflict}"
+        )
+    finally:
+        cursor.close()
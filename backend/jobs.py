@@ -0,0 +1,162 @@
+# finance-app-master/jobs.py
+"""
+Фоновые задачи: быстрое удаление данных пользователя и очередь отзыва согласий.
+
+Отзывы согласий хранятся в таблице consent_revocation_jobs, поэтому не теряются
+при перезапуске. Обработчик забирает задачи через SELECT ... FOR UPDATE SKIP LOCKED,
+так что несколько воркеров не возьмут одну и ту же задачу.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, select, text, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import models
+from database import SessionLocal
+from utils import revoke_consent
+
+logger = logging.getLogger("uvicorn")
+
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "5"))
+JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "20"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "8"))
+JOBS_RETRY_BASE_SECONDS = float(os.getenv("JOBS_RETRY_BASE_SECONDS", "30"))
+# Пока задача обрабатывается, она "арендована" и не видна другим воркерам
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))
+
+_wakeup: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def enqueue_user_consent_revocations(db: Session, user_id: int) -> int:
+    """Ставит в очередь отзыв всех согласий пользователя. Коммит остается за вызывающим кодом."""
+    rows = db.execute(
+        select(models.ConnectedBank.bank_name, models.ConnectedBank.consent_id, models.ConnectedBank.request_id)
+        .where(models.ConnectedBank.user_id == user_id)
+    ).all()
+    jobs = [
+        models.ConsentRevocationJob(bank_name=row.bank_name, consent_id=row.consent_id or row.request_id)
+        for row in rows if row.consent_id or row.request_id
+    ]
+    db.add_all(jobs)
+    return len(jobs)
+
+
+def bulk_delete_user(db: Session, user_id: int) -> None:
+    """
+    Удаляет пользователя и все его данные набором DELETE-запросов без загрузки
+    объектов в ORM. Коммит остается за вызывающим кодом, чтобы все шло одной транзакцией.
+    Записи об удалении счетов и подключений не создаются: их удалил бы каскад вместе с пользователем.
+    """
+    db.execute(text("SELECT set_config(:name, 'on', true)"), {"name": models.SYNC_SKIP_TOMBSTONES_SETTING})
+    connection_ids = select(models.ConnectedBank.id).where(models.ConnectedBank.user_id == user_id)
+    account_ids = select(models.Account.id).where(models.Account.connection_id.in_(connection_ids))
+    db.execute(delete(models.Transaction).where(models.Transaction.user_id == user_id))
+    db.execute(delete(models.BalanceSnapshot).where(models.BalanceSnapshot.account_id.in_(account_ids)))
+    db.execute(delete(models.Account).where(models.Account.connection_id.in_(connection_ids)))
+    db.execute(delete(models.ConnectedBank).where(models.ConnectedBank.user_id == user_id))
+    db.execute(delete(models.User).where(models.User.id == user_id))
+    # Остальная часть транзакции вызывающего кода снова пишет записи об удалении
+    db.execute(text("SELECT set_config(:name, 'off', true)"), {"name": models.SYNC_SKIP_TOMBSTONES_SETTING})
+
+
+def wake_worker() -> None:
+    """Будит обработчик очереди, не дожидаясь следующего опроса. Можно вызывать из любого потока."""
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def _claim_jobs() -> List[Tuple[int, str, str, int, Optional[models.Bank]]]:
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        jobs = db.execute(
+            select(models.ConsentRevocationJob)
+            .where(models.ConsentRevocationJob.status == "pending", models.ConsentRevocationJob.next_attempt_at <= now)
+            .order_by(models.ConsentRevocationJob.next_attempt_at)
+            .limit(JOBS_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not jobs:
+            return []
+        bank_names = {job.bank_name for job in jobs}
+        # Отвязанные от сессии копии конфигов: они нужны уже после ее закрытия
+        configs = {
+            bank.name: models.Bank(name=bank.name, base_url=bank.base_url, client_id=bank.client_id, client_secret=bank.client_secret)
+            for bank in db.query(models.Bank).filter(models.Bank.name.in_(bank_names)).all()
+        }
+        claimed = []
+        for job in jobs:
+            job.attempts += 1
+            job.next_attempt_at = now + timedelta(seconds=JOBS_LEASE_SECONDS)
+            claimed.append((job.id, job.bank_name, job.consent_id, job.attempts, configs.get(job.bank_name)))
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def _finish_jobs(results: List[Tuple[int, int, Optional[str]]]) -> None:
+    """results: (job_id, attempts, error) - error=None означает успех."""
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        for job_id, attempts, error in results:
+            values = {"last_error": error}
+            if error is None:
+                values["status"] = "done"
+            elif attempts >= JOBS_MAX_ATTEMPTS:
+                values["status"] = "failed"
+                logger.error(f"Consent revocation job {job_id} failed after {attempts} attempts: {error}")
+            else:
+                values["status"] = "pending"
+                values["next_attempt_at"] = now + timedelta(seconds=JOBS_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+            db.execute(update(models.ConsentRevocationJob).where(models.ConsentRevocationJob.id == job_id).values(**values))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _process(job) -> Tuple[int, int, Optional[str]]:
+    job_id, bank_name, consent_id, attempts, config = job
+    if config is None:
+        return job_id, attempts, f"Bank config for '{bank_name}' not found"
+    ok = await revoke_consent(config, consent_id)
+    return job_id, attempts, None if ok else "Bank did not confirm revocation"
+
+
+async def run_once() -> int:
+    """Обрабатывает одну пачку задач. Возвращает количество обработанных."""
+    jobs = await run_in_threadpool(_claim_jobs)
+    if not jobs:
+        return 0
+    results = await asyncio.gather(*[_process(job) for job in jobs])
+    await run_in_threadpool(_finish_jobs, list(results))
+    return len(jobs)
+
+
+async def run_consent_revocation_worker() -> None:
+    """Фоновая задача процесса: разбирает очередь отзыва согласий."""
+    global _wakeup, _loop
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            processed = await run_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Consent revocation worker error: {e}")
+            processed = 0
+        if processed >= JOBS_BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOBS_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
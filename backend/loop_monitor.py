@@ -0,0 +1,139 @@
+# finance-app-master/loop_monitor.py
+"""
+Обнаружение блокировок event loop.
+
+Корутина-пульс в event loop каждые LOOP_MONITOR_INTERVAL секунд отмечает время.
+Сторожевой поток проверяет эту отметку: если пульса нет дольше
+LOOP_BLOCK_THRESHOLD_MS, значит какой-то callback выполняется синхронно и держит
+loop. Тогда поток снимает стек потока event loop и определяет маршрут запроса,
+которому принадлежит текущая задача. Когда loop отпускает, блокировка
+записывается в метрики (finapp_event_loop_blocks_total,
+finapp_event_loop_block_duration_seconds) и в кольцевой буфер, доступный через
+GET /admin/loop-blocks.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, List, Optional
+
+from metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_BLOCK_DURATION
+
+logger = logging.getLogger("uvicorn")
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+LOOP_MONITOR_INTERVAL = LOOP_BLOCK_THRESHOLD / 2
+LOOP_BLOCK_HISTORY = int(os.getenv("LOOP_BLOCK_HISTORY", "100"))
+LOOP_BLOCK_STACK_DEPTH = 25
+
+# Задача asyncio -> ASGI scope запроса, который она обрабатывает
+_task_scopes: "weakref.WeakKeyDictionary[asyncio.Task, dict]" = weakref.WeakKeyDictionary()
+
+_events: Deque[dict] = deque(maxlen=LOOP_BLOCK_HISTORY)
+_events_lock = threading.Lock()
+
+
+class LoopMonitorMiddleware:
+    """Запоминает, какой запрос обрабатывает задача, чтобы приписать блокировку маршруту."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not LOOP_MONITOR_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        _task_scopes[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _task_scopes.pop(task, None)
+
+
+def _describe_task(task: Optional[asyncio.Task]) -> tuple:
+    """(маршрут, имя задачи). Маршрут - шаблон пути, как в метриках API."""
+    if task is None:
+        return "callback", None
+    coro = task.get_coro()
+    task_name = getattr(coro, "__qualname__", None) or task.get_name()
+    scope = _task_scopes.get(task)
+    if scope is None:
+        return "background", task_name
+    route = getattr(scope.get("route"), "path", None) or "unmatched"
+    return f"{scope.get('method', 'WS')} {route}", task_name
+
+
+class _Watchdog:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def _capture(self) -> dict:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.format_stack(frame)[-LOOP_BLOCK_STACK_DEPTH:] if frame is not None else []
+        route, task_name = _describe_task(asyncio.current_task(self.loop))
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "route": route,
+            "task": task_name,
+            "duration_ms": None,
+            "stack": [line.rstrip() for line in stack],
+        }
+
+    def _watch(self) -> None:
+        blocked: Optional[dict] = None
+        blocked_beat = 0.0
+        while not self._stop.wait(LOOP_MONITOR_INTERVAL / 2):
+            beat = self.beat
+            if blocked is not None and beat != blocked_beat:
+                # Loop снова работает: пульс пришел позже на время блокировки
+                duration = max(beat - blocked_beat - LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD)
+                blocked["duration_ms"] = round(duration * 1000, 1)
+                EVENT_LOOP_BLOCKS.inc(route=blocked["route"])
+                EVENT_LOOP_BLOCK_DURATION.observe(duration, route=blocked["route"])
+                logger.warning(
+                    f"Event loop blocked for {blocked['duration_ms']} ms in {blocked['route']}: "
+                    f"{blocked['stack'][-1].strip() if blocked['stack'] else 'unknown'}"
+                )
+                blocked = None
+            if blocked is None and time.monotonic() - beat > LOOP_MONITOR_INTERVAL + LOOP_BLOCK_THRESHOLD:
+                blocked, blocked_beat = self._capture(), beat
+                with _events_lock:
+                    _events.append(blocked)
+
+
+async def run_loop_monitor() -> None:
+    """Фоновая задача: пульс event loop и сторожевой поток на время жизни воркера."""
+    if not LOOP_MONITOR_ENABLED:
+        return
+    watchdog = _Watchdog(asyncio.get_running_loop())
+    watchdog.start()
+    try:
+        while True:
+            watchdog.beat = time.monotonic()
+            await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+    finally:
+        watchdog.stop()
+
+
+def recent_blocks() -> List[dict]:
+    """Последние блокировки, самые новые - первыми. duration_ms=None - блокировка еще идет."""
+    with _events_lock:
+        return [dict(event) for event in reversed(_events)]
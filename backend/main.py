@@ -1,6 +1,8 @@
 # finance-app-master/main.py
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
@@ -12,23 +14,70 @@ from banks_api import router as banks_router
 from connections_api import router as connections_router
 from accounts_api import router as accounts_router
 from transactions_api import router as transactions_router # <--- ДОБАВЛЕН ИМПОРТ
+from turnover_api import router as turnover_router
+from export_api import router as export_router
+from search_api import router as search_router
+from dashboard_api import router as dashboard_router
+from events_api import router as events_router
+from sync_api import router as sync_router, run_tombstone_pruner
+from metrics_api import router as metrics_router
+from metrics import MetricsMiddleware, monitor_event_loop_lag
+from admin_api import router as admin_router
+from profiling import ProfilingMiddleware
+from icons import CachedStaticFiles
+from encoding import CompressionMiddleware
+from admission import AdmissionMiddleware, admission_snapshot
+from loop_monitor import LoopMonitorMiddleware, run_loop_monitor
+from outbound_logging import install_access_log_redaction, start_outbound_logging, stop_outbound_logging
+from jobs import run_consent_revocation_worker
+from events import start_event_listener, stop_event_listener
+from warmup import cancel_warmups
+from migrations import run_migrations
+from rate_limit import BankRateLimited
 
 load_dotenv()
 
 models.Base.metadata.create_all(bind=engine)
+# create_all не меняет существующие таблицы: новые колонки и индексы доводят миграции
+run_migrations(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Фоновые задачи, живущие вместе с процессом воркера
+    install_access_log_redaction()
+    start_outbound_logging()
+    start_event_listener()
+    background_tasks = [
+        asyncio.create_task(monitor_event_loop_lag()),
+        asyncio.create_task(run_loop_monitor()),
+        asyncio.create_task(run_consent_revocation_worker()),
+        asyncio.create_task(run_tombstone_pruner()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await cancel_warmups()
+    stop_event_listener()
+    stop_outbound_logging()
+
 
 app = FastAPI(
     title="FinApp API",
     version="1.0.0",
-    description="API для подключения банковских счетов и управления финансовыми данными."
+    description="API для подключения банковских счетов и управления финансовыми данными.",
+    lifespan=lifespan
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 origins = [
     "*",
 ]
 
+# Внутри CORS, чтобы ответы 503 при перегрузке тоже получали CORS-заголовки
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -36,10 +85,42 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(LoopMonitorMiddleware)
+# Последним добавлен - первым обрабатывает: сжимается уже готовый ответ
+app.add_middleware(CompressionMiddleware)
 
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(connections_router)
 app.include_router(banks_router)
 app.include_router(accounts_router)
-app.include_router(transactions_router) # <--- ПОДКЛЮЧЕН НОВЫЙ РОУТЕР
\ No newline at end of file
+app.include_router(transactions_router) # <--- ПОДКЛЮЧЕН НОВЫЙ РОУТЕР
+app.include_router(turnover_router)
+app.include_router(export_router)
+app.include_router(search_router)
+app.include_router(dashboard_router)
+app.include_router(events_router)
+app.include_router(sync_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
+
+
+@app.exception_handler(BankRateLimited)
+async def bank_rate_limited_handler(request: Request, exc: BankRateLimited):
+    # Запрос в банк не дождался очереди в лимитере, и обработчик не смог без него обойтись
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.get("/health", tags=["health"], summary="Проверка работоспособности воркера")
+async def health():
+    """
+    Не обращается к БД и банкам и не ограничивается admission control, поэтому
+    отвечает и при перегрузке. admission - загрузка групп маршрутов в этом воркере.
+    """
+    return {"status": "ok", "admission": admission_snapshot()}
@@ -0,0 +1,307 @@
+# finance-app-master/metrics.py
+"""
+Минимальная реализация метрик в текстовом формате Prometheus.
+Без внешних зависимостей: счетчики, gauge и гистограммы с метками.
+"""
+import asyncio
+import bisect
+from abc import ABC, abstractmethod
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> Iterable[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счетчики по бакетам..., сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_number(bound)))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- HTTP API ---
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "finapp_http_request_duration_seconds", "Latency of incoming API requests by route.",
+    ("method", "route", "status"),
+))
+HTTP_REQUESTS_IN_PROGRESS = REGISTRY.register(Gauge(
+    "finapp_http_requests_in_progress", "Incoming API requests currently being processed.",
+))
+
+# --- Исходящие запросы в банки ---
+BANK_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "finapp_bank_request_duration_seconds", "Latency of outbound bank API calls.",
+    ("bank", "operation", "status"),
+))
+BANK_TRANSACTION_PAGES = REGISTRY.register(Histogram(
+    "finapp_bank_transaction_pages", "Number of transaction pages fetched per account fetch.",
+    ("bank",), buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+))
+BANK_TOKEN_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "finapp_bank_token_cache_total", "Bank token cache lookups by result (hit, shared_hit, miss).",
+    ("bank", "result"),
+))
+BANK_RATE_LIMIT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "finapp_bank_rate_limit_queue_depth", "Outbound bank calls waiting for the rate limiter.",
+    ("bank",),
+))
+BANK_RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    "finapp_bank_rate_limit_wait_seconds", "Time outbound bank calls spent waiting for the rate limiter.",
+    ("bank", "operation"),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+))
+BANK_RATE_LIMIT_REJECTED = REGISTRY.register(Counter(
+    "finapp_bank_rate_limit_rejected_total", "Outbound bank calls that missed their rate limiter deadline.",
+    ("bank", "operation"),
+))
+
+ADMISSION_IN_FLIGHT = REGISTRY.register(Gauge(
+    "finapp_admission_in_flight", "Requests currently admitted by route group.",
+    ("group",),
+))
+ADMISSION_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "finapp_admission_queue_depth", "Requests waiting for admission by route group.",
+    ("group",),
+))
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    "finapp_admission_wait_seconds", "Time requests spent waiting for admission.",
+    ("group",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "finapp_admission_rejected_total", "Requests rejected with 503 by route group and reason (queue_full, timeout).",
+    ("group", "reason"),
+))
+
+LOGIN_WARMUPS = REGISTRY.register(Counter(
+    "finapp_login_warmups_total", "Post-login warm-ups by result (started, running, limited, ok, error, timeout).",
+    ("result",),
+))
+LOGIN_WARMUP_DURATION = REGISTRY.register(Histogram(
+    "finapp_login_warmup_duration_seconds", "Duration of completed post-login warm-ups.",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+))
+
+# --- База данных и event loop ---
+DB_POOL_CHECKOUT_WAIT = REGISTRY.register(Histogram(
+    "finapp_db_pool_checkout_wait_seconds", "Time spent waiting for a DB connection from the pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+))
+REPLICA_LAG = REGISTRY.register(Gauge(
+    "finapp_db_replica_lag_seconds", "Most recently measured replication lag of the read replica.",
+))
+DB_READ_ROUTE = REGISTRY.register(Counter(
+    "finapp_db_read_sessions_total", "Read-only DB sessions by target (replica or primary).",
+    ("target",),
+))
+EVENT_LOOP_LAG = REGISTRY.register(Gauge(
+    "finapp_event_loop_lag_seconds", "Most recent measured event loop scheduling lag.",
+))
+EVENT_LOOP_LAG_HISTOGRAM = REGISTRY.register(Histogram(
+    "finapp_event_loop_lag_distribution_seconds", "Distribution of event loop scheduling lag.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+))
+EVENT_LOOP_BLOCKS = REGISTRY.register(Counter(
+    "finapp_event_loop_blocks_total", "Callbacks that blocked the event loop longer than the threshold, by route.",
+    ("route",),
+))
+EVENT_LOOP_BLOCK_DURATION = REGISTRY.register(Histogram(
+    "finapp_event_loop_block_duration_seconds", "Duration of event loop blocks longer than the threshold, by route.",
+    ("route",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+))
+
+
+def classify_bank_operation(path: str) -> str:
+    """Определяет тип операции банка по пути запроса (для метки operation)."""
+    if path.endswith("/auth/bank-token"):
+        return "token"
+    if "/account-consents" in path:
+        return "consents"
+    if path.endswith("/balances"):
+        return "balances"
+    if path.endswith("/transactions"):
+        return "transactions"
+    if "/accounts" in path:
+        return "accounts"
+    return "other"
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware, измеряющее время ответа по шаблону маршрута
+    (например, /users/{user_id}/accounts/), а не по конкретному URL.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or ("/static" if scope.get("path", "").startswith("/static") else "unmatched")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""), route=route_path, status=str(status_holder["status"]),
+            )
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """Фоновая задача: измеряет, насколько позже запланированного просыпается event loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
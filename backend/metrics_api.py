@@ -0,0 +1,24 @@
+# finance-app-master/metrics_api.py
+import os
+import secrets
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from metrics import REGISTRY
+
+router = APIRouter(tags=["monitoring"])
+
+# Если задан METRICS_TOKEN, /metrics требует заголовок "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics(authorization: Optional[str] = Header(None)):
+    """
+    Метрики в текстовом формате Prometheus: задержки API по маршрутам,
+    запросы в банки, кэш токенов, пул соединений БД и задержка event loop.
+    """
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,163 @@
+# finance-app-master/migrations.py
+"""
+Обновление схемы существующей БД.
+
+Base.metadata.create_all создает только отсутствующие таблицы и не меняет
+существующие. Поэтому колонки, индексы и триггеры, добавленные к уже
+существующим таблицам, описаны здесь идемпотентным DDL (ADD COLUMN IF NOT EXISTS,
+CREATE INDEX IF NOT EXISTS) с заполнением данных, где оно нужно. На новой БД
+create_all уже создает все целиком, и миграции ничего не меняют.
+
+Примененные миграции записываются в schema_migrations и повторно не выполняются.
+Каждая миграция идет в своей транзакции; одновременный старт нескольких воркеров
+разводится advisory-lock. Запуск: автоматически при старте (main.py) или вручную
+`python migrations.py`.
+"""
+import logging
+from typing import Callable, List, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+import models
+
+logger = logging.getLogger("uvicorn")
+
+# Произвольный ключ advisory-lock для миграций
+MIGRATIONS_LOCK_KEY = 715_031_001
+
+
+
+def _backfill_typed_balances(conn: Connection) -> None:
+    """Типизированные колонки балансов для счетов, сохраненных до их появления."""
+    from balance_history import extract_typed_balances
+
+    rows = conn.execute(text(
+        "SELECT id, balance_data FROM accounts WHERE balance_data IS NOT NULL AND balance_currency IS NULL"
+    )).all()
+    for row in rows:
+        values = extract_typed_balances(row.balance_data)
+        if values["balance_currency"] is None:
+            continue
+        conn.execute(text(
+            "UPDATE accounts SET current_balance_minor = :current_balance_minor, "
+            "available_balance_minor = :available_balance_minor, balance_currency = :balance_currency, "
+            "balance_as_of = :balance_as_of WHERE id = :id"
+        ), {**values, "id": row.id})
+
+
+
+def _sync_row_versions() -> List[str]:
+    """Версии строк для синхронизации: колонки, функции, триггеры и заполнение."""
+    statements = [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_version BIGINT" for table in models.SYNC_VERSIONED_TABLES
+    ]
+    statements += models.SYNC_FUNCTIONS_DDL
+    for table in models.SYNC_VERSIONED_TABLES:
+        statements += [
+            f"DROP TRIGGER IF EXISTS trg_{table}_row_version ON {table}",
+            f"DROP TRIGGER IF EXISTS trg_{table}_tombstone ON {table}",
+        ]
+        statements += models.sync_trigger_ddl(table)
+        # Уже существующие строки получают версию этой миграции; клиенты их еще не видели
+        statements += [
+            f"UPDATE {table} SET row_version = pg_current_xact_id()::text::bigint WHERE row_version IS NULL",
+            f"ALTER TABLE {table} ALTER COLUMN row_version SET NOT NULL",
+        ]
+    statements += [
+        "CREATE INDEX IF NOT EXISTS ix_connected_banks_user_version ON connected_banks (user_id, row_version)",
+        "CREATE INDEX IF NOT EXISTS ix_accounts_connection_version ON accounts (connection_id, row_version)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_version ON transactions (user_id, row_version, id)",
+    ]
+    return statements
+
+
+# Шаг миграции: SQL-оператор или функция, если заполнение требует логики приложения
+Step = Union[str, Callable[[Connection], None]]
+
+# (имя, шаги). Новые миграции добавляются в конец
+MIGRATIONS: List[Tuple[str, List[Step]]] = [
+    ("035_transactions_user_id", [
+        "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users (id) ON DELETE CASCADE",
+        "UPDATE transactions AS t SET user_id = c.user_id "
+        "FROM accounts AS a JOIN connected_banks AS c ON c.id = a.connection_id "
+        "WHERE a.id = t.account_id AND t.user_id IS NULL",
+        "ALTER TABLE transactions ALTER COLUMN user_id SET NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_booking "
+        "ON transactions (user_id, booking_date_time DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_amount ON transactions (user_id, amount)",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_information_trgm "
+        "ON transactions USING gin (transaction_information gin_trgm_ops)",
+    ]),
+    ("037_sync_status", [
+        "ALTER TABLE connected_banks ADD COLUMN IF NOT EXISTS last_synced_at TIMESTAMPTZ",
+        "ALTER TABLE connected_banks ADD COLUMN IF NOT EXISTS sync_status VARCHAR(16)",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS last_synced_at TIMESTAMPTZ",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS sync_status VARCHAR(16)",
+    ]),
+    ("038_account_content_hash", [
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    ]),
+    ("040_typed_balances", [
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS current_balance_minor BIGINT",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS available_balance_minor BIGINT",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS balance_currency VARCHAR(3)",
+        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS balance_as_of TIMESTAMPTZ",
+        _backfill_typed_balances,
+        "CREATE INDEX IF NOT EXISTS ix_accounts_connection_balance ON accounts (connection_id, balance_currency) "
+        "INCLUDE (current_balance_minor, available_balance_minor, balance_as_of)",
+        "CREATE INDEX IF NOT EXISTS ix_connected_banks_user_id ON connected_banks (user_id)",
+    ]),
+    ("042_bank_icon_variants", [
+        "ALTER TABLE banks ADD COLUMN IF NOT EXISTS icon_variants JSONB",
+    ]),
+    ("049_sync_row_versions", _sync_row_versions()),
+    ("049_sync_tombstone_skip", [
+        models.SYNC_TOMBSTONE_FUNCTION_DDL,
+    ]),
+]
+
+
+def run_migrations(bind: Engine) -> List[str]:
+    """Применяет еще не примененные миграции. Возвращает имена примененных."""
+    applied_now: List[str] = []
+    with bind.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        try:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "name VARCHAR PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            ))
+            conn.commit()
+            applied = set(conn.execute(text("SELECT name FROM schema_migrations")).scalars())
+            conn.commit()
+            for name, steps in MIGRATIONS:
+                if name in applied:
+                    continue
+                logger.info(f"Applying schema migration {name}")
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(text(step))
+                conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+                conn.commit()
+                applied_now.append(name)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            conn.commit()
+    return applied_now
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=engine)
+    names = run_migrations(engine)
+    print(f"Applied: {', '.join(names)}" if names else "Schema is up to date.")
@@ -1,5 +1,7 @@
 # finance-app-master/models.py
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Boolean, JSON
+from typing import List
+
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Numeric, ForeignKey, Boolean, JSON, Index, UniqueConstraint, DDL, event, func
 from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.dialects.postgresql import JSONB # <-- ИМПОРТИРУЙТЕ JSONB
 from database import Base
@@ -14,7 +16,16 @@ class Bank(Base):
     client_secret = Column(String, nullable=False)
     base_url = Column(String, nullable=False)
     auto_approve = Column(Boolean, default=False)
-    icon_filename = Column(String, nullable=True)
+    icon_filename = Column(String, nullable=True) # оригинал, имя = хэш содержимого
+    icon_variants = Column(JSONB, nullable=True)  # {"48": "<hash>-48.png", ...}
+
+class BankToken(Base):
+    """Общий для всех воркеров кэш банковских токенов (второй уровень после кэша в памяти)."""
+    __tablename__ = "bank_tokens"
+    bank_name = Column(String, primary_key=True)
+    token = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
 class User(Base):
     __tablename__ = "users"
@@ -26,18 +37,27 @@ class User(Base):
 class ConnectedBank(Base):
     __tablename__ = "connected_banks"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     bank_name = Column(String, index=True)
     bank_client_id = Column(String, index=True)
     request_id = Column(String, unique=True, nullable=True, index=True)
     consent_id = Column(String, unique=True, nullable=True)
     status = Column(String, default="awaitingauthorization")
     full_name = Column(String, nullable=True)
+    # Последняя синхронизация счетов с банком: время и результат (ok / error)
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
+    sync_status = Column(String(16), nullable=True)
+    # Версия строки для инкрементальной синхронизации (ставится триггером, см. ниже)
+    row_version = Column(BigInteger, nullable=False)
     
     user = relationship("User")
     # Добавим обратную связь, чтобы легко получать счета подключения
     accounts = relationship("Account", back_populates="connection", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_connected_banks_user_version", "user_id", "row_version"),
+    )
+
 # v-- НОВАЯ МОДЕЛЬ ДЛЯ ХРАНЕНИЯ СЧЕТОВ --v
 class Account(Base):
     __tablename__ = "accounts"
@@ -60,7 +80,31 @@ class Account(Base):
     owner_data = Column(JSONB, nullable=True) # Содержимое "account": [...]
     balance_data = Column(JSONB, nullable=True) # Содержимое "balance": [...]
 
+    # ok - счет и балансы получены, partial - балансы получить не удалось.
+    # last_synced_at меняется только вместе с данными: неизменившийся счет не перезаписывается,
+    # время последней проверки хранится в ConnectedBank.last_synced_at
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
+    sync_status = Column(String(16), nullable=True)
+    # sha256 данных счета и балансов из банка - чтобы не писать строку, если ничего не изменилось
+    content_hash = Column(String(64), nullable=True)
+
+    # Остатки из balance_data в типизированном виде (минимальные единицы валюты, со знаком)
+    current_balance_minor = Column(BigInteger, nullable=True)   # InterimBooked / ClosingBooked
+    available_balance_minor = Column(BigInteger, nullable=True) # InterimAvailable / ClosingAvailable
+    balance_currency = Column(String(3), nullable=True)
+    balance_as_of = Column(DateTime(timezone=True), nullable=True)
+    row_version = Column(BigInteger, nullable=False)
+
     connection = relationship("ConnectedBank", back_populates="accounts")
+
+    __table_args__ = (
+        # Итог по пользователю считается только по индексу (index-only scan)
+        Index(
+            "ix_accounts_connection_balance", "connection_id", "balance_currency",
+            postgresql_include=["current_balance_minor", "available_balance_minor", "balance_as_of"],
+        ),
+        Index("ix_accounts_connection_version", "connection_id", "row_version"),
+    )
     
     bank_name = association_proxy("connection", "bank_name")
     bank_client_id = association_proxy("connection", "bank_client_id")
@@ -72,3 +116,175 @@ class Account(Base):
         .scalar_subquery()
     )
 
+
+# v-- ИСТОРИЯ БАЛАНСОВ --v
+class BalanceSnapshot(Base):
+    """
+    Временной ряд балансов. Запись добавляется только при изменении значения,
+    поэтому ряд хранит "дельты", а не копию balance_data на каждое обновление.
+    """
+    __tablename__ = "balance_snapshots"
+    id = Column(BigInteger, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    balance_type = Column(String(32), nullable=False) # type (InterimAvailable, InterimBooked, ...)
+    amount_minor = Column(BigInteger, nullable=False) # Сумма в минимальных единицах валюты, со знаком
+    currency = Column(String(3))
+    captured_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_balance_snapshots_account_type_time", "account_id", "balance_type", "captured_at"),
+    )
+
+
+# v-- СОХРАНЕННЫЕ ТРАНЗАКЦИИ --v
+class Transaction(Base):
+    """Транзакции, полученные из банка. Уникальны в пределах счета по transactionId."""
+    __tablename__ = "transactions"
+    id = Column(BigInteger, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    # Денормализовано: поиск идет по всем счетам пользователя одним индексом
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    transaction_id = Column(String, nullable=False) # transactionId
+    booking_date_time = Column(DateTime(timezone=True), nullable=False) # bookingDateTime
+    value_date_time = Column(DateTime(timezone=True), nullable=True) # valueDateTime
+    amount = Column(Numeric(20, 4), nullable=False)
+    currency = Column(String(3))
+    credit_debit_indicator = Column(String(16)) # creditDebitIndicator
+    status = Column(String(32))
+    transaction_information = Column(String, nullable=True) # transactionInformation
+    bank_transaction_code = Column(String, nullable=True) # bankTransactionCode.code
+    row_version = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("account_id", "transaction_id", name="uq_transactions_account_transaction"),
+        Index("ix_transactions_account_booking", "account_id", "booking_date_time"),
+        # Ключевая пагинация поиска: ORDER BY booking_date_time DESC, id DESC
+        Index("ix_transactions_user_booking", "user_id", booking_date_time.desc(), id.desc()),
+        Index("ix_transactions_user_amount", "user_id", "amount"),
+        # Изменения для синхронизации: WHERE user_id = ? AND row_version >= ? ORDER BY row_version, id
+        Index("ix_transactions_user_version", "user_id", "row_version", "id"),
+        Index(
+            "ix_transactions_information_trgm", "transaction_information",
+            postgresql_using="gin", postgresql_ops={"transaction_information": "gin_trgm_ops"},
+        ),
+    )
+
+
+# Триграммный индекс требует расширения pg_trgm
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+# v-- ВЕРСИИ СТРОК ДЛЯ ИНКРЕМЕНТАЛЬНОЙ СИНХРОНИЗАЦИИ --v
+class SyncTombstone(Base):
+    """
+    Запись об удаленном подключении или счете. Транзакции удаленного счета
+    отдельных записей не получают: клиент удаляет их вместе со счетом.
+    """
+    __tablename__ = "sync_tombstones"
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    entity = Column(String(16), nullable=False) # connection | account
+    entity_id = Column(Integer, nullable=False)
+    row_version = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_sync_tombstones_user_version", "user_id", "row_version"),
+        Index("ix_sync_tombstones_deleted_at", "deleted_at"),
+    )
+
+
+# row_version - 64-битный id транзакции БД, которая последней записала строку.
+# Он возрастает монотонно, а снимок (pg_snapshot) точно говорит, какие транзакции
+# уже были видны: изменения, закоммиченные не в порядке выдачи id, не теряются.
+# Триггеры срабатывают и для ORM, и для upsert/COPY из ingest; upsert, который
+# ничего не изменил (WHERE ... IS DISTINCT FROM), версию не трогает. Колонки
+# NOT NULL: BEFORE-триггер ставит версию до проверки ограничения.
+# Параметр транзакции: пока он равен 'on', удаления не записываются в sync_tombstones.
+# Его ставит jobs.bulk_delete_user - записи об удалении для удаляемого пользователя
+# все равно тут же удалил бы каскад.
+SYNC_SKIP_TOMBSTONES_SETTING = "finapp.skip_sync_tombstones"
+
+SYNC_TOMBSTONE_FUNCTION_DDL = f"""
+CREATE OR REPLACE FUNCTION sync_record_tombstone() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    owner_id integer;
+BEGIN
+    IF current_setting('{SYNC_SKIP_TOMBSTONES_SETTING}', true) = 'on' THEN
+        RETURN OLD;
+    END IF;
+    IF TG_TABLE_NAME = 'accounts' THEN
+        SELECT user_id INTO owner_id FROM connected_banks WHERE id = OLD.connection_id;
+    ELSE
+        owner_id := OLD.user_id;
+    END IF;
+    IF owner_id IS NOT NULL THEN
+        INSERT INTO sync_tombstones (user_id, entity, entity_id) VALUES (owner_id, TG_ARGV[0], OLD.id);
+    END IF;
+    RETURN OLD;
+END $$
+"""
+
+SYNC_FUNCTIONS_DDL = [
+    """
+CREATE OR REPLACE FUNCTION sync_set_row_version() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.row_version := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END $$
+""",
+    SYNC_TOMBSTONE_FUNCTION_DDL,
+    # Видна ли запись версии version в снимке snapshot (текстовое представление pg_snapshot)
+    """
+CREATE OR REPLACE FUNCTION sync_row_visible(version bigint, snapshot text) RETURNS boolean
+LANGUAGE sql STABLE AS $$
+    SELECT pg_visible_in_snapshot(version::text::xid8, snapshot::pg_snapshot)
+$$
+""",
+]
+
+SYNC_VERSIONED_TABLES = ("connected_banks", "accounts", "transactions", "sync_tombstones")
+SYNC_TOMBSTONE_TABLES = {"connected_banks": "connection", "accounts": "account"}
+
+
+def sync_trigger_ddl(table_name: str) -> List[str]:
+    """Триггеры версий строк (и записей об удалении) для таблицы."""
+    statements = [
+        f"CREATE TRIGGER trg_{table_name}_row_version BEFORE INSERT OR UPDATE ON {table_name} "
+        f"FOR EACH ROW EXECUTE FUNCTION sync_set_row_version()"
+    ]
+    if table_name in SYNC_TOMBSTONE_TABLES:
+        statements.append(
+            f"CREATE TRIGGER trg_{table_name}_tombstone AFTER DELETE ON {table_name} "
+            f"FOR EACH ROW EXECUTE FUNCTION sync_record_tombstone('{SYNC_TOMBSTONE_TABLES[table_name]}')"
+        )
+    return statements
+
+
+# Новая БД получает функции и триггеры вместе с таблицами; существующую доводит migrations.py
+for _statement in SYNC_FUNCTIONS_DDL:
+    event.listen(Base.metadata, "before_create", DDL(_statement))
+for _table_name in SYNC_VERSIONED_TABLES:
+    for _statement in sync_trigger_ddl(_table_name):
+        event.listen(Base.metadata.tables[_table_name], "after_create", DDL(_statement))
+
+
+# v-- ФОНОВЫЕ ЗАДАЧИ --v
+class ConsentRevocationJob(Base):
+    """
+    Задача на отзыв согласия в банке. Переживает перезапуск сервера и
+    повторяется с экспоненциальной задержкой, пока банк не подтвердит отзыв.
+    """
+    __tablename__ = "consent_revocation_jobs"
+    id = Column(BigInteger, primary_key=True)
+    bank_name = Column(String, nullable=False)
+    consent_id = Column(String, nullable=False) # consent_id или request_id подключения
+    status = Column(String(16), nullable=False, default="pending", server_default="pending") # pending | done | failed
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_consent_revocation_jobs_status_next", "status", "next_attempt_at"),
+    )
@@ -0,0 +1,279 @@
+# finance-app-master/outbound_logging.py
+"""
+Логирование запросов в банки без блокирующего I/O на пути запроса.
+
+Запись только кладется в очередь (QueueHandler), форматирование и вывод
+выполняет отдельный поток (QueueListener). Тела ответов обрезаются до
+LOG_BODY_MAX_BYTES, успешные вызовы логируются с вероятностью
+LOG_SUCCESS_SAMPLE_RATE, ошибки - всегда. Секреты (токены, client_secret) маскируются
+в URL, заголовках и телах (JSON и form-urlencoded); тела ответов эндпоинтов выдачи
+токенов не логируются совсем. Те же query-параметры маскируются в журналах доступа
+uvicorn для входящих запросов (install_access_log_redaction).
+LOG_FORMAT=json включает вывод в формате JSON Lines.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+from metrics import REGISTRY, Counter
+
+LOG_BODY_MAX_BYTES = int(os.getenv("LOG_BODY_MAX_BYTES", "2048"))
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "0.05"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Тела до этого размера маскируются разбором JSON целиком, более длинные - по шаблону
+LOG_REDACT_MAX_BYTES = int(os.getenv("LOG_REDACT_MAX_BYTES", str(64 * 1024)))
+OUTBOUND_LOG_LEVEL = os.getenv("OUTBOUND_LOG_LEVEL", "INFO").upper()
+
+SECRET_HEADERS = {"authorization", "x-consent-id", "cookie", "set-cookie", "proxy-authorization"}
+SECRET_PARAMS = {"client_secret", "access_token", "refresh_token", "password", "token"}
+REDACTED = "***"
+# Поля тел, которые маскируются дополнительно к SECRET_PARAMS: реквизиты владельца счета
+SECRET_BODY_FIELDS = SECRET_PARAMS | {"identification", "secondary_identification"}
+# Ответы этих эндпоинтов целиком состоят из секретов
+SECRET_BODY_PATHS = ("/auth/bank-token",)
+
+_SECRET_KEYS = {name.replace("_", "") for name in SECRET_BODY_FIELDS}
+# Секретный параметр в пути с query string, как его пишут журналы доступа uvicorn
+_SECRET_QUERY_RE = re.compile(
+    r"([?&](?:%s)=)[^&\s\"]*" % "|".join(re.escape(name) for name in sorted(SECRET_PARAMS)), re.IGNORECASE
+)
+# Журнал доступа HTTP и журнал, куда uvicorn пишет открытие WebSocket-соединений
+ACCESS_LOGGERS = ("uvicorn.access", "uvicorn.error")
+_SECRET_VALUE_RE = re.compile(r'("([A-Za-z_]+)"\s*:\s*)"(?:[^"\\]|\\.)*("|$)')
+
+OUTBOUND_LOG_DROPPED = REGISTRY.register(Counter(
+    "finapp_outbound_log_dropped_total", "Outbound log records dropped because the log queue was full.",
+))
+
+
+def redact_headers(headers) -> dict:
+    return {k: (REDACTED if k.lower() in SECRET_HEADERS else v) for k, v in headers.items()}
+
+
+def redact_url(url: httpx.URL) -> str:
+    if not url.query:
+        return str(url)
+    params = [(k, REDACTED if k.lower() in SECRET_PARAMS else v) for k, v in parse_qsl(url.query.decode(), keep_blank_values=True)]
+    return str(url.copy_with(query=urlencode(params, safe="*").encode()))
+
+
+def redact_query_string(text: str) -> str:
+    return _SECRET_QUERY_RE.sub(rf"\1{REDACTED}", text)
+
+
+class AccessLogRedactFilter(logging.Filter):
+    """Маскирует секретные query-параметры (например, token у /users/{id}/events) в аргументах записи."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(redact_query_string(arg) if isinstance(arg, str) else arg for arg in record.args)
+        return True
+
+
+def install_access_log_redaction() -> None:
+    """
+    Вешает AccessLogRedactFilter на журналы uvicorn. Вызывается после настройки логирования
+    uvicorn (при старте приложения): dictConfig сбрасывает фильтры настраиваемых логгеров.
+    """
+    for name in ACCESS_LOGGERS:
+        access_logger = logging.getLogger(name)
+        if not any(isinstance(f, AccessLogRedactFilter) for f in access_logger.filters):
+            access_logger.addFilter(AccessLogRedactFilter())
+
+
+def _is_secret_key(key) -> bool:
+    return isinstance(key, str) and key.lower().replace("_", "") in _SECRET_KEYS
+
+
+def _redact_value(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if _is_secret_key(k) else _redact_value(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact_value(item) for item in value]
+    return value
+
+
+def redact_body(raw: bytes) -> str:
+    """
+    Текст тела с замаскированными секретами. JSON разбирается целиком, тело формы -
+    как пары ключ=значение; обрезанный или иной текст маскируется по шаблону "ключ": "значение".
+    """
+    text = raw.decode("utf-8", errors="replace")
+    stripped = text.lstrip()
+    if stripped[:1] in ("{", "["):
+        try:
+            return json.dumps(_redact_value(json.loads(text)), ensure_ascii=False, separators=(",", ":"))
+        except ValueError:
+            pass
+    elif "=" in text and " " not in text.strip():
+        pairs = parse_qsl(text, keep_blank_values=True)
+        if pairs:
+            return urlencode([(k, REDACTED if _is_secret_key(k) else v) for k, v in pairs], safe="*")
+    return _SECRET_VALUE_RE.sub(
+        lambda m: f'{m.group(1)}"{REDACTED}"' if _is_secret_key(m.group(2)) else m.group(0), text
+    )
+
+
+def _body_for_log(url: httpx.URL, content: bytes) -> dict:
+    """Поля записи с телом. Разбор и маскирование выполняет поток записи, здесь - только срез."""
+    if url.path.endswith(SECRET_BODY_PATHS):
+        return {"body": None, "body_size": len(content), "body_omitted": True}
+    # Короткое тело передается целиком, чтобы его можно было разобрать как JSON
+    body = content if len(content) <= LOG_REDACT_MAX_BYTES else content[:LOG_BODY_MAX_BYTES]
+    return {"body": body, "body_size": len(content)}
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке: стандартный prepare()
+    собирает сообщение сразу, а нам это нужно сделать в потоке слушателя.
+    При переполненной очереди запись отбрасывается, а не блокирует запрос.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            OUTBOUND_LOG_DROPPED.inc()
+
+
+def _body_preview(event: dict) -> str:
+    if event.get("body_omitted"):
+        return f"[omitted, {event.get('body_size', 0)} bytes]"
+    raw = event.get("body")
+    if not raw:
+        return ""
+    text = redact_body(raw)
+    total_size = event.get("body_size", 0)
+    if len(text) > LOG_BODY_MAX_BYTES or total_size > len(raw):
+        text = text[:LOG_BODY_MAX_BYTES] + f"... [truncated, {total_size} bytes total]"
+    return text
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, "event", None)
+        if event is None:
+            return super().format(record)
+        line = f"{record.levelname}: [{event.get('bank') or '-'}] {event['method']} {event['url']} -> {event.get('status') or 'ERROR'}"
+        if event.get("duration_ms") is not None:
+            line += f" in {event['duration_ms']} ms"
+        if event.get("error"):
+            line += f"\n    Error: {event['error']}"
+        if event.get("request_headers") is not None:
+            line += f"\n    Headers: {event['request_headers']}"
+        body = _body_preview(event)
+        if body:
+            line += f"\n    Body: {body}"
+        return line
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        event = getattr(record, "event", None)
+        if event is None:
+            data["message"] = record.getMessage()
+        else:
+            data.update({k: v for k, v in event.items() if k not in ("body", "body_omitted")})
+            data["body"] = _body_preview(event)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+outbound_logger = logging.getLogger("finapp.outbound")
+outbound_logger.setLevel(OUTBOUND_LOG_LEVEL)
+outbound_logger.propagate = False
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+outbound_logger.addHandler(DeferredQueueHandler(_log_queue))
+_listener: Optional[QueueListener] = None
+
+
+def start_outbound_logging() -> None:
+    """Запускает поток, который форматирует и пишет записи из очереди."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonLinesFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    _listener = QueueListener(_log_queue, handler, respect_handler_level=False)
+    _listener.start()
+
+
+def stop_outbound_logging() -> None:
+    """Останавливает поток записи, дописав все, что осталось в очереди."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def should_log(status_code: Optional[int]) -> bool:
+    if status_code is None or status_code >= 400:
+        return True
+    return LOG_SUCCESS_SAMPLE_RATE > 0 and random.random() < LOG_SUCCESS_SAMPLE_RATE
+
+
+def log_exchange(
+    request: httpx.Request,
+    response: Optional[httpx.Response] = None,
+    bank: Optional[str] = None,
+    duration: Optional[float] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    """
+    Ставит в очередь запись об обмене с банком. Здесь выполняются только
+    дешевые операции: выборка, маскирование и срез байтов тела.
+    """
+    status_code = response.status_code if response is not None else None
+    if not should_log(status_code):
+        return
+    event = {
+        "bank": bank,
+        "method": request.method,
+        "url": redact_url(request.url),
+        "status": status_code,
+        "duration_ms": round(duration * 1000, 1) if duration is not None else None,
+    }
+    if error is not None:
+        event["error"] = repr(error)
+    if response is not None:
+        try:
+            content = response.content
+        except httpx.ResponseNotRead:
+            content = b""
+        event.update(_body_for_log(request.url, content))
+    level = logging.INFO if status_code is not None and status_code < 400 else logging.ERROR
+    outbound_logger.log(level, "bank_call", extra={"event": event})
+
+
+def log_request_details(request: httpx.Request) -> None:
+    """Подробная запись исходящего запроса (уровень DEBUG, заголовки замаскированы)."""
+    if not outbound_logger.isEnabledFor(logging.DEBUG):
+        return
+    try:
+        content = request.content
+    except httpx.RequestNotRead:
+        content = b""
+    event = {
+        "method": request.method,
+        "url": redact_url(request.url),
+        "request_headers": redact_headers(request.headers),
+        **_body_for_log(request.url, content),
+    }
+    outbound_logger.debug("bank_request", extra={"event": event})
@@ -0,0 +1,261 @@
+# finance-app-master/profiling.py
+"""
+Профилирование отдельных запросов по требованию администратора.
+
+Запрос с заголовком `X-Profile: 1` и токеном администратора выполняется под cProfile,
+а время раскладывается по участкам (bank_io, db, validation, encoding).
+Результат доступен через GET /admin/profiles/{id}, краткая сводка - в заголовке Server-Timing.
+Число профилей ограничено (не более одного одновременно и PROFILING_MAX_PER_MINUTE в минуту),
+поэтому механизм можно оставлять включенным в продакшене.
+
+cProfile включается только на время шагов задачи самого запроса: пока запрос
+ждет (банк, БД, клиент), в event loop выполняются другие запросы, и в профиль
+они не попадают. Задачи, которые запрос запускает сам (asyncio.gather, create_task),
+и код в пуле потоков в cProfile тоже не видны - их время учитывается участками.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, engine, replica_engine
+from deps import get_current_user, get_current_admin_user
+
+logger = logging.getLogger("uvicorn")
+
+PROFILE_HEADER = "x-profile"
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILING_MAX_PER_MINUTE = int(os.getenv("PROFILING_MAX_PER_MINUTE", "6"))
+PROFILING_STORE_SIZE = int(os.getenv("PROFILING_STORE_SIZE", "50"))
+PROFILING_TOP_FUNCTIONS = int(os.getenv("PROFILING_TOP_FUNCTIONS", "40"))
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, user_email: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.user_email = user_email
+        self.started_at = datetime.now(timezone.utc)
+        self.status_code: Optional[int] = None
+        self.total_seconds = 0.0
+        # имя участка -> [суммарное время, количество вызовов]
+        self.spans: Dict[str, list] = {}
+        self.stats_text = ""
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float) -> None:
+        with self._lock:
+            span = self.spans.setdefault(name, [0.0, 0])
+            span[0] += seconds
+            span[1] += 1
+
+    def server_timing(self) -> str:
+        parts = [f'{name};dur={total * 1000:.1f};desc="{count} calls"' for name, (total, count) in self.spans.items()]
+        parts.append(f"total;dur={self.total_seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "user_email": self.user_email,
+            "started_at": self.started_at,
+            "status_code": self.status_code,
+            "total_ms": round(self.total_seconds * 1000, 2),
+            "spans": {name: {"total_ms": round(total * 1000, 2), "count": count} for name, (total, count) in self.spans.items()},
+        }
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+PROFILE_STORE: Deque[RequestProfile] = deque(maxlen=PROFILING_STORE_SIZE)
+_profile_slot = threading.Lock()
+_recent_starts: Deque[float] = deque()
+_rate_lock = threading.Lock()
+
+
+@contextmanager
+def span(name: str):
+    """Учитывает время блока в профиле текущего запроса. Без активного профиля почти ничего не стоит."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, time.perf_counter() - start)
+
+
+# --- Время SQL-запросов ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profiling_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    starts = conn.info.get("profiling_start")
+    if profile is not None and starts:
+        profile.add_span("db", time.perf_counter() - starts.pop())
+
+
+for _engine in {engine, replica_engine}:
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _take_sampling_slot() -> bool:
+    """Ограничение частоты: не больше PROFILING_MAX_PER_MINUTE профилей за скользящую минуту."""
+    now = time.monotonic()
+    with _rate_lock:
+        while _recent_starts and now - _recent_starts[0] > 60:
+            _recent_starts.popleft()
+        if len(_recent_starts) >= PROFILING_MAX_PER_MINUTE:
+            return False
+        _recent_starts.append(now)
+        return True
+
+
+def _authorize_admin(token: str) -> Optional[str]:
+    """Проверяет токен через те же зависимости, что и эндпоинты. Возвращает email администратора."""
+    db = SessionLocal()
+    try:
+        user = get_current_admin_user(get_current_user(db=db, token=token))
+        return user.email
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
+
+def get_profile(profile_id: str) -> Optional[RequestProfile]:
+    for profile in PROFILE_STORE:
+        if profile.id == profile_id:
+            return profile
+    return None
+
+
+def list_profiles() -> List[dict]:
+    return [profile.summary() for profile in reversed(PROFILE_STORE)]
+
+
+class _ProfiledCoroutine:
+    """
+    Выполняет корутину, включая профилировщик только на время ее шагов
+    (от возобновления до следующего await, который отдает управление loop).
+    """
+    def __init__(self, coro, profiler: cProfile.Profile):
+        self.coro = coro
+        self.profiler = profiler
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profiler.enable()
+            try:
+                if error is not None:
+                    yielded = self.coro.throw(error)
+                else:
+                    yielded = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler.disable()
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                # Отмена задачи и другие исключения передаются в корутину запроса
+                value, error = None, e
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        flag = headers.get(PROFILE_HEADER.encode(), b"").decode().lower()
+        authorization = headers.get(b"authorization", b"").decode()
+        if flag not in ("1", "true", "yes") or not authorization.lower().startswith("bearer "):
+            await self.app(scope, receive, send)
+            return
+
+        admin_email = await run_in_threadpool(_authorize_admin, authorization[7:].strip())
+        if not admin_email:
+            # Не раскрываем наличие механизма: запрос выполняется как обычно
+            await self.app(scope, receive, send)
+            return
+
+        if not _profile_slot.acquire(blocking=False):
+            await self._run_with_status(scope, receive, send, "busy")
+            return
+        if not _take_sampling_slot():
+            _profile_slot.release()
+            await self._run_with_status(scope, receive, send, "rate-limited")
+            return
+
+        try:
+            await self._run_profiled(scope, receive, send, admin_email)
+        finally:
+            _profile_slot.release()
+
+    async def _run_with_status(self, scope, receive, send, status: str):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-status", status.encode())]
+            await send(message)
+        await self.app(scope, receive, send_wrapper)
+
+    async def _run_profiled(self, scope, receive, send, admin_email: str):
+        profile = RequestProfile(scope.get("method", ""), scope.get("path", ""), admin_email)
+        token = _current_profile.set(profile)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                profile.total_seconds = time.perf_counter() - start
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode()),
+                    (b"x-profile-status", b"profiled"),
+                    (b"server-timing", profile.server_timing().encode()),
+                ]
+            await send(message)
+
+        # cProfile видит только шаги этой задачи в потоке event loop; работа синхронных
+        # эндпоинтов в пуле потоков попадает в профиль через участки (db, validation и т.д.).
+        try:
+            await _ProfiledCoroutine(self.app(scope, receive, send_wrapper), profiler)
+        finally:
+            _current_profile.reset(token)
+            profile.total_seconds = time.perf_counter() - start
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILING_TOP_FUNCTIONS)
+            profile.stats_text = stream.getvalue()
+            PROFILE_STORE.append(profile)
+            logger.info(f"Profiled {profile.method} {profile.path} as {profile.id}: {profile.server_timing()}")
@@ -0,0 +1,259 @@
+# finance-app-master/rate_limit.py
+"""
+Ограничение частоты запросов в банки (в пределах процесса).
+
+Для каждого банка действует token bucket на все запросы и отдельные bucket'ы
+на классы операций (token, accounts, balances, transactions, consents).
+Запрос сверх лимита не отклоняется сразу, а ждет в очереди своего пользователя;
+очереди обслуживаются по кругу, так что один пользователь с массовым обновлением
+не задерживает остальных. Если запрос не дождался отправки за BANK_RATE_LIMIT_MAX_WAIT
+секунд, поднимается BankRateLimited (подкласс httpx.RequestError): для обработчиков
+ошибок запроса в банк это обычный сбой запроса, а ответом API он становится только
+на уровне приложения - 503 с Retry-After (обработчик в main.py).
+
+Настройка: BANK_RATE_LIMIT_RPS / BANK_RATE_LIMIT_BURST - лимит банка по умолчанию,
+BANK_RATE_LIMITS - JSON с переопределениями, ключи "bank", "bank:operation" или "*:operation":
+    {"vbank": {"rps": 5, "burst": 10}, "*:transactions": {"rps": 2, "burst": 4}}
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from metrics import BANK_RATE_LIMIT_QUEUE_DEPTH, BANK_RATE_LIMIT_WAIT, BANK_RATE_LIMIT_REJECTED
+
+logger = logging.getLogger("uvicorn")
+
+BANK_RATE_LIMIT_ENABLED = os.getenv("BANK_RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+BANK_RATE_LIMIT_RPS = float(os.getenv("BANK_RATE_LIMIT_RPS", "10"))
+BANK_RATE_LIMIT_BURST = float(os.getenv("BANK_RATE_LIMIT_BURST", "20"))
+BANK_RATE_LIMIT_MAX_WAIT = float(os.getenv("BANK_RATE_LIMIT_MAX_WAIT", "15"))
+
+# Служебные запросы (токен банка, фоновые задачи) идут в отдельной очереди
+SYSTEM_USER = "system"
+
+
+def _load_overrides() -> Dict[str, Dict[str, float]]:
+    raw = os.getenv("BANK_RATE_LIMITS")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"BANK_RATE_LIMITS is not valid JSON, ignoring: {e}")
+        return {}
+
+
+BANK_RATE_LIMIT_OVERRIDES = _load_overrides()
+
+
+class BankRateLimited(httpx.RequestError):
+    """Запрос не дождался своей очереди в лимитере банка."""
+    def __init__(self, bank_name: str, retry_after: int):
+        super().__init__(f"Bank '{bank_name}' is rate limited, try again later.")
+        self.bank_name = bank_name
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - доступен сейчас)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Банк ответил 429: не отправляем ничего, пока не истечет Retry-After."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("operation", "future", "enqueued_at")
+
+    def __init__(self, operation: str, future: asyncio.Future):
+        self.operation = operation
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class BankRateLimiter:
+    """Лимитер одного банка: общий bucket, bucket'ы операций и справедливая очередь по пользователям."""
+    def __init__(self, bank_name: str):
+        self.bank_name = bank_name
+        rps, burst = self._limits(bank_name)
+        self.bank_bucket = TokenBucket(rps, burst)
+        self.operation_buckets: Dict[str, Optional[TokenBucket]] = {}
+        # пользователь -> его очередь; порядок ключей задает очередность обхода
+        self.queues: "OrderedDict[str, deque[_Waiter]]" = OrderedDict()
+        self.queued = 0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def _limits(key: str, default: Tuple[float, float] = (BANK_RATE_LIMIT_RPS, BANK_RATE_LIMIT_BURST)) -> Tuple[float, float]:
+        override = BANK_RATE_LIMIT_OVERRIDES.get(key)
+        if not override:
+            return default
+        return float(override.get("rps", default[0])), float(override.get("burst", default[1]))
+
+    def _operation_bucket(self, operation: str) -> Optional[TokenBucket]:
+        if operation not in self.operation_buckets:
+            key = f"{self.bank_name}:{operation}"
+            wildcard = f"*:{operation}"
+            if key in BANK_RATE_LIMIT_OVERRIDES or wildcard in BANK_RATE_LIMIT_OVERRIDES:
+                rps, burst = self._limits(key if key in BANK_RATE_LIMIT_OVERRIDES else wildcard)
+                self.operation_buckets[operation] = TokenBucket(rps, burst)
+            else:
+                self.operation_buckets[operation] = None
+        return self.operation_buckets[operation]
+
+    def _delay(self, operation: str, now: float) -> float:
+        delay = self.bank_bucket.delay(now)
+        bucket = self._operation_bucket(operation)
+        if bucket is not None:
+            delay = max(delay, bucket.delay(now))
+        return delay
+
+    def _take(self, operation: str, now: float) -> None:
+        self.bank_bucket.take(now)
+        bucket = self._operation_bucket(operation)
+        if bucket is not None:
+            bucket.take(now)
+
+    def pause(self, seconds: float) -> None:
+        self.bank_bucket.pause(seconds)
+
+    async def acquire(self, operation: str, user_key: str, max_wait: float) -> None:
+        now = time.monotonic()
+        if not self.queued and self._delay(operation, now) == 0:
+            self._take(operation, now)
+            BANK_RATE_LIMIT_WAIT.observe(0.0, bank=self.bank_name, operation=operation)
+            return
+
+        waiter = _Waiter(operation, asyncio.get_running_loop().create_future())
+        self.queues.setdefault(user_key, deque()).append(waiter)
+        self.queued += 1
+        BANK_RATE_LIMIT_QUEUE_DEPTH.set(self.queued, bank=self.bank_name)
+        self._ensure_dispatcher()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                self._remove(user_key, waiter)
+                waiter.future.cancel()
+                BANK_RATE_LIMIT_REJECTED.inc(bank=self.bank_name, operation=operation)
+                delay = min(self._delay(operation, time.monotonic()), max_wait)
+                retry_after = max(1, math.ceil(delay + self.queued / max(self.bank_bucket.rate, 0.1)))
+                raise BankRateLimited(self.bank_name, retry_after)
+        except asyncio.CancelledError:
+            if not waiter.future.done():
+                self._remove(user_key, waiter)
+                waiter.future.cancel()
+            raise
+        BANK_RATE_LIMIT_WAIT.observe(time.monotonic() - waiter.enqueued_at, bank=self.bank_name, operation=operation)
+
+    def _remove(self, user_key: str, waiter: _Waiter) -> None:
+        queue = self.queues.get(user_key)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[user_key]
+        self.queued -= 1
+        BANK_RATE_LIMIT_QUEUE_DEPTH.set(self.queued, bank=self.bank_name)
+
+    def _ensure_dispatcher(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self) -> None:
+        """
+        Обходит очереди пользователей по кругу и отпускает первый запрос, который
+        укладывается в лимиты. Пользователь, получивший слот, уходит в конец круга.
+        """
+        while self.queues:
+            now = time.monotonic()
+            min_delay = math.inf
+            released = False
+            for user_key in list(self.queues):
+                waiter = self.queues[user_key][0]
+                delay = self._delay(waiter.operation, now)
+                if delay > 0:
+                    min_delay = min(min_delay, delay)
+                    continue
+                self._take(waiter.operation, now)
+                self._remove(user_key, waiter)
+                if user_key in self.queues:
+                    self.queues.move_to_end(user_key)
+                waiter.future.set_result(None)
+                released = True
+                break
+            if released:
+                continue
+            self._wakeup.clear()
+            try:
+                # Просыпаемся, когда появится токен или в очередь встанет новый запрос
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(min_delay, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+
+_limiters: Dict[str, BankRateLimiter] = {}
+
+
+def get_limiter(bank_name: str) -> BankRateLimiter:
+    limiter = _limiters.get(bank_name)
+    if limiter is None:
+        limiter = _limiters[bank_name] = BankRateLimiter(bank_name)
+    return limiter
+
+
+async def acquire_bank_slot(bank_name: str, operation: str, user_id: Optional[int] = None) -> None:
+    """Ждет разрешения на запрос в банк. Вызывается из BankClient перед каждой отправкой."""
+    if not BANK_RATE_LIMIT_ENABLED:
+        return
+    user_key = str(user_id) if user_id is not None else SYSTEM_USER
+    await get_limiter(bank_name).acquire(operation, user_key, BANK_RATE_LIMIT_MAX_WAIT)
+
+
+def report_throttled(bank_name: str, retry_after: Optional[str]) -> None:
+    """Учитывает ответ 429 от банка: приостанавливает отправку на Retry-After (по умолчанию 1 с)."""
+    if not BANK_RATE_LIMIT_ENABLED:
+        return
+    try:
+        seconds = float(retry_after) if retry_after else 1.0
+    except ValueError:
+        seconds = 1.0
+    get_limiter(bank_name).pause(min(seconds, BANK_RATE_LIMIT_MAX_WAIT))
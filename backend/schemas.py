@@ -1,6 +1,6 @@
 # finance-app-master/schemas.py
 from pydantic import BaseModel, field_validator, Field
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from datetime import datetime, date
 from decimal import Decimal
 
@@ -52,6 +52,7 @@ class BankResponse(BaseModel):
     base_url: str
     auto_approve: bool
     icon_url: Optional[str] = None # <-- Оставляем это поле как было
+    icon_variants: Optional[Dict[str, str]] = Field(None, description="URL иконки по размеру в пикселях")
     
     class Config:
         from_attributes = True
@@ -74,6 +75,12 @@ class AccountSchema(BaseModel):
     balance_data: Optional[Any] = None
     statement_date: Optional[date] = None
     payment_date: Optional[date] = None
+    last_synced_at: Optional[datetime] = None
+    sync_status: Optional[str] = None
+    current_balance_minor: Optional[int] = None
+    available_balance_minor: Optional[int] = None
+    balance_currency: Optional[str] = None
+    balance_as_of: Optional[datetime] = None
     # Поля, которые мы добавим вручную в эндпоинте
     bank_client_id: str
     bank_name: str
@@ -114,6 +121,22 @@ class TransactionListResponse(BaseModel):
     data: TransactionListData
 # --- ^^^ КОНЕЦ НОВЫХ СХЕМ ^^^ ---
 
+class StoredTransaction(BaseModel):
+    account_id: int
+    transactionId: str
+    amount: TransactionAmountDetail
+    creditDebitIndicator: Optional[str] = None
+    status: Optional[str] = None
+    bookingDateTime: datetime
+    valueDateTime: Optional[datetime] = None
+    transactionInformation: Optional[str] = None
+    bankTransactionCode: Optional[str] = None
+
+class TransactionSearchResponse(BaseModel):
+    count: int
+    transactions: List[StoredTransaction]
+    next_cursor: Optional[str] = Field(None, description="Передайте в cursor, чтобы получить следующую страницу")
+
 class TurnoverResponse(BaseModel):
     account_id: str
     total_credit: Decimal = Field(..., description="Общая сумма поступлений (приход)")
@@ -122,6 +145,125 @@ class TurnoverResponse(BaseModel):
     period_from: Optional[datetime] = None
     period_to: Optional[datetime] = None
 
+class CurrencyTurnover(BaseModel):
+    currency: str
+    total_credit: Decimal = Field(..., description="Сумма поступлений в валюте")
+    total_debit: Decimal = Field(..., description="Сумма списаний в валюте")
+    net: Decimal = Field(..., description="Поступления минус списания")
+    transactions_count: int = 0
+
+class AccountTurnoverError(BaseModel):
+    account_id: int
+    api_account_id: str
+    detail: str
+
+class ConsolidatedTurnoverResponse(BaseModel):
+    accounts_count: int
+    by_currency: List[CurrencyTurnover]
+    base_currency: Optional[str] = None
+    converted: Optional[CurrencyTurnover] = Field(None, description="Итог в базовой валюте (если задана)")
+    missing_rates: List[str] = Field(default_factory=list, description="Валюты, для которых нет курса")
+    failed_accounts: List[AccountTurnoverError] = Field(default_factory=list)
+    period_from: Optional[datetime] = None
+    period_to: Optional[datetime] = None
+
+class BalancePoint(BaseModel):
+    period_start: datetime
+    amount: Decimal
+    currency: Optional[str] = None
+
+class BalanceSeries(BaseModel):
+    balance_type: str
+    points: List[BalancePoint]
+
+class BalanceHistoryResponse(BaseModel):
+    account_id: int
+    granularity: str
+    series: List[BalanceSeries]
+
+class CurrencyBalanceTotal(BaseModel):
+    currency: Optional[str] = None
+    current: Decimal = Field(..., description="Сумма текущих остатков (InterimBooked)")
+    available: Decimal = Field(..., description="Сумма доступных остатков (InterimAvailable)")
+    accounts_count: int
+
+class NetWorthResponse(BaseModel):
+    accounts_count: int
+    by_currency: List[CurrencyBalanceTotal]
+    base_currency: Optional[str] = None
+    converted: Optional[CurrencyBalanceTotal] = Field(None, description="Итог в базовой валюте (если задана)")
+    missing_rates: List[str] = Field(default_factory=list, description="Валюты, для которых нет курса")
+    as_of: Optional[datetime] = Field(None, description="Самый старый момент актуальности среди остатков")
+
+class DashboardConnection(BaseModel):
+    id: int
+    bank_name: str
+    status: Optional[str] = None
+    sync_status: Optional[str] = None
+    last_synced_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class DashboardAccount(BaseModel):
+    id: int
+    connection_id: int
+    bank_name: str
+    api_account_id: str
+    nickname: Optional[str] = None
+    account_type: Optional[str] = None
+    currency: Optional[str] = None
+    status: Optional[str] = None
+    current_balance_minor: Optional[int] = None
+    available_balance_minor: Optional[int] = None
+    balance_currency: Optional[str] = None
+    balance_as_of: Optional[datetime] = None
+    sync_status: Optional[str] = None
+    last_synced_at: Optional[datetime] = None
+    recent_transactions: Optional[List[StoredTransaction]] = Field(None, description="Последние транзакции (None - не удалось получить)")
+    turnover: Optional[List[CurrencyTurnover]] = Field(None, description="Обороты за период по валютам")
+
+    class Config:
+        from_attributes = True
+
+class DashboardSectionError(BaseModel):
+    section: str
+    detail: str
+    account_id: Optional[int] = None
+
+class DashboardResponse(BaseModel):
+    sections: Dict[str, str] = Field(..., description="Статус каждого раздела: ok, partial, timeout или error")
+    banks: Optional[List[BankResponse]] = None
+    connections: Optional[List[DashboardConnection]] = None
+    accounts: Optional[List[DashboardAccount]] = None
+    errors: List[DashboardSectionError] = Field(default_factory=list)
+    period_from: datetime
+
 class AccountUpdate(BaseModel):
     statement_date: Optional[date] = None
-    payment_date: Optional[date] = None
\ No newline at end of file
+    payment_date: Optional[date] = None
+
+class SyncConnection(BaseModel):
+    id: int
+    bank_name: str
+    bank_client_id: Optional[str] = None
+    status: Optional[str] = None
+    full_name: Optional[str] = None
+    sync_status: Optional[str] = None
+    last_synced_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class SyncDeleted(BaseModel):
+    connections: List[int] = Field(default_factory=list)
+    accounts: List[int] = Field(default_factory=list, description="Транзакции этих счетов тоже удалены")
+
+class SyncResponse(BaseModel):
+    reset: bool = Field(..., description="true - это полное состояние: локальные данные нужно заменить")
+    connections: List[SyncConnection]
+    accounts: List[AccountSchema]
+    transactions: List[StoredTransaction]
+    deleted: SyncDeleted
+    has_more: bool = Field(False, description="Есть еще транзакции: запросите следующую страницу с новым sync_token")
+    sync_token: str
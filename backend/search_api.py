@@ -0,0 +1,122 @@
+# finance-app-master/search_api.py
+"""
+Поиск по сохраненным транзакциям всех счетов пользователя.
+
+Пагинация ключевая (keyset): курсор хранит (bookingDateTime, id) последней
+выданной записи, и следующая страница начинается строго после нее. В отличие
+от OFFSET, стоимость запроса не растет с номером страницы. Сортировка совпадает
+с индексом ix_transactions_user_booking, текстовый поиск использует триграммный
+индекс ix_transactions_information_trgm.
+"""
+import base64
+import json
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from typing import List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+import models
+from database import get_read_db
+from deps import user_is_admin_or_self
+from schemas import StoredTransaction, TransactionSearchResponse, TransactionAmountDetail
+
+router = APIRouter(
+    prefix="/users/{user_id}/transactions",
+    tags=["transactions"]
+)
+
+
+def encode_cursor(booking_date_time: datetime, row_id: int) -> str:
+    payload = json.dumps({"t": booking_date_time.isoformat(), "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["t"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@router.get("/search", response_model=TransactionSearchResponse, summary="Поиск транзакций по всем счетам пользователя")
+def search_transactions(
+    user_id: int,
+    q: Optional[str] = Query(None, min_length=3, description="Текст в описании транзакции (transactionInformation)"),
+    min_amount: Optional[Decimal] = Query(None, ge=0, description="Минимальная сумма"),
+    max_amount: Optional[Decimal] = Query(None, ge=0, description="Максимальная сумма"),
+    direction: Optional[Literal["Credit", "Debit"]] = Query(None, description="Направление (creditDebitIndicator)"),
+    status: Optional[str] = Query(None, description="Статус транзакции"),
+    bank_transaction_code: Optional[str] = Query(None, description="Код транзакции банка"),
+    from_date: Optional[date] = Query(None, description="Дата проведения с"),
+    to_date: Optional[date] = Query(None, description="Дата проведения по (включительно)"),
+    account_ids: Optional[List[int]] = Query(None, description="Ограничить поиск счетами"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущего ответа"),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Ищет среди транзакций, сохраненных в БД (они сохраняются при каждом запросе
+    транзакций из банка). Результаты отсортированы от новых к старым.
+    """
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise HTTPException(status_code=400, detail="min_amount must not exceed max_amount.")
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date must not be after to_date.")
+
+    transaction = models.Transaction
+    query = select(transaction).where(transaction.user_id == user_id)
+    if q:
+        query = query.where(transaction.transaction_information.ilike(f"%{_escape_like(q)}%", escape="\\"))
+    if min_amount is not None:
+        query = query.where(transaction.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(transaction.amount <= max_amount)
+    if direction:
+        query = query.where(transaction.credit_debit_indicator == direction)
+    if status:
+        query = query.where(transaction.status == status)
+    if bank_transaction_code:
+        query = query.where(transaction.bank_transaction_code == bank_transaction_code)
+    if from_date:
+        query = query.where(transaction.booking_date_time >= datetime.combine(from_date, time.min, tzinfo=timezone.utc))
+    if to_date:
+        query = query.where(transaction.booking_date_time <= datetime.combine(to_date, time.max, tzinfo=timezone.utc))
+    if account_ids:
+        query = query.where(transaction.account_id.in_(account_ids))
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        query = query.where(tuple_(transaction.booking_date_time, transaction.id) < tuple_(cursor_time, cursor_id))
+
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    rows = db.execute(
+        query.order_by(transaction.booking_date_time.desc(), transaction.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [
+        StoredTransaction(
+            account_id=row.account_id,
+            transactionId=row.transaction_id,
+            amount=TransactionAmountDetail(amount=str(row.amount), currency=row.currency or ""),
+            creditDebitIndicator=row.credit_debit_indicator,
+            status=row.status,
+            bookingDateTime=row.booking_date_time,
+            valueDateTime=row.value_date_time,
+            transactionInformation=row.transaction_information,
+            bankTransactionCode=row.bank_transaction_code,
+        )
+        for row in rows
+    ]
+    next_cursor = encode_cursor(rows[-1].booking_date_time, rows[-1].id) if has_more else None
+    return TransactionSearchResponse(count=len(items), transactions=items, next_cursor=next_cursor)
@@ -0,0 +1,212 @@
+# finance-app-master/sync_api.py
+"""
+Инкрементальная синхронизация для мобильного клиента.
+
+Вместо полных списков подключений и счетов при каждом запуске клиент передает
+sync_token из предыдущего ответа и получает только то, что создано, изменено
+или удалено после него. Без токена отдается полное состояние.
+
+Токен хранит снимок БД (pg_snapshot) на момент ответа. Изменившиеся строки - те,
+чей row_version (id записавшей транзакции) в этом снимке еще не был виден;
+удаленные подключения и счета берутся из sync_tombstones. Транзакции отдаются
+страницами по (row_version, id): пока has_more=true, следующие страницы
+продолжают то же окно изменений.
+
+Записи об удалении хранятся SYNC_TOMBSTONE_RETENTION_DAYS. Для более старого
+токена ответ приходит с reset=true: клиент заменяет локальные данные полным
+состоянием.
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import and_, delete, func, not_, select, text, tuple_
+from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
+
+import models
+from database import SessionLocal, get_read_db
+from deps import user_is_admin_or_self
+from encoding import encoded_response, MSGPACK_RESPONSES
+from schemas import (
+    AccountSchema, StoredTransaction, SyncConnection, SyncDeleted, SyncResponse, TransactionAmountDetail,
+)
+
+logger = logging.getLogger("uvicorn")
+
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+SYNC_PRUNE_INTERVAL = float(os.getenv("SYNC_PRUNE_INTERVAL", "3600"))
+
+_SNAPSHOT_RE = re.compile(r"^\d+:\d+:(\d+(,\d+)*)?$")
+
+router = APIRouter(
+    prefix="/users/{user_id}/sync",
+    tags=["sync"]
+)
+
+
+class SyncWindow:
+    """Окно изменений: после снимка since (None - с начала) и не позже снимка upto."""
+    def __init__(self, since: Optional[str], upto: str, issued_at: int, after: Optional[Tuple[int, int]] = None):
+        self.since = since
+        self.upto = upto
+        self.issued_at = issued_at
+        self.after = after
+
+    def changed(self, version_column):
+        conditions = [func.sync_row_visible(version_column, self.upto)]
+        if self.since is not None:
+            # Все версии меньше xmin снимка в нем уже видны - это условие идет по индексу
+            since_xmin = int(self.since.split(":", 1)[0])
+            conditions += [version_column >= since_xmin, not_(func.sync_row_visible(version_column, self.since))]
+        return and_(*conditions)
+
+
+def encode_token(payload: dict) -> str:
+    data = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_token(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        # s=None бывает только у страниц полного состояния
+        snapshots = [payload["u"], payload["s"] or payload["u"]] if "u" in payload else [payload["s"]]
+        if not all(isinstance(s, str) and _SNAPSHOT_RE.match(s) for s in snapshots):
+            raise ValueError("bad snapshot")
+        int(payload["t"])
+        if "a" in payload:
+            payload["a"] = (int(payload["a"][0]), int(payload["a"][1]))
+        return payload
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid sync token.")
+
+
+def _to_stored(row: models.Transaction) -> StoredTransaction:
+    return StoredTransaction(
+        account_id=row.account_id,
+        transactionId=row.transaction_id,
+        amount=TransactionAmountDetail(amount=str(row.amount), currency=row.currency or ""),
+        creditDebitIndicator=row.credit_debit_indicator,
+        status=row.status,
+        bookingDateTime=row.booking_date_time,
+        valueDateTime=row.value_date_time,
+        transactionInformation=row.transaction_information,
+        bankTransactionCode=row.bank_transaction_code,
+    )
+
+
+@router.get("/", response_model=SyncResponse, responses=MSGPACK_RESPONSES, summary="Изменения с момента прошлой синхронизации")
+def get_changes(
+    user_id: int,
+    request: Request,
+    sync_token: Optional[str] = Query(None, description="sync_token из предыдущего ответа; без него - полное состояние"),
+    include_transactions: bool = Query(True, description="Отдавать сохраненные транзакции"),
+    limit: int = Query(500, ge=1, le=2000, description="Максимум транзакций на страницу"),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+) -> Response:
+    """
+    Возвращает подключения и счета (с балансами), созданные или измененные после
+    sync_token, id удаленных подключений и счетов, а также сохраненные транзакции.
+    Транзакции удаленного счета клиент удаляет сам. Клиент применяет ответ и
+    сохраняет новый sync_token; при has_more=true сразу запрашивает следующую страницу.
+    С заголовком Accept: application/msgpack ответ отдается в MessagePack.
+    """
+    token = decode_token(sync_token) if sync_token else None
+    reset = token is None
+    if token is not None and time.time() - token["t"] > SYNC_TOMBSTONE_RETENTION_DAYS * 86400:
+        # Записи об удалениях за этот период могли быть уже очищены
+        token, reset = None, True
+
+    # Все запросы ответа читают один и тот же снимок
+    db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    if token is not None and "u" in token:
+        # Продолжение страниц транзакций: подключения, счета и удаления уже отданы
+        window = SyncWindow(token["s"], token["u"], token["t"], token.get("a"))
+        connections, accounts, deleted = [], [], SyncDeleted()
+    else:
+        current_snapshot = db.execute(text("SELECT pg_current_snapshot()::text")).scalar_one()
+        window = SyncWindow(token["s"] if token else None, current_snapshot, int(time.time()))
+        connection_model, account_model = models.ConnectedBank, models.Account
+        connections = db.execute(
+            select(connection_model)
+            .where(connection_model.user_id == user_id, window.changed(connection_model.row_version))
+            .order_by(connection_model.id)
+        ).scalars().all()
+        accounts = db.execute(
+            select(account_model)
+            .join(connection_model, account_model.connection_id == connection_model.id)
+            .where(connection_model.user_id == user_id, window.changed(account_model.row_version))
+            .options(joinedload(account_model.connection))
+            .order_by(account_model.id)
+        ).scalars().all()
+        deleted = SyncDeleted()
+        if window.since is not None:
+            tombstone = models.SyncTombstone
+            for entity, entity_id in db.execute(
+                select(tombstone.entity, tombstone.entity_id)
+                .where(tombstone.user_id == user_id, window.changed(tombstone.row_version))
+            ):
+                (deleted.connections if entity == "connection" else deleted.accounts).append(entity_id)
+
+    transactions, has_more = [], False
+    if include_transactions:
+        transaction = models.Transaction
+        query = select(transaction).where(transaction.user_id == user_id, window.changed(transaction.row_version))
+        if window.after is not None:
+            query = query.where(tuple_(transaction.row_version, transaction.id) > tuple_(*window.after))
+        # На одну запись больше, чтобы понять, есть ли следующая страница
+        rows = db.execute(
+            query.order_by(transaction.row_version, transaction.id).limit(limit + 1)
+        ).scalars().all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        transactions = [_to_stored(row) for row in rows]
+
+    if has_more:
+        payload = {"s": window.since, "u": window.upto, "t": window.issued_at, "a": [rows[-1].row_version, rows[-1].id]}
+    else:
+        payload = {"s": window.upto, "t": window.issued_at}
+
+    return encoded_response(request, SyncResponse(
+        reset=reset,
+        connections=[SyncConnection.model_validate(c) for c in connections],
+        accounts=[AccountSchema.model_validate(a) for a in accounts],
+        transactions=transactions,
+        deleted=deleted,
+        has_more=has_more,
+        sync_token=encode_token(payload),
+    ))
+
+
+def prune_tombstones() -> int:
+    """Удаляет записи об удалениях старше срока хранения. Возвращает число удаленных."""
+    horizon = datetime.now(timezone.utc) - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS + 1)
+    with SessionLocal() as db:
+        result = db.execute(delete(models.SyncTombstone).where(models.SyncTombstone.deleted_at < horizon))
+        db.commit()
+        return result.rowcount
+
+
+async def run_tombstone_pruner() -> None:
+    """Фоновая задача процесса: периодическая очистка sync_tombstones."""
+    while True:
+        try:
+            removed = await run_in_threadpool(prune_tombstones)
+            if removed:
+                logger.info(f"Pruned {removed} sync tombstones")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Sync tombstone pruning failed: {e}")
+        await asyncio.sleep(SYNC_PRUNE_INTERVAL)
@@ -0,0 +1,78 @@
+# finance-app-master/token_cache.py
+"""
+Общий кэш банковских токенов для нескольких процессов (воркеров uvicorn/gunicorn).
+
+Первый уровень - словарь в памяти процесса (utils.BANK_TOKEN_CACHE), второй - таблица
+bank_tokens. Обновлять токен идет только тот воркер, который захватил
+advisory-lock Postgres для этого банка; остальные ждут, пока в таблице появится свежий токен.
+"""
+import zlib
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+
+import models
+from database import SessionLocal, engine
+
+# Первый аргумент pg_advisory_lock(int, int): пространство ключей приложения
+ADVISORY_LOCK_NAMESPACE = 0x46494E  # "FIN"
+
+
+def _lock_key(bank_name: str) -> int:
+    # crc32 укладывается в 32 бита; приводим к знаковому int4
+    key = zlib.crc32(bank_name.encode())
+    return key - 2**32 if key >= 2**31 else key
+
+
+def read_shared_token(bank_name: str) -> Optional[Tuple[str, datetime]]:
+    db = SessionLocal()
+    try:
+        row = db.get(models.BankToken, bank_name)
+        return (row.token, row.expires_at) if row else None
+    finally:
+        db.close()
+
+
+def try_acquire_refresh_lock(bank_name: str) -> Optional[Connection]:
+    """
+    Пытается стать единственным воркером, который обновляет токен банка.
+    Возвращает соединение, держащее блокировку, или None, если ее держит кто-то другой.
+    """
+    conn = engine.connect()
+    try:
+        acquired = conn.execute(
+            text("SELECT pg_try_advisory_lock(:ns, :key)"),
+            {"ns": ADVISORY_LOCK_NAMESPACE, "key": _lock_key(bank_name)},
+        ).scalar()
+        conn.commit()
+    except Exception:
+        conn.close()
+        raise
+    if not acquired:
+        conn.close()
+        return None
+    return conn
+
+
+def store_shared_token(conn: Connection, bank_name: str, token: str, expires_at: datetime) -> None:
+    stmt = insert(models.BankToken).values(bank_name=bank_name, token=token, expires_at=expires_at)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.BankToken.bank_name],
+        set_={"token": stmt.excluded.token, "expires_at": stmt.excluded.expires_at, "updated_at": text("now()")},
+    )
+    conn.execute(stmt)
+    conn.commit()
+
+
+def release_refresh_lock(conn: Connection, bank_name: str) -> None:
+    try:
+        conn.execute(
+            text("SELECT pg_advisory_unlock(:ns, :key)"),
+            {"ns": ADVISORY_LOCK_NAMESPACE, "key": _lock_key(bank_name)},
+        )
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,118 @@
+# finance-app-master/transaction_store.py
+import logging
+from typing import List, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import models
+from currency import parse_amount
+from database import SessionLocal, mark_user_write
+from schemas import TransactionDetail
+from ingest import upsert_rows
+
+logger = logging.getLogger("uvicorn")
+
+TRANSACTION_KEY = ("account_id", "transaction_id")
+# Поля, которые банк может изменить у уже сохраненной транзакции (например, статус)
+TRANSACTION_UPDATE_COLUMNS = (
+    "booking_date_time", "value_date_time", "amount", "currency", "credit_debit_indicator",
+    "status", "transaction_information", "bank_transaction_code",
+)
+
+
+def transaction_row(account_id: int, user_id: int, transaction: TransactionDetail) -> dict:
+    return {
+        "account_id": account_id,
+        "user_id": user_id,
+        "transaction_id": transaction.transactionId,
+        "booking_date_time": transaction.bookingDateTime,
+        "value_date_time": transaction.valueDateTime,
+        "amount": parse_amount(transaction.amount.amount),
+        "currency": transaction.amount.currency,
+        "credit_debit_indicator": transaction.creditDebitIndicator,
+        "status": transaction.status,
+        "transaction_information": transaction.transactionInformation,
+        "bank_transaction_code": transaction.bankTransactionCode.code if transaction.bankTransactionCode else None,
+    }
+
+
+def _checked(row: dict) -> dict:
+    """ValueError, если строковое значение длиннее своей колонки (иначе DataError на всю пачку)."""
+    columns = models.Transaction.__table__.c
+    for key, value in row.items():
+        length = getattr(columns[key].type, "length", None)
+        if length is not None and isinstance(value, str) and len(value) > length:
+            raise ValueError(f"{key} is longer than {length} characters")
+    return row
+
+
+def store_transactions(db: Session, account_id: int, user_id: int, transactions: List[TransactionDetail]) -> int:
+    """
+    Сохраняет (или обновляет) транзакции счета массовым upsert (см. ingest).
+    Повторная загрузка того же периода не создает дублей благодаря
+    уникальности (account_id, transaction_id). Транзакции с некорректной суммой
+    или слишком длинными полями пропускаются с предупреждением в логе.
+    """
+    rows, skipped = [], []
+    for t in transactions:
+        try:
+            rows.append(_checked(transaction_row(account_id, user_id, t)))
+        except ValueError as e:
+            skipped.append(f"{t.transactionId}: {e}")
+    if skipped:
+        # Одна некорректная транзакция из банка не должна срывать запись всей страницы
+        logger.warning(f"Skipped {len(skipped)} malformed transactions for account {account_id}, e.g. {skipped[0]}")
+    return upsert_rows(db, models.Transaction.__table__, rows, TRANSACTION_KEY, update_columns=TRANSACTION_UPDATE_COLUMNS)
+
+
+def persist_fetched_transactions(
+    db: Session,
+    connection_id: int,
+    api_account_id: str,
+    transactions: List[TransactionDetail],
+) -> Optional[int]:
+    """
+    Сохраняет транзакции, только что полученные из банка. Ошибка записи
+    не должна ломать ответ клиенту, поэтому она логируется, а не пробрасывается.
+    """
+    if not transactions:
+        return 0
+    row = db.query(models.Account.id, models.ConnectedBank.user_id).join(
+        models.ConnectedBank, models.Account.connection_id == models.ConnectedBank.id
+    ).filter(
+        models.Account.connection_id == connection_id,
+        models.Account.api_account_id == api_account_id
+    ).first()
+    if row is None:
+        return None
+    account_id, user_id = row
+    try:
+        stored = store_transactions(db, account_id, user_id, transactions)
+        db.commit()
+        return stored
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.warning(f"Failed to store transactions for account {account_id}: {e}")
+        return None
+
+
+def persist_fetched_transactions_task(
+    user_id: int,
+    connection_id: int,
+    api_account_id: str,
+    transactions: List[TransactionDetail],
+) -> None:
+    """
+    Для BackgroundTasks: сохраняет транзакции после отправки ответа в пуле потоков
+    и в собственной сессии, чтобы upsert тысяч строк не занимал event loop.
+    """
+    db = SessionLocal()
+    db.info["user_id"] = user_id
+    try:
+        stored = persist_fetched_transactions(db, connection_id, api_account_id, transactions)
+        if stored:
+            # upsert идет мимо ORM, поэтому read-your-writes отмечаем явно
+            mark_user_write(user_id)
+    finally:
+        db.close()
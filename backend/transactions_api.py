@@ -1,17 +1,22 @@
 # finance-app-master/backend/transactions_api.py
 
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Optional, List, Set, Tuple
 from datetime import datetime, timezone, time
 from decimal import Decimal
 
 import models
 from database import get_db
 from deps import user_is_admin_or_self
-from utils import get_bank_token
-from schemas import TransactionListResponse, TurnoverResponse, TransactionDetail
+from utils import get_bank_token, bank_http_client
+from rate_limit import BankRateLimited
+from metrics import BANK_TRANSACTION_PAGES
+from profiling import span
+from transaction_store import persist_fetched_transactions_task
+from encoding import encoded_response, MSGPACK_RESPONSES
+from schemas import TransactionListResponse, TransactionListData, TurnoverResponse, TransactionDetail
 
 router = APIRouter(
     prefix="/users/{user_id}/banks/{bank_id}/accounts",
@@ -19,6 +24,57 @@ router = APIRouter(
 )
 
 
+def filter_transactions_page(
+    transactions_on_page: List[dict],
+    processed_transaction_ids: Set[str],
+    from_utc: Optional[datetime],
+    to_utc_inclusive: Optional[datetime],
+) -> List[TransactionDetail]:
+    """
+    Разбирает страницу транзакций из ответа банка: пропускает уже полученные
+    (по transactionId), некорректные и вышедшие за период. ID принятых транзакций
+    добавляются в processed_transaction_ids.
+    """
+    accepted: List[TransactionDetail] = []
+    for trans_data in transactions_on_page:
+        try:
+            transaction_id = trans_data.get("transactionId")
+            if not transaction_id or transaction_id in processed_transaction_ids:
+                continue
+
+            transaction = TransactionDetail(**trans_data)
+
+            # Внутренняя фильтрация остаётся как дополнительная проверка
+            if from_utc and transaction.bookingDateTime < from_utc:
+                continue
+            if to_utc_inclusive and transaction.bookingDateTime > to_utc_inclusive:
+                continue
+
+            processed_transaction_ids.add(transaction_id)
+            accepted.append(transaction)
+        except Exception:
+            continue
+    return accepted
+
+
+def sum_account_turnover(transactions: List[TransactionDetail]) -> Tuple[Decimal, Decimal, Optional[str]]:
+    """Приход, расход и валюта (первой транзакции, где она указана) по списку транзакций."""
+    total_credit = Decimal("0.0")
+    total_debit = Decimal("0.0")
+    currency = None
+
+    for transaction in transactions:
+        if currency is None and transaction.amount.currency:
+            currency = transaction.amount.currency
+
+        amount_decimal = Decimal(transaction.amount.amount)
+        if transaction.creditDebitIndicator.lower() == 'credit':
+            total_credit += amount_decimal
+        elif transaction.creditDebitIndicator.lower() == 'debit':
+            total_debit += amount_decimal
+    return total_credit, total_debit, currency
+
+
 # --- НОВАЯ ЕДИНАЯ ФУНКЦИЯ ДЛЯ ПОЛУЧЕНИЯ ВСЕХ ТРАНЗАКЦИЙ ---
 async def _get_all_transactions_for_period(
     bank_access_token: str,
@@ -59,7 +115,7 @@ async def _get_all_transactions_for_period(
     processed_transaction_ids = set()
     page = 1
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    async with bank_http_client(connection.bank_name, user_id=connection.user_id, timeout=30.0) as client:
         while True:
             current_params = base_params.copy()
             current_params["page"] = page
@@ -73,37 +129,22 @@ async def _get_all_transactions_for_period(
                 if not transactions_on_page:
                     break
                 
-                num_processed_before = len(processed_transaction_ids)
-
-                for trans_data in transactions_on_page:
-                    try:
-                        transaction_id = trans_data.get("transactionId")
-                        if not transaction_id or transaction_id in processed_transaction_ids:
-                            continue
-                        
-                        transaction = TransactionDetail(**trans_data)
-
-                        # Внутренняя фильтрация остаётся как дополнительная проверка
-                        is_in_date_range = True
-                        if from_utc and transaction.bookingDateTime < from_utc:
-                            is_in_date_range = False
-                        if to_utc_inclusive and transaction.bookingDateTime > to_utc_inclusive:
-                            is_in_date_range = False
-                        
-                        if is_in_date_range:
-                            processed_transaction_ids.add(transaction_id)
-                            all_transactions.append(transaction)
-                            
-                    except Exception:
-                        continue
-                
-                if len(processed_transaction_ids) == num_processed_before:
+                with span("validation"):
+                    page_transactions = filter_transactions_page(
+                        transactions_on_page, processed_transaction_ids, from_utc, to_utc_inclusive
+                    )
+                all_transactions.extend(page_transactions)
+
+                if not page_transactions:
                     break
 
                 page += 1
+            except BankRateLimited:
+                raise
             except (httpx.RequestError, httpx.HTTPStatusError) as e:
                 raise Exception(f"Failed to fetch transactions from {connection.bank_name}: {e}")
 
+    BANK_TRANSACTION_PAGES.observe(page, bank=connection.bank_name)
     return all_transactions
 
 
@@ -111,12 +152,15 @@ async def _get_all_transactions_for_period(
 @router.get(
     "/{api_account_id}/transactions",
     response_model=TransactionListResponse,
+    responses=MSGPACK_RESPONSES,
     summary="Получить транзакции по ID счета и ID банка"
 )
 async def get_transactions(
     user_id: int,
     bank_id: int,
     api_account_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
     from_booking_date_time: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
     to_booking_date_time: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
     db: Session = Depends(get_db),
@@ -146,11 +190,15 @@ async def get_transactions(
             from_dt=from_booking_date_time,
             to_dt=to_booking_date_time,
         )
-        transactions_as_dicts = [t.model_dump() for t in all_transactions]
-        return {"data": {"transaction": transactions_as_dicts}}
+    except (HTTPException, BankRateLimited):
+        raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
 
+    background_tasks.add_task(persist_fetched_transactions_task, user_id, connection.id, api_account_id, all_transactions)
+    with span("encoding"):
+        return encoded_response(request, TransactionListResponse(data=TransactionListData(transaction=all_transactions)))
+
 
 # --- ОБНОВЛЕННАЯ ФУНКЦИЯ get_account_turnover ---
 @router.get(
@@ -162,6 +210,7 @@ async def get_account_turnover(
     user_id: int,
     bank_id: int,
     api_account_id: str,
+    background_tasks: BackgroundTasks,
     from_booking_date_time: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
     to_booking_date_time: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
     db: Session = Depends(get_db),
@@ -191,22 +240,13 @@ async def get_account_turnover(
             from_dt=from_booking_date_time,
             to_dt=to_booking_date_time,
         )
+    except (HTTPException, BankRateLimited):
+        raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
-        
-    total_credit = Decimal("0.0")
-    total_debit = Decimal("0.0")
-    currency = None
 
-    for transaction in all_transactions:
-        if currency is None and transaction.amount.currency:
-            currency = transaction.amount.currency
-        
-        amount_decimal = Decimal(transaction.amount.amount)
-        if transaction.creditDebitIndicator.lower() == 'credit':
-            total_credit += amount_decimal
-        elif transaction.creditDebitIndicator.lower() == 'debit':
-            total_debit += amount_decimal
+    background_tasks.add_task(persist_fetched_transactions_task, user_id, db_account.connection_id, api_account_id, all_transactions)
+    total_credit, total_debit, currency = sum_account_turnover(all_transactions)
 
     return TurnoverResponse(
         account_id=api_account_id,
@@ -0,0 +1,195 @@
+# finance-app-master/turnover_api.py
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional, List, Dict, Iterable
+from datetime import datetime
+
+import models
+from database import get_db
+from deps import user_is_admin_or_self
+from utils import get_bank_token
+from currency import RateTable, get_rate_table, to_minor_units, from_minor_units
+from schemas import (
+    ConsolidatedTurnoverResponse, CurrencyTurnover, AccountTurnoverError, TransactionDetail
+)
+from transactions_api import _get_all_transactions_for_period
+
+router = APIRouter(
+    prefix="/users/{user_id}/turnover",
+    tags=["transactions"]
+)
+
+
+class TurnoverBucket:
+    """Накопитель оборотов по одной валюте в целых минимальных единицах."""
+    __slots__ = ("credit", "debit", "count")
+
+    def __init__(self):
+        self.credit = 0
+        self.debit = 0
+        self.count = 0
+
+
+def accumulate_turnover(
+    transactions: Iterable[TransactionDetail],
+    buckets: Dict[str, TurnoverBucket],
+    fallback_currency: Optional[str] = None,
+) -> None:
+    """
+    Раскладывает транзакции по корзинам валют. Сумма каждой транзакции
+    переводится в минимальные единицы её собственной валюты, поэтому
+    смешанные валюты на одном счете не складываются между собой.
+    Некорректная сумма (не число, NaN, Infinity) - ValueError или ArithmeticError.
+    """
+    for transaction in transactions:
+        currency = (transaction.amount.currency or fallback_currency or "N/A").upper()
+        indicator = transaction.creditDebitIndicator.lower()
+        if indicator not in ("credit", "debit"):
+            continue
+        minor = to_minor_units(transaction.amount.amount, currency)
+        bucket = buckets.get(currency)
+        if bucket is None:
+            bucket = buckets[currency] = TurnoverBucket()
+        if indicator == "credit":
+            bucket.credit += minor
+        else:
+            bucket.debit += minor
+        bucket.count += 1
+
+
+def merge_turnover(target: Dict[str, TurnoverBucket], source: Dict[str, TurnoverBucket]) -> None:
+    for currency, bucket in source.items():
+        total = target.get(currency)
+        if total is None:
+            total = target[currency] = TurnoverBucket()
+        total.credit += bucket.credit
+        total.debit += bucket.debit
+        total.count += bucket.count
+
+
+def _bucket_to_schema(currency: str, bucket: TurnoverBucket) -> CurrencyTurnover:
+    return CurrencyTurnover(
+        currency=currency,
+        total_credit=from_minor_units(bucket.credit, currency),
+        total_debit=from_minor_units(bucket.debit, currency),
+        net=from_minor_units(bucket.credit - bucket.debit, currency),
+        transactions_count=bucket.count,
+    )
+
+
+@router.get(
+    "/",
+    response_model=ConsolidatedTurnoverResponse,
+    summary="Сводные обороты по всем (или выбранным) счетам пользователя"
+)
+async def get_consolidated_turnover(
+    user_id: int,
+    account_ids: Optional[List[int]] = Query(None, description="ID счетов в БД. По умолчанию - все счета пользователя"),
+    from_booking_date_time: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
+    to_booking_date_time: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
+    base_currency: Optional[str] = Query(None, min_length=3, max_length=3, description="Валюта для пересчета итога (например, RUB)"),
+    db: Session = Depends(get_db),
+    rate_table: RateTable = Depends(get_rate_table),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Считает приход/расход по нескольким счетам сразу. Транзакции по счетам
+    запрашиваются у банков параллельно, суммы копятся отдельно по каждой валюте.
+    Если задан base_currency, итог дополнительно пересчитывается по локальной таблице курсов.
+    """
+    query = db.query(models.Account).join(models.ConnectedBank).filter(models.ConnectedBank.user_id == user_id)
+    if account_ids:
+        query = query.filter(models.Account.id.in_(account_ids))
+    accounts = query.all()
+
+    if account_ids and not accounts:
+        raise HTTPException(status_code=404, detail="None of the requested accounts were found.")
+
+    failed: List[AccountTurnoverError] = []
+    ready_accounts: List[models.Account] = []
+    for account in accounts:
+        conn = account.connection
+        if conn.status != "active" or not conn.consent_id:
+            failed.append(AccountTurnoverError(account_id=account.id, api_account_id=account.api_account_id, detail="Active connection with consent is required."))
+        else:
+            ready_accounts.append(account)
+
+    # Конфиги и токены запрашиваем один раз на банк, а не на каждый счет.
+    bank_names = {account.connection.bank_name for account in ready_accounts}
+    bank_configs: Dict[str, models.Bank] = {
+        bank.name: bank for bank in db.query(models.Bank).filter(models.Bank.name.in_(bank_names)).all()
+    }
+    bank_tokens: Dict[str, str] = {}
+    bank_errors: Dict[str, str] = {}
+    for bank_name in bank_names:
+        if bank_name not in bank_configs:
+            bank_errors[bank_name] = "Bank configuration not found."
+            continue
+        try:
+            bank_tokens[bank_name] = await get_bank_token(bank_name, db)
+        except HTTPException as e:
+            bank_errors[bank_name] = str(e.detail)
+
+    fetch_accounts: List[models.Account] = []
+    for account in ready_accounts:
+        bank_name = account.connection.bank_name
+        if bank_name in bank_errors:
+            failed.append(AccountTurnoverError(account_id=account.id, api_account_id=account.api_account_id, detail=bank_errors[bank_name]))
+        else:
+            fetch_accounts.append(account)
+
+    results = await asyncio.gather(*[
+        _get_all_transactions_for_period(
+            bank_access_token=bank_tokens[account.connection.bank_name],
+            bank_config=bank_configs[account.connection.bank_name],
+            connection=account.connection,
+            api_account_id=account.api_account_id,
+            from_dt=from_booking_date_time,
+            to_dt=to_booking_date_time,
+        )
+        for account in fetch_accounts
+    ], return_exceptions=True)
+
+    buckets: Dict[str, TurnoverBucket] = {}
+    counted_accounts = 0
+    for account, result in zip(fetch_accounts, results):
+        if isinstance(result, Exception):
+            failed.append(AccountTurnoverError(account_id=account.id, api_account_id=account.api_account_id, detail=str(result)))
+            continue
+        # Счет с некорректной суммой в выписке не попадает в итог частично
+        account_buckets: Dict[str, TurnoverBucket] = {}
+        try:
+            accumulate_turnover(result, account_buckets, fallback_currency=account.currency)
+        except (ValueError, ArithmeticError) as e:
+            failed.append(AccountTurnoverError(account_id=account.id, api_account_id=account.api_account_id, detail=f"Invalid transaction amount: {e}"))
+            continue
+        merge_turnover(buckets, account_buckets)
+        counted_accounts += 1
+
+    converted = None
+    missing_rates: List[str] = []
+    if base_currency:
+        base_currency = base_currency.upper()
+        total = TurnoverBucket()
+        for currency, bucket in buckets.items():
+            credit = rate_table.convert_minor(bucket.credit, currency, base_currency)
+            debit = rate_table.convert_minor(bucket.debit, currency, base_currency)
+            if credit is None or debit is None:
+                missing_rates.append(currency)
+                continue
+            total.credit += credit
+            total.debit += debit
+            total.count += bucket.count
+        converted = _bucket_to_schema(base_currency, total)
+
+    return ConsolidatedTurnoverResponse(
+        accounts_count=counted_accounts,
+        by_currency=[_bucket_to_schema(currency, buckets[currency]) for currency in sorted(buckets)],
+        base_currency=base_currency,
+        converted=converted,
+        missing_rates=missing_rates,
+        failed_accounts=failed,
+        period_from=from_booking_date_time,
+        period_to=to_booking_date_time,
+    )
@@ -3,10 +3,11 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import models
-from database import get_db
+from database import get_db, get_read_db
 from models import User
 from schemas import UserResponse, UserListResponse, UserCreate, UserUpdateAdmin
 from deps import get_current_user, get_current_admin_user
+from jobs import enqueue_user_consent_revocations, bulk_delete_user, wake_worker
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -14,7 +15,7 @@ router = APIRouter(prefix="/users", tags=["users"])
 @router.get("/", response_model=UserListResponse, summary="Get Users (Admins only)")
 def get_users(
     email: Optional[str] = Query(None, description="Filter users by email (exact match)"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     query = db.query(User)
@@ -51,15 +52,16 @@ def delete_my_account(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    from utils import revoke_bank_consent
-    import asyncio
-    connections = db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == current_user.id).all()
-    asyncio.run(asyncio.gather(*[revoke_bank_consent(conn, db) for conn in connections]))
-    
-    db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == current_user.id).delete()
-    db.delete(current_user)
+    """
+    Удаляет аккаунт и все связанные данные одной транзакцией.
+    Согласия в банках отзываются в фоне (очередь с повторами), ответ не ждет банков.
+    """
+    user_id = current_user.id
+    queued = enqueue_user_consent_revocations(db, user_id)
+    bulk_delete_user(db, user_id)
     db.commit()
-    return {"status": "deleted", "message": "Your account has been deleted"}
+    wake_worker()
+    return {"status": "deleted", "message": "Your account has been deleted", "revocations_queued": queued}
 
 @router.put("/{user_id}", response_model=UserResponse, summary="Update a user by ID (Admins only)")
 def update_user_by_admin(
@@ -88,7 +90,7 @@ def update_user_by_admin(
 
 
 @router.delete("/{user_id}", summary="Delete a user by ID (Admins only)")
-async def delete_user_by_admin(
+def delete_user_by_admin(
     user_id: int,
     db: Session = Depends(get_db),
     current_admin: User = Depends(get_current_admin_user)
@@ -100,13 +102,9 @@ async def delete_user_by_admin(
     if target_user.id == current_admin.id:
         raise HTTPException(status_code=400, detail="Admins cannot delete their own account via this endpoint.")
 
-    from utils import revoke_bank_consent
-    import asyncio
-    connections = db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == target_user.id).all()
-    
-    await asyncio.gather(*[revoke_bank_consent(conn, db) for conn in connections])
-    
-    db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == target_user.id).delete()
-    db.delete(target_user)
+    email = target_user.email
+    queued = enqueue_user_consent_revocations(db, target_user.id)
+    bulk_delete_user(db, target_user.id)
     db.commit()
-    return {"status": "deleted", "message": f"User {target_user.email} has been deleted."}
\ No newline at end of file
+    wake_worker()
+    return {"status": "deleted", "message": f"User {email} has been deleted.", "revocations_queued": queued}
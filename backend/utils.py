@@ -1,51 +1,189 @@
 # finance-app-master/utils.py
+import asyncio
 import httpx
 import logging
+import os
+import time
 from sqlalchemy.orm import Session
-from typing import Optional, Dict
-from datetime import datetime, timedelta
+from typing import Optional, Dict, Tuple
+from datetime import datetime, timedelta, timezone
 
 from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
 import models
+import token_cache
 from models import ConnectedBank, Bank
+from metrics import BANK_REQUEST_DURATION, BANK_TOKEN_CACHE_LOOKUPS, classify_bank_operation
+from profiling import span
+from outbound_logging import log_exchange, log_request_details
+from rate_limit import acquire_bank_slot, report_throttled
 
 
 logger = logging.getLogger("uvicorn")
-def log_request(request: httpx.Request): logger.info(f"--> {request.method} {request.url}\n    Headers: {request.headers}\n    Body: {request.content.decode() if request.content else ''}")
-def log_response(response: httpx.Response): logger.info(f"<-- {response.status_code} URL: {response.url}\n    Response JSON: {response.text}")
+def log_request(request: httpx.Request): log_request_details(request)
+def log_response(response: httpx.Response): log_exchange(response.request, response)
+
+
+class BankClient(httpx.AsyncClient):
+    """
+    httpx-клиент для запросов в API банка. Замеряет время и статус каждого
+    запроса с метками банка и операции (token, accounts, balances, transactions, consents)
+    и пишет его в асинхронный лог (см. outbound_logging).
+    Перед отправкой запрос ждет своей очереди в лимитере банка (см. rate_limit).
+    """
+    def __init__(self, bank_name: str, user_id: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.bank_name = bank_name
+        self.user_id = user_id
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        operation = classify_bank_operation(request.url.path)
+        await acquire_bank_slot(self.bank_name, operation, self.user_id)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            with span("bank_io"):
+                response = await super().send(request, **kwargs)
+            status = str(response.status_code)
+            if response.status_code == 429:
+                report_throttled(self.bank_name, response.headers.get("retry-after"))
+            log_exchange(request, response, bank=self.bank_name, duration=time.perf_counter() - start)
+            return response
+        except httpx.HTTPError as e:
+            log_exchange(request, bank=self.bank_name, duration=time.perf_counter() - start, error=e)
+            raise
+        finally:
+            BANK_REQUEST_DURATION.observe(time.perf_counter() - start, bank=self.bank_name, operation=operation, status=status)
+
+
+def bank_http_client(bank_name: str, user_id: Optional[int] = None, **kwargs) -> BankClient:
+    """
+    Создает клиент для запросов в конкретный банк (используется вместо httpx.AsyncClient()).
+    user_id - чей это запрос: лимитер чередует очереди пользователей; без него запрос служебный.
+    """
+    return BankClient(bank_name, user_id=user_id, **kwargs)
 
 
 # --- ПЕРЕНЕСЕНО ИЗ main.py ---
 BANK_TOKEN_CACHE: Dict[str, Dict] = {}
 
-async def get_bank_token(bank_name: str, db: Session) -> str:
-    config = db.query(models.Bank).filter(models.Bank.name == bank_name).first()
-    if not config:
-        raise HTTPException(status_code=500, detail=f"Internal server error: Bank config for '{bank_name}' not found.")
-    
+# "db" - токены общие для всех воркеров через таблицу bank_tokens, "memory" - только кэш процесса
+BANK_TOKEN_CACHE_BACKEND = os.getenv("BANK_TOKEN_CACHE_BACKEND", "db").lower()
+# Сколько ждать, пока другой воркер обновит токен, прежде чем запросить его самостоятельно
+BANK_TOKEN_WAIT_SECONDS = float(os.getenv("BANK_TOKEN_WAIT_SECONDS", "10"))
+_bank_token_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _cached_token(bank_name: str) -> Optional[str]:
     cache_entry = BANK_TOKEN_CACHE.get(bank_name)
-    if cache_entry and cache_entry["expires_at"] > datetime.utcnow(): return cache_entry["token"]
-    
+    if cache_entry and cache_entry["expires_at"] > datetime.now(timezone.utc):
+        return cache_entry["token"]
+    return None
+
+
+async def _request_bank_token(config: models.Bank) -> Tuple[str, datetime]:
     token_url = f"{config.base_url}/auth/bank-token"
     params = {"client_id": config.client_id, "client_secret": config.client_secret}
-    async with httpx.AsyncClient() as client:
+    async with bank_http_client(config.name) as client:
         response = await client.post(token_url, params=params)
     if response.status_code != 200: raise HTTPException(status_code=500, detail=f"Failed to get bank token: {response.text}")
     token_data = response.json()
-    BANK_TOKEN_CACHE[bank_name] = {"token": token_data['access_token'], "expires_at": datetime.utcnow() + timedelta(seconds=token_data['expires_in'] - 60)}
-    return token_data['access_token']
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=token_data['expires_in'] - 60)
+    return token_data['access_token'], expires_at
+
+
+async def _get_shared_bank_token(config: models.Bank) -> Tuple[str, datetime]:
+    """
+    Берет токен из общей таблицы, а если его нет или он истек - обновляет его,
+    но только в том воркере, который выиграл advisory-lock.
+    """
+    bank_name = config.name
+    deadline = time.monotonic() + BANK_TOKEN_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        shared = await run_in_threadpool(token_cache.read_shared_token, bank_name)
+        if shared and shared[1] > datetime.now(timezone.utc):
+            BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="shared_hit")
+            return shared
 
-async def fetch_accounts(bank_access_token: str, consent_id: str, bank_client_id: str, bank_config: models.Bank) -> dict:
+        lock_conn = await run_in_threadpool(token_cache.try_acquire_refresh_lock, bank_name)
+        if lock_conn is None:
+            await asyncio.sleep(0.2)
+            continue
+        try:
+            # Пока мы ждали блокировку, токен мог обновить другой воркер
+            shared = await run_in_threadpool(token_cache.read_shared_token, bank_name)
+            if shared and shared[1] > datetime.now(timezone.utc):
+                BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="shared_hit")
+                return shared
+            BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="miss")
+            token, expires_at = await _request_bank_token(config)
+            await run_in_threadpool(token_cache.store_shared_token, lock_conn, bank_name, token, expires_at)
+            return token, expires_at
+        finally:
+            await run_in_threadpool(token_cache.release_refresh_lock, lock_conn, bank_name)
+
+    logger.warning(f"Timed out waiting for shared token refresh of '{bank_name}', requesting directly.")
+    BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="miss")
+    return await _request_bank_token(config)
+
+
+async def get_bank_token(bank_name: str, db: Session) -> str:
+    token = _cached_token(bank_name)
+    if token:
+        BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="hit")
+        return token
+
+    config = db.query(models.Bank).filter(models.Bank.name == bank_name).first()
+    if not config:
+        raise HTTPException(status_code=500, detail=f"Internal server error: Bank config for '{bank_name}' not found.")
+
+    # Внутри процесса токен обновляет только одна корутина, остальные ждут ее результат
+    lock = _bank_token_locks.setdefault(bank_name, asyncio.Lock())
+    async with lock:
+        token = _cached_token(bank_name)
+        if token:
+            BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="hit")
+            return token
+        if BANK_TOKEN_CACHE_BACKEND == "db":
+            token, expires_at = await _get_shared_bank_token(config)
+        else:
+            BANK_TOKEN_CACHE_LOOKUPS.inc(bank=bank_name, result="miss")
+            token, expires_at = await _request_bank_token(config)
+        BANK_TOKEN_CACHE[bank_name] = {"token": token, "expires_at": expires_at}
+    return token
+
+async def fetch_accounts(bank_access_token: str, consent_id: str, bank_client_id: str, bank_config: models.Bank, user_id: Optional[int] = None) -> dict:
     accounts_url = f"{bank_config.base_url}/accounts"
     headers = {"Authorization": f"Bearer {bank_access_token}", "X-Requesting-Bank": bank_config.client_id, "X-Consent-Id": consent_id}
     params = {"client_id": bank_client_id}
-    async with httpx.AsyncClient() as client:
+    async with bank_http_client(bank_config.name, user_id=user_id) as client:
         response = await client.get(accounts_url, headers=headers, params=params)
     if response.status_code != 200: raise HTTPException(status_code=500, detail=f"Failed to fetch accounts: {response.text}")
     return response.json()
 # --- КОНЕЦ ПЕРЕНЕСЕННОГО КОДА ---
 
 
+async def revoke_consent(config: Bank, id_to_revoke: str) -> bool:
+    """
+    Отзывает согласие (consent или request) в банке.
+    Возвращает True, если банк подтвердил отзыв или согласия уже нет (204/404).
+    """
+    revoke_url = f"{config.base_url.strip()}/account-consents/{id_to_revoke}"
+    headers = {"x-fapi-interaction-id": config.client_id}
+
+    try:
+        async with bank_http_client(config.name) as client:
+            response = await client.delete(revoke_url, headers=headers)
+        logger.info(f"Revoked consent {id_to_revoke} at {revoke_url}: status {response.status_code}")
+        if response.status_code not in (204, 404):
+            logger.error(f"Unexpected status on revoke: {response.status_code}, body: {response.text}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"Failed to revoke consent {id_to_revoke} for bank {config.name}: {e}")
+        return False
+
+
 async def revoke_bank_consent(connection: ConnectedBank, db: Session) -> None:
     """
     Отзывает согласие (consent или request) в банке по данным подключения.
@@ -60,14 +198,4 @@ async def revoke_bank_consent(connection: ConnectedBank, db: Session) -> None:
         logger.warning(f"Bank config for '{bank_name}' not found in DB for conn {connection.id}. Skipping revocation.")
         return
 
-    revoke_url = f"{config.base_url.strip()}/account-consents/{id_to_revoke}"
-    headers = {"x-fapi-interaction-id": config.client_id}
-
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(revoke_url, headers=headers)
-        logger.info(f"Revoked consent {id_to_revoke} at {revoke_url}: status {response.status_code}")
-        if response.status_code not in (204, 404):
-            logger.error(f"Unexpected status on revoke: {response.status_code}, body: {response.text}")
-    except Exception as e:
-        logger.error(f"Failed to revoke consent {id_to_revoke} for bank {bank_name}: {e}")
\ No newline at end of file
+    await revoke_consent(config, id_to_revoke)
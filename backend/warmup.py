@@ -0,0 +1,190 @@
+# finance-app-master/warmup.py
+"""
+Прогрев данных пользователя сразу после входа.
+
+Сразу после /auth/login клиент запрашивает счета и транзакции, и эти первые
+запросы платят за холодный токен банка и за обращения к банку. Если прогрев
+включен (WARMUP_ON_LOGIN или параметр warm_up у /auth/login), login запускает
+фоновую задачу, которая по активным подключениям пользователя:
+  - получает токены банков (в кэш процесса и общую таблицу bank_tokens);
+  - обновляет устаревшие счета (refresh_connection_accounts, свежие пропускаются);
+  - догружает транзакции за последние WARMUP_TRANSACTION_DAYS дней в таблицу
+    transactions - с последней сохраненной даты, а не за весь период.
+
+Для одного пользователя одновременно идет не больше одного прогрева и не больше
+WARMUP_MAX_PER_USER за WARMUP_WINDOW_SECONDS. Подключения всех пользователей
+прогреваются не более чем по WARMUP_CONCURRENCY одновременно, чтобы волна
+входов не отнимала лимиты банков у обычных запросов.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Set
+
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+
+import models
+from account_sync import refresh_connection_accounts
+from database import SessionLocal, mark_user_write
+from metrics import LOGIN_WARMUPS, LOGIN_WARMUP_DURATION
+from transaction_store import store_transactions
+from transactions_api import _get_all_transactions_for_period
+from utils import get_bank_token
+
+logger = logging.getLogger("uvicorn")
+
+WARMUP_ON_LOGIN = os.getenv("WARMUP_ON_LOGIN", "false").lower() in ("1", "true", "yes")
+WARMUP_MAX_PER_USER = int(os.getenv("WARMUP_MAX_PER_USER", "3"))
+WARMUP_WINDOW_SECONDS = float(os.getenv("WARMUP_WINDOW_SECONDS", "3600"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "8"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "60"))
+WARMUP_TRANSACTION_DAYS = int(os.getenv("WARMUP_TRANSACTION_DAYS", "30"))
+# Перекрытие с уже сохраненными транзакциями: банк мог изменить статус недавних
+WARMUP_OVERLAP = timedelta(days=1)
+
+_running: Dict[int, asyncio.Task] = {}
+_history: Dict[int, Deque[float]] = {}
+_tasks: Set[asyncio.Task] = set()
+_connection_slots = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+
+def _within_limit(user_id: int) -> bool:
+    """Учитывает прогрев в окне WARMUP_WINDOW_SECONDS; False - лимит пользователя исчерпан."""
+    now = time.monotonic()
+    # Пользователи без прогревов в окне больше не влияют на лимит
+    if len(_history) > 10000:
+        for key in [k for k, starts in _history.items() if not starts or starts[-1] < now - WARMUP_WINDOW_SECONDS]:
+            del _history[key]
+    starts = _history.setdefault(user_id, deque())
+    while starts and starts[0] < now - WARMUP_WINDOW_SECONDS:
+        starts.popleft()
+    if len(starts) >= WARMUP_MAX_PER_USER:
+        return False
+    starts.append(now)
+    return True
+
+
+def start_warmup(user_id: int) -> str:
+    """
+    Запускает прогрев в фоне, не дожидаясь его. Возвращает started, running
+    (прогрев пользователя уже идет) или limited (исчерпан лимит за окно).
+    """
+    if user_id in _running:
+        result = "running"
+    elif not _within_limit(user_id):
+        result = "limited"
+    else:
+        task = asyncio.create_task(_warm_up_user(user_id))
+        _running[user_id] = task
+        _tasks.add(task)
+        task.add_done_callback(lambda t: (_tasks.discard(t), _running.pop(user_id, None)))
+        result = "started"
+    LOGIN_WARMUPS.inc(result=result)
+    return result
+
+
+async def cancel_warmups() -> None:
+    """Останавливает незавершенные прогревы при остановке воркера."""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _active_connection_ids(user_id: int) -> List[int]:
+    db = SessionLocal()
+    try:
+        rows = db.query(models.ConnectedBank.id).filter(
+            models.ConnectedBank.user_id == user_id,
+            models.ConnectedBank.status == "active",
+            models.ConnectedBank.consent_id.isnot(None),
+        ).all()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+# _fetch_from и _store_window выполняются в пуле потоков и открывают свою сессию:
+# при отмене прогрева (WARMUP_TIMEOUT) поток доработает с ней сам, а сессия
+# event loop закрывается, не деля соединение с потоком
+def _fetch_from(account_id: int, window_start: datetime) -> datetime:
+    with SessionLocal() as db:
+        latest = db.query(func.max(models.Transaction.booking_date_time)).filter(
+            models.Transaction.account_id == account_id
+        ).scalar()
+    if latest is None:
+        return window_start
+    return max(window_start, latest - WARMUP_OVERLAP)
+
+
+def _store_window(account_id: int, user_id: int, transactions) -> int:
+    with SessionLocal() as db:
+        db.info["user_id"] = user_id
+        stored = store_transactions(db, account_id, user_id, transactions)
+        db.commit()
+    if stored:
+        # Запись идет мимо ORM, поэтому read-your-writes отмечаем явно
+        mark_user_write(user_id)
+    return stored
+
+
+async def _warm_connection(user_id: int, connection_id: int, window_start: datetime) -> None:
+    async with _connection_slots:
+        db = SessionLocal()
+        db.info["user_id"] = user_id
+        try:
+            conn = db.get(models.ConnectedBank, connection_id)
+            if conn is None:
+                return
+            bank_config = db.query(models.Bank).filter(models.Bank.name == conn.bank_name).first()
+            if bank_config is None:
+                return
+            token = await get_bank_token(conn.bank_name, db)
+            await refresh_connection_accounts(db, conn, bank_config)
+
+            for account in list(conn.accounts):
+                from_dt = await run_in_threadpool(_fetch_from, account.id, window_start)
+                transactions = await _get_all_transactions_for_period(
+                    bank_access_token=token,
+                    bank_config=bank_config,
+                    connection=conn,
+                    api_account_id=account.api_account_id,
+                    from_dt=from_dt,
+                    to_dt=None,
+                )
+                if transactions:
+                    await run_in_threadpool(_store_window, account.id, user_id, transactions)
+        finally:
+            db.close()
+
+
+async def _warm_up_user(user_id: int) -> None:
+    start = time.monotonic()
+    window_start = datetime.now(timezone.utc) - timedelta(days=WARMUP_TRANSACTION_DAYS)
+    try:
+        connection_ids = await run_in_threadpool(_active_connection_ids, user_id)
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                *(_warm_connection(user_id, connection_id, window_start) for connection_id in connection_ids),
+                return_exceptions=True,
+            ),
+            timeout=WARMUP_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        LOGIN_WARMUPS.inc(result="timeout")
+        logger.warning(f"Warm-up for user {user_id} timed out after {WARMUP_TIMEOUT} s")
+        return
+    except Exception as e:
+        LOGIN_WARMUPS.inc(result="error")
+        logger.warning(f"Warm-up for user {user_id} failed: {e}")
+        return
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    for failure in failures:
+        logger.warning(f"Warm-up for user {user_id}: connection failed: {failure}")
+    LOGIN_WARMUPS.inc(result="error" if failures else "ok")
+    LOGIN_WARMUP_DURATION.observe(time.monotonic() - start)
@@ -0,0 +1,5 @@
+#!/bin/bash
+# Разрешает потоковую репликацию для сервиса postgres-replica (compose profile "replica").
+# Выполняется один раз при инициализации пустого тома основной БД.
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
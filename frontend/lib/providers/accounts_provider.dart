@@ -74,6 +74,8 @@ class AccountsProvider with ChangeNotifier {
               authProvider!.token!,
               authProvider!.userId!,
               conn.id,
+              // Ручное обновление всегда идет в банк, при запуске - только если данные устарели
+              force: !isInitialLoad,
             ),
           );
         } else if (conn.status == 'awaitingauthorization') {
@@ -131,10 +131,13 @@ class ApiService {
   Future<void> refreshConnection(
     String token,
     int userId,
-    int connectionId,
-  ) async {
+    int connectionId, {
+    bool force = false,
+  }) async {
     final response = await http.post(
-      Uri.parse('$API_BASE_URL/users/$userId/accounts/$connectionId/refresh'),
+      Uri.parse(
+        '$API_BASE_URL/users/$userId/accounts/$connectionId/refresh${force ? '?force=true' : ''}',
+      ),
       headers: {'Authorization': 'Bearer $token'},
     );
     if (response.statusCode != 200) {
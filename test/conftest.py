@@ -0,0 +1,10 @@
+# finance-app-master/test/conftest.py
+"""Модульные тесты (pytest) импортируют модули бэкенда напрямую, без БД и сети."""
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+# Модулям бэкенда нужны настройки при импорте; соединение с БД не открывается
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+os.environ.setdefault("SECRET_KEY", "unit-test-secret")
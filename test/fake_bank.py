@@ -0,0 +1,239 @@
+# finance-app-master/test/fake_bank.py
+"""
+Локальная замена песочниц *.open.bankingapi.ru для нагрузочных тестов.
+
+Реализует эндпоинты, которые использует бэкенд:
+  POST   /{bank}/auth/bank-token
+  POST   /{bank}/account-consents/request
+  GET    /{bank}/account-consents/{id}
+  DELETE /{bank}/account-consents/{id}
+  GET    /{bank}/accounts
+  GET    /{bank}/accounts/{id}/balances
+  GET    /{bank}/accounts/{id}/transactions  (постранично)
+
+Данные генерируются детерминированно из ID счета, поэтому ничего не хранится в памяти.
+Чтобы бэкенд ходил сюда, base_url банков в БД должен указывать на
+http://<host>:<port>/<bank_name> (см. test/load_test.py --setup-db).
+
+Запуск:
+    python test/fake_bank.py --port 9100 --latency-ms 50 --transactions 2000
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, Response
+
+
+class FakeBankSettings:
+    def __init__(self):
+        self.latency_ms = float(os.getenv("FAKE_BANK_LATENCY_MS", "20"))
+        self.jitter_ms = float(os.getenv("FAKE_BANK_JITTER_MS", "10"))
+        self.error_rate = float(os.getenv("FAKE_BANK_ERROR_RATE", "0"))
+        self.accounts_per_client = int(os.getenv("FAKE_BANK_ACCOUNTS", "3"))
+        self.transactions_per_account = int(os.getenv("FAKE_BANK_TRANSACTIONS", "500"))
+        self.max_page_size = int(os.getenv("FAKE_BANK_PAGE_SIZE", "100"))
+        self.history_days = int(os.getenv("FAKE_BANK_HISTORY_DAYS", "365"))
+        self.token_ttl = int(os.getenv("FAKE_BANK_TOKEN_TTL", "3600"))
+        self.auto_approve = os.getenv("FAKE_BANK_AUTO_APPROVE", "1") != "0"
+
+
+settings = FakeBankSettings()
+# Все транзакции отсчитываются от момента старта сервера - данные стабильны между запросами
+ANCHOR = datetime.now(timezone.utc).replace(microsecond=0)
+# request_id -> consent_id для согласий, ожидающих подтверждения
+PENDING_REQUESTS = {}
+
+app = FastAPI(title="Fake Open Banking API")
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()[:12], 16)
+
+
+async def _simulate(request: Request) -> Optional[Response]:
+    """Искусственная задержка и случайные ошибки согласно настройкам."""
+    delay = settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if settings.error_rate and random.random() < settings.error_rate:
+        status = random.choice((429, 500, 503))
+        return JSONResponse(status_code=status, content={"error": "simulated failure", "path": request.url.path})
+    return None
+
+
+def _account_ids(bank: str, client_id: str):
+    return [f"{bank}-{client_id}-acc{i}" for i in range(settings.accounts_per_client)]
+
+
+def _account(bank: str, client_id: str, account_id: str) -> dict:
+    rnd = random.Random(_seed(account_id))
+    return {
+        "accountId": account_id,
+        "status": "Enabled",
+        "currency": "RUB",
+        "accountType": "Personal",
+        "accountSubType": rnd.choice(["Checking", "Savings", "CreditCard"]),
+        "nickname": f"Счет {account_id[-4:]}",
+        "openingDate": "2023-01-15",
+        "account": [{
+            "schemeName": "RU.CBR.PAN",
+            "identification": str(rnd.randrange(10**19, 10**20)),
+            "name": f"Клиент {client_id}",
+        }],
+    }
+
+
+def _balances(account_id: str) -> list:
+    rnd = random.Random(_seed(account_id, "balance"))
+    amount = f"{rnd.uniform(0, 500000):.2f}"
+    moment = ANCHOR.isoformat()
+    return [
+        {"accountId": account_id, "type": "InterimAvailable", "dateTime": moment,
+         "amount": {"amount": amount, "currency": "RUB"}, "creditDebitIndicator": "Credit"},
+        {"accountId": account_id, "type": "InterimBooked", "dateTime": moment,
+         "amount": {"amount": amount, "currency": "RUB"}, "creditDebitIndicator": "Credit"},
+    ]
+
+
+def _transaction_step() -> float:
+    return settings.history_days * 86400 / max(settings.transactions_per_account, 1)
+
+
+def _transaction(account_id: str, index: int) -> dict:
+    rnd = random.Random(_seed(account_id, index))
+    booking = ANCHOR - timedelta(seconds=index * _transaction_step())
+    credit = rnd.random() < 0.3
+    return {
+        "accountId": account_id,
+        "transactionId": f"{account_id}-tx{index}",
+        "amount": {"amount": f"{rnd.uniform(10, 20000):.2f}", "currency": "RUB"},
+        "creditDebitIndicator": "Credit" if credit else "Debit",
+        "status": "Booked",
+        "bookingDateTime": booking.isoformat(),
+        "valueDateTime": booking.isoformat(),
+        "transactionInformation": rnd.choice(["Оплата в магазине", "Перевод", "Кафе", "Зарплата", "Такси", "Коммунальные услуги"]),
+        "bankTransactionCode": {"code": "ReceivedCreditTransfer" if credit else "IssuedDebitTransfer"},
+    }
+
+
+def _parse_dt(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+
+
+@app.post("/{bank}/auth/bank-token")
+async def bank_token(bank: str, request: Request, client_id: str = Query(...), client_secret: str = Query(...)):
+    if (failure := await _simulate(request)):
+        return failure
+    return {"access_token": uuid.uuid4().hex, "token_type": "bearer", "expires_in": settings.token_ttl}
+
+
+@app.post("/{bank}/account-consents/request")
+async def create_consent(bank: str, request: Request):
+    if (failure := await _simulate(request)):
+        return failure
+    consent_id = f"consent-{uuid.uuid4().hex[:16]}"
+    if settings.auto_approve:
+        return {"auto_approved": True, "consent_id": consent_id, "status": "approved"}
+    request_id = f"req-{uuid.uuid4().hex[:16]}"
+    PENDING_REQUESTS[request_id] = consent_id
+    return {"auto_approved": False, "request_id": request_id, "status": "pending"}
+
+
+@app.get("/{bank}/account-consents/{consent_id}")
+async def get_consent(bank: str, consent_id: str, request: Request):
+    if (failure := await _simulate(request)):
+        return failure
+    resolved = PENDING_REQUESTS.get(consent_id, consent_id)
+    return {"data": {"consentId": resolved, "status": "Authorized"}}
+
+
+@app.delete("/{bank}/account-consents/{consent_id}")
+async def revoke_consent(bank: str, consent_id: str, request: Request):
+    if (failure := await _simulate(request)):
+        return failure
+    PENDING_REQUESTS.pop(consent_id, None)
+    return Response(status_code=204)
+
+
+@app.get("/{bank}/accounts")
+async def list_accounts(bank: str, request: Request, client_id: str = Query(...)):
+    if (failure := await _simulate(request)):
+        return failure
+    return {"data": {"account": [_account(bank, client_id, acc_id) for acc_id in _account_ids(bank, client_id)]}}
+
+
+@app.get("/{bank}/accounts/{account_id}/balances")
+async def account_balances(bank: str, account_id: str, request: Request):
+    if (failure := await _simulate(request)):
+        return failure
+    return {"data": {"balance": _balances(account_id)}}
+
+
+@app.get("/{bank}/accounts/{account_id}/transactions")
+async def account_transactions(
+    bank: str,
+    account_id: str,
+    request: Request,
+    page: int = Query(1, ge=1),
+    limit: int = Query(100, ge=1),
+    from_booking_date_time: Optional[str] = None,
+    to_booking_date_time: Optional[str] = None,
+):
+    if (failure := await _simulate(request)):
+        return failure
+    step = _transaction_step()
+    first, last = 0, settings.transactions_per_account - 1
+    to_dt, from_dt = _parse_dt(to_booking_date_time), _parse_dt(from_booking_date_time)
+    if to_dt:
+        first = max(first, math.ceil((ANCHOR - to_dt).total_seconds() / step))
+    if from_dt:
+        last = min(last, math.floor((ANCHOR - from_dt).total_seconds() / step))
+
+    page_size = min(limit, settings.max_page_size)
+    start = first + (page - 1) * page_size
+    end = min(start + page_size - 1, last)
+    transactions = [_transaction(account_id, i) for i in range(start, end + 1)] if start <= last else []
+    return {"data": {"transaction": transactions}, "meta": {"page": page, "limit": page_size}}
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Open Banking API for local load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate, help="Доля запросов, завершающихся 429/500/503")
+    parser.add_argument("--accounts", type=int, default=settings.accounts_per_client, help="Счетов на одного клиента")
+    parser.add_argument("--transactions", type=int, default=settings.transactions_per_account, help="Транзакций на счет")
+    parser.add_argument("--page-size", type=int, default=settings.max_page_size, help="Максимальный размер страницы")
+    parser.add_argument("--history-days", type=int, default=settings.history_days)
+    parser.add_argument("--manual-approve", action="store_true", help="Согласия требуют проверки статуса (как sbank)")
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.error_rate = args.error_rate
+    settings.accounts_per_client = args.accounts
+    settings.transactions_per_account = args.transactions
+    settings.max_page_size = args.page_size
+    settings.history_days = args.history_days
+    settings.auto_approve = not args.manual_approve
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# finance-app-master/test/load_test.py
+"""
+Нагрузочный прогон бэкенда против локального фейкового банка (test/fake_bank.py).
+
+Сценарии: login, refresh, transactions, turnover. Для каждого сценария
+печатается пропускная способность и перцентили p50/p95/p99.
+
+refresh по умолчанию идет с force=true: иначе почти все ответы в окне свежести
+(ACCOUNTS_FRESHNESS_SECONDS) отдаются из БД, и замер показывает не опрос банка.
+--no-refresh-force оставляет обычное поведение; поле source ответов (bank/shared/stored)
+подсчитывается в отчете в обоих случаях.
+
+Пример:
+    python test/fake_bank.py --port 9100 &
+    cd backend && uvicorn main:app --port 8001 &
+    python test/load_test.py --setup-db --fake-bank-url http://127.0.0.1:9100 \\
+        --users 20 --concurrency 20 --duration 30 --json bench_output.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+SCENARIOS = ("login", "refresh", "transactions", "turnover")
+
+
+class VirtualUser:
+    def __init__(self, email: str, password: str):
+        self.email = email
+        self.password = password
+        self.user_id: Optional[int] = None
+        self.token: Optional[str] = None
+        self.connections: List[int] = []
+        # (connection_id, bank_id, api_account_id)
+        self.accounts: List[tuple] = []
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class ScenarioStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status_counts: Dict[str, int] = {}
+        # Откуда взят ответ refresh: bank, shared или stored
+        self.source_counts: Dict[str, int] = {}
+        self.elapsed = 0.0
+
+    def record(self, latency: float, status: str, ok: bool):
+        self.latencies.append(latency)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], pct: float) -> float:
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+        return sorted_values[index]
+
+    def summary(self) -> dict:
+        values = sorted(self.latencies)
+        return {
+            "scenario": self.name,
+            "requests": len(values),
+            "errors": self.errors,
+            "throughput_rps": round(len(values) / self.elapsed, 2) if self.elapsed else 0.0,
+            "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+            "p50_ms": round(self._percentile(values, 50) * 1000, 2),
+            "p95_ms": round(self._percentile(values, 95) * 1000, 2),
+            "p99_ms": round(self._percentile(values, 99) * 1000, 2),
+            "statuses": self.status_counts,
+            "sources": self.source_counts,
+        }
+
+
+def configure_banks(fake_bank_url: str) -> None:
+    """Переключает base_url всех банков в БД бэкенда на фейковый банк."""
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+    sys.path.insert(0, backend_dir)
+    import models
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for bank in db.query(models.Bank).all():
+            bank.base_url = f"{fake_bank_url.rstrip('/')}/{bank.name}"
+        db.commit()
+    finally:
+        db.close()
+
+
+async def prepare_user(client: httpx.AsyncClient, user: VirtualUser, banks: List[str]) -> None:
+    await client.post("/auth/register", json={"email": user.email, "password": user.password})
+    response = await client.post("/auth/login", data={"username": user.email, "password": user.password})
+    response.raise_for_status()
+    body = response.json()
+    user.token, user.user_id = body["access_token"], body["user_id"]
+
+    for bank_name in banks:
+        response = await client.post(
+            f"/users/{user.user_id}/connections/",
+            json={"bank_name": bank_name, "bank_client_id": f"{user.email.split('@')[0]}-{bank_name}"},
+            headers=user.headers,
+        )
+        response.raise_for_status()
+        connection_id = response.json()["connection_id"]
+        if response.json().get("status") == "awaiting_authorization":
+            await client.post(f"/users/{user.user_id}/connections/{connection_id}", headers=user.headers)
+        user.connections.append(connection_id)
+        response = await client.post(f"/users/{user.user_id}/accounts/{connection_id}/refresh", headers=user.headers)
+        response.raise_for_status()
+
+    response = await client.get(f"/users/{user.user_id}/accounts/", headers=user.headers)
+    response.raise_for_status()
+    user.accounts = [(a["connection_id"], a["bank_id"], a["api_account_id"]) for a in response.json()["accounts"]]
+
+
+def build_request(scenario: str, user: VirtualUser, step: int, window_days: int, refresh_force: bool = True):
+    """Возвращает (method, url, kwargs) для очередного запроса сценария."""
+    if scenario == "login":
+        return "POST", "/auth/login", {"data": {"username": user.email, "password": user.password}}
+    if scenario == "refresh":
+        connection_id = user.connections[step % len(user.connections)]
+        params = {"force": "true"} if refresh_force else {}
+        return "POST", f"/users/{user.user_id}/accounts/{connection_id}/refresh", {"headers": user.headers, "params": params}
+
+    _, bank_id, api_account_id = user.accounts[step % len(user.accounts)]
+    params = {}
+    if window_days:
+        now = time.time()
+        params = {
+            "from_booking_date_time": time.strftime("%Y-%m-%dT00:00:00", time.gmtime(now - window_days * 86400)),
+            "to_booking_date_time": time.strftime("%Y-%m-%dT00:00:00", time.gmtime(now)),
+        }
+    suffix = "transactions" if scenario == "transactions" else "turnover"
+    url = f"/users/{user.user_id}/banks/{bank_id}/accounts/{api_account_id}/{suffix}"
+    return "GET", url, {"headers": user.headers, "params": params}
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: str,
+    users: List[VirtualUser],
+    concurrency: int,
+    duration: float,
+    max_requests: Optional[int],
+    window_days: int,
+    refresh_force: bool = True,
+) -> ScenarioStats:
+    stats = ScenarioStats(scenario)
+    deadline = time.perf_counter() + duration
+    counter = {"issued": 0}
+
+    async def worker(worker_index: int):
+        step = worker_index
+        while time.perf_counter() < deadline:
+            if max_requests is not None and counter["issued"] >= max_requests:
+                return
+            counter["issued"] += 1
+            user = users[step % len(users)]
+            method, url, kwargs = build_request(scenario, user, step, window_days, refresh_force)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                stats.record(time.perf_counter() - start, str(response.status_code), response.status_code < 400)
+                if scenario == "refresh" and response.status_code == 200:
+                    source = response.json().get("source", "unknown")
+                    stats.source_counts[source] = stats.source_counts.get(source, 0) + 1
+            except httpx.HTTPError as e:
+                stats.record(time.perf_counter() - start, type(e).__name__, False)
+            step += concurrency
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    stats.elapsed = time.perf_counter() - started
+    return stats
+
+
+async def loop_blocks_total(client: httpx.AsyncClient) -> Optional[float]:
+    """Сумма finapp_event_loop_blocks_total из /metrics бэкенда (None - метрики недоступны)."""
+    token = os.getenv("METRICS_TOKEN")
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    try:
+        response = await client.get("/metrics", headers=headers)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in response.text.splitlines()
+        if line.startswith("finapp_event_loop_blocks_total")
+    )
+
+
+def print_report(results: List[dict]) -> None:
+    header = f"{'scenario':<14}{'requests':>10}{'errors':>8}{'rps':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<14}{r['requests']:>10}{r['errors']:>8}{r['throughput_rps']:>10}"
+              f"{r['mean_ms']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+    print("(latency in ms)")
+    for r in results:
+        if r["sources"]:
+            print(f"{r['scenario']} sources: " + ", ".join(f"{k}={v}" for k, v in sorted(r["sources"].items())))
+
+
+async def main_async(args) -> int:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        users = [VirtualUser(f"load{i}-{args.run_id}@example.com", "loadtest-password") for i in range(args.users)]
+        banks = [b.strip() for b in args.banks.split(",") if b.strip()]
+        print(f"Preparing {len(users)} users with banks {banks}...")
+        await asyncio.gather(*[prepare_user(client, user, banks) for user in users])
+
+        blocks_before = await loop_blocks_total(client)
+        results = []
+        for scenario in scenarios:
+            print(f"Running '{scenario}' for {args.duration}s with concurrency {args.concurrency}...")
+            stats = await run_scenario(
+                client, scenario, users, args.concurrency, args.duration, args.requests, args.window_days,
+                args.refresh_force,
+            )
+            results.append(stats.summary())
+        blocks_after = await loop_blocks_total(client)
+
+    print_report(results)
+    loop_blocks = None
+    if blocks_before is not None and blocks_after is not None:
+        loop_blocks = int(blocks_after - blocks_before)
+        print(f"Event loop blocks during the run: {loop_blocks}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"run_id": args.run_id, "args": vars(args), "results": results, "loop_blocks": loop_blocks},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.json}")
+
+    failed = [r for r in results if args.max_error_rate is not None and r["requests"] and r["errors"] / r["requests"] > args.max_error_rate]
+    if args.max_loop_blocks is not None:
+        if loop_blocks is None:
+            print("Event loop block count is unavailable (/metrics)", file=sys.stderr)
+            return 1
+        if loop_blocks > args.max_loop_blocks:
+            print(f"Too many event loop blocks: {loop_blocks} > {args.max_loop_blocks}", file=sys.stderr)
+            return 1
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the FinApp backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--fake-bank-url", default="http://127.0.0.1:9100")
+    parser.add_argument("--setup-db", action="store_true", help="Направить банки в БД бэкенда на фейковый банк (нужен DATABASE_URL)")
+    parser.add_argument("--banks", default="vbank,abank")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20.0, help="Длительность каждого сценария, секунд")
+    parser.add_argument("--requests", type=int, default=None, help="Ограничить число запросов на сценарий")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--refresh-force", action=argparse.BooleanOptionalAction, default=True,
+                        help="Сценарий refresh с force=true, в обход окна свежести")
+    parser.add_argument("--window-days", type=int, default=90, help="Период для transactions/turnover (0 - без дат)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--run-id", default=str(int(time.time())))
+    parser.add_argument("--json", default=None, help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="Завершиться с кодом 1, если доля ошибок выше")
+    parser.add_argument("--max-loop-blocks", type=int, default=None,
+                        help="Завершиться с кодом 1, если event loop бэкенда блокировался чаще (по /metrics)")
+    args = parser.parse_args()
+
+    if args.setup_db:
+        configure_banks(args.fake_bank_url)
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
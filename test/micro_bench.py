@@ -0,0 +1,294 @@
+# finance-app-master/test/micro_bench.py
+"""
+Микробенчмарки горячих функций бэкенда на синтетических данных, без БД и сети.
+
+Бенчмарки:
+    parse_transactions    - TransactionDetail(**data) для транзакций из ответа банка
+    filter_page           - filter_transactions_page: разбор, дедупликация, фильтр по датам
+    turnover_decimal      - sum_account_turnover (Decimal, оборот по одному счету)
+    turnover_minor        - accumulate_turnover (целые минимальные единицы, сводные обороты)
+    serialize_accounts    - AccountListResponse с JSONB-полями owner_data / balance_data в JSON
+    jwt_decode            - разбор JWT, как в deps.get_current_user
+    verify_password       - security.verify_password (bcrypt), size - число проверок
+
+Результаты пишутся в JSON (--json); с --baseline каждый результат сравнивается
+с сохраненным прогоном, а с --max-regression скрипт завершается с кодом 1,
+если медиана выросла сильнее заданного множителя.
+
+Пример:
+    python test/micro_bench.py --json micro_baseline.json
+    python test/micro_bench.py --baseline micro_baseline.json --max-regression 1.3
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+# Модулям бэкенда нужны настройки при импорте; соединение с БД не открывается
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("SECRET_KEY", "micro-bench-secret")
+
+from jose import jwt  # noqa: E402
+
+import security  # noqa: E402
+from schemas import AccountListResponse, TransactionDetail  # noqa: E402
+from transactions_api import filter_transactions_page, sum_account_turnover  # noqa: E402
+from turnover_api import TurnoverBucket, accumulate_turnover  # noqa: E402
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+PERIOD_START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+# --- Синтетические данные ---
+
+def make_raw_transactions(count: int, rng: random.Random, duplicate_share: float = 0.0) -> List[dict]:
+    """Транзакции в формате ответа банка; duplicate_share - доля повторов transactionId."""
+    items = []
+    for i in range(count):
+        if duplicate_share and i and rng.random() < duplicate_share:
+            index = rng.randrange(i)
+        else:
+            index = i
+        booked = PERIOD_START + timedelta(minutes=index * 7)
+        items.append({
+            "accountId": "acc-0001",
+            "transactionId": f"tx-{index:08d}",
+            "amount": {"amount": f"{rng.randint(1, 500000) / 100:.2f}", "currency": rng.choice(("RUB", "RUB", "USD"))},
+            "creditDebitIndicator": rng.choice(("Credit", "Debit")),
+            "status": "Booked",
+            "bookingDateTime": booked.isoformat(),
+            "valueDateTime": booked.isoformat(),
+            "transactionInformation": f"Payment #{index} to merchant {rng.randint(1, 999)}",
+            "bankTransactionCode": {"code": rng.choice(("PMNT", "CARD", "TRF"))},
+        })
+    return items
+
+
+def make_accounts(count: int, rng: random.Random) -> List[dict]:
+    """Счета в виде строк таблицы accounts с типичными JSONB-данными банка."""
+    accounts = []
+    for i in range(count):
+        amount = f"{rng.randint(0, 10_000_000) / 100:.2f}"
+        accounts.append({
+            "id": i + 1,
+            "connection_id": i // 3 + 1,
+            "api_account_id": f"acc-{i:06d}",
+            "status": "Enabled",
+            "currency": "RUB",
+            "account_type": "Personal",
+            "account_subtype": "CurrentAccount",
+            "nickname": f"Account {i}",
+            "opening_date": "2020-01-01",
+            "owner_data": [{
+                "schemeName": "RU.CBR.PAN",
+                "identification": f"4081781000000{i:07d}",
+                "name": "Иванов Иван Иванович",
+            }],
+            "balance_data": [
+                {
+                    "accountId": f"acc-{i:06d}",
+                    "type": balance_type,
+                    "dateTime": "2025-06-01T12:00:00+00:00",
+                    "amount": {"amount": amount, "currency": "RUB"},
+                    "creditDebitIndicator": "Credit",
+                }
+                for balance_type in ("InterimAvailable", "InterimBooked", "ClosingBooked")
+            ],
+            "bank_client_id": "team-042",
+            "bank_name": "vbank",
+            "bank_id": 1,
+        })
+    return accounts
+
+
+# --- Бенчмарки: setup(size, rng) возвращает функцию без аргументов ---
+
+def bench_parse_transactions(size: int, rng: random.Random) -> Callable[[], object]:
+    raw = make_raw_transactions(size, rng)
+    return lambda: [TransactionDetail(**data) for data in raw]
+
+
+def bench_filter_page(size: int, rng: random.Random) -> Callable[[], object]:
+    # 10% повторов и примерно четверть транзакций вне периода, как при перекрывающихся страницах
+    raw = make_raw_transactions(size, rng, duplicate_share=0.1)
+    from_utc = PERIOD_START + timedelta(minutes=size * 7 // 8)
+    to_utc = PERIOD_START + timedelta(minutes=size * 7)
+    return lambda: filter_transactions_page(raw, set(), from_utc, to_utc)
+
+
+def bench_turnover_decimal(size: int, rng: random.Random) -> Callable[[], object]:
+    transactions = [TransactionDetail(**data) for data in make_raw_transactions(size, rng)]
+    return lambda: sum_account_turnover(transactions)
+
+
+def bench_turnover_minor(size: int, rng: random.Random) -> Callable[[], object]:
+    transactions = [TransactionDetail(**data) for data in make_raw_transactions(size, rng)]
+
+    def run():
+        buckets: Dict[str, TurnoverBucket] = {}
+        accumulate_turnover(transactions, buckets, fallback_currency="RUB")
+        return buckets
+    return run
+
+
+def bench_serialize_accounts(size: int, rng: random.Random) -> Callable[[], object]:
+    accounts = make_accounts(size, rng)
+    return lambda: AccountListResponse(count=len(accounts), accounts=accounts).model_dump_json()
+
+
+def bench_jwt_decode(size: int, rng: random.Random) -> Callable[[], object]:
+    tokens = [
+        security.create_access_token({"sub": f"user{i}@example.com"}, expires_delta=timedelta(hours=1))
+        for i in range(min(size, 1000))
+    ]
+
+    def run():
+        for i in range(size):
+            jwt.decode(tokens[i % len(tokens)], security.SECRET_KEY, algorithms=[security.ALGORITHM])
+    return run
+
+
+def bench_verify_password(size: int, rng: random.Random) -> Callable[[], object]:
+    hashed = security.get_password_hash("correct horse battery staple")
+
+    def run():
+        for _ in range(size):
+            security.verify_password("correct horse battery staple", hashed)
+    return run
+
+
+# name -> (setup, размеры по умолчанию). bcrypt намеренно медленный, поэтому у него свои размеры
+BENCHMARKS = {
+    "parse_transactions": (bench_parse_transactions, DEFAULT_SIZES),
+    "filter_page": (bench_filter_page, DEFAULT_SIZES),
+    "turnover_decimal": (bench_turnover_decimal, DEFAULT_SIZES),
+    "turnover_minor": (bench_turnover_minor, DEFAULT_SIZES),
+    "serialize_accounts": (bench_serialize_accounts, (100, 1000, 10000)),
+    "jwt_decode": (bench_jwt_decode, (100, 1000, 10000)),
+    "verify_password": (bench_verify_password, (1, 5)),
+}
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> List[float]:
+    """Время каждого запуска; запусков не меньше repeat и суммарно не меньше min_time секунд."""
+    func()  # прогрев
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat or (time.perf_counter() - started < min_time and len(timings) < repeat * 20):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_benchmarks(names: List[str], sizes: Optional[List[int]], repeat: int, min_time: float, seed: int) -> List[dict]:
+    results = []
+    for name in names:
+        setup, default_sizes = BENCHMARKS[name]
+        for size in (sizes or default_sizes):
+            func = setup(size, random.Random(seed))
+            timings = measure(func, repeat, min_time)
+            median = statistics.median(timings)
+            results.append({
+                "name": name,
+                "size": size,
+                "runs": len(timings),
+                "min_s": min(timings),
+                "median_s": median,
+                "mean_s": statistics.fmean(timings),
+                "per_record_us": median / size * 1e6,
+            })
+            print(f"{name:<20}{size:>8}{len(timings):>6}{median * 1000:>12.3f}{median / size * 1e6:>12.3f}", flush=True)
+    return results
+
+
+def compare(results: List[dict], baseline: dict) -> List[dict]:
+    """Добавляет к результатам отношение медианы к базовой (ratio > 1 - стало медленнее)."""
+    base = {(r["name"], r["size"]): r for r in baseline.get("results", [])}
+    for result in results:
+        previous = base.get((result["name"], result["size"]))
+        result["baseline_median_s"] = previous["median_s"] if previous else None
+        result["ratio"] = result["median_s"] / previous["median_s"] if previous and previous["median_s"] else None
+    return results
+
+
+def print_comparison(results: List[dict]) -> None:
+    print(f"\n{'benchmark':<20}{'size':>8}{'baseline ms':>14}{'now ms':>12}{'ratio':>8}")
+    for r in results:
+        if r.get("ratio") is None:
+            continue
+        print(f"{r['name']:<20}{r['size']:>8}{r['baseline_median_s'] * 1000:>14.3f}{r['median_s'] * 1000:>12.3f}{r['ratio']:>8.2f}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for the FinApp backend hot paths")
+    parser.add_argument("--bench", default=",".join(BENCHMARKS), help="Бенчмарки через запятую")
+    parser.add_argument("--sizes", default=None, help="Размеры через запятую (по умолчанию свои у каждого бенчмарка)")
+    parser.add_argument("--repeat", type=int, default=5, help="Минимальное число замеров")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Минимальное суммарное время замеров, секунд")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", default=None, help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--baseline", default=None, help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Завершиться с кодом 1, если медиана выросла больше чем в столько раз")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.bench.split(",") if name.strip()]
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(sorted(unknown))}", file=sys.stderr)
+        sys.exit(2)
+    sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else None
+
+    print(f"{'benchmark':<20}{'size':>8}{'runs':>6}{'median ms':>12}{'us/record':>12}")
+    results = run_benchmarks(names, sizes, args.repeat, args.min_time, args.seed)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+        print_comparison(results)
+        if args.max_regression is not None:
+            regressions = [r for r in results if r.get("ratio") is not None and r["ratio"] > args.max_regression]
+            for r in regressions:
+                print(f"Regression: {r['name']} size={r['size']} is {r['ratio']:.2f}x slower", file=sys.stderr)
+
+    if args.json:
+        output = {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.json}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
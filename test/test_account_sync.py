@@ -0,0 +1,57 @@
+# finance-app-master/test/test_account_sync.py
+"""Объединение одновременных обновлений счетов одного подключения."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import account_sync
+
+
+def test_waiter_takes_over_when_owner_is_cancelled(monkeypatch):
+    calls = []
+    gate = asyncio.Event()
+
+    async def fake_sync(db, conn, bank_config):
+        calls.append(db)
+        await gate.wait()
+        return {"created": 0, "updated": 1, "unchanged": 0, "balance_snapshots": 0, "last_synced_at": None}
+
+    monkeypatch.setattr(account_sync, "sync_connection_accounts", fake_sync)
+    conn = SimpleNamespace(id=1, sync_status=None, last_synced_at=None)
+
+    async def main():
+        owner = asyncio.create_task(account_sync.refresh_connection_accounts("owner-db", conn, None))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(account_sync.refresh_connection_accounts("waiter-db", conn, None))
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        await asyncio.sleep(0)
+        gate.set()
+        result = await waiter
+        assert result["source"] == "bank"
+        assert calls == ["owner-db", "waiter-db"]
+        assert account_sync._inflight == {}
+
+    asyncio.run(main())
+
+
+def test_concurrent_refreshes_share_one_sync(monkeypatch):
+    calls = []
+
+    async def fake_sync(db, conn, bank_config):
+        calls.append(db)
+        await asyncio.sleep(0.01)
+        return {"created": 1, "updated": 0, "unchanged": 0, "balance_snapshots": 0, "last_synced_at": None}
+
+    monkeypatch.setattr(account_sync, "sync_connection_accounts", fake_sync)
+    conn = SimpleNamespace(id=2, sync_status=None, last_synced_at=None)
+
+    async def main():
+        return await asyncio.gather(*(account_sync.refresh_connection_accounts(i, conn, None) for i in range(3)))
+
+    results = asyncio.run(main())
+    assert [r["source"] for r in results] == ["bank", "shared", "shared"]
+    assert calls == [0]
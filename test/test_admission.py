@@ -0,0 +1,156 @@
+# finance-app-master/test/test_admission.py
+"""Ограничение одновременных запросов: AdmissionGroup и AdmissionMiddleware."""
+import asyncio
+import json
+
+import pytest
+
+import admission
+from admission import AdmissionGroup, AdmissionMiddleware, route_group
+
+
+async def settle():
+    """Дает ожидающим задачам дойти до очереди или забрать переданное место."""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_admits_up_to_concurrency_then_queues():
+    async def main():
+        group = AdmissionGroup("test", concurrency=2, queue=4, max_wait=5)
+        assert await group.acquire() is None
+        assert await group.acquire() is None
+        waiter = asyncio.create_task(group.acquire())
+        await settle()
+        assert not waiter.done()
+        assert group.snapshot() == {"in_flight": 2, "queued": 1, "concurrency": 2, "queue": 4}
+        group.release()
+        assert await waiter is None
+        assert group.in_flight == 2
+    asyncio.run(main())
+
+
+def test_rejects_when_queue_is_full():
+    async def main():
+        group = AdmissionGroup("test", concurrency=1, queue=1, max_wait=5)
+        assert await group.acquire() is None
+        waiter = asyncio.create_task(group.acquire())
+        await settle()
+        assert await group.acquire() == "queue_full"
+        group.release()
+        assert await waiter is None
+    asyncio.run(main())
+
+
+def test_times_out_and_leaves_the_queue():
+    async def main():
+        group = AdmissionGroup("test", concurrency=1, queue=4, max_wait=0.05)
+        assert await group.acquire() is None
+        assert await group.acquire() == "timeout"
+        assert len(group.waiters) == 0
+        # Истекший ожидающий не получает место при освобождении
+        group.release()
+        assert group.in_flight == 0
+    asyncio.run(main())
+
+
+def test_hands_slots_over_in_fifo_order():
+    async def main():
+        group = AdmissionGroup("test", concurrency=1, queue=4, max_wait=5)
+        assert await group.acquire() is None
+        order = []
+
+        async def request(name):
+            assert await group.acquire() is None
+            order.append(name)
+            await asyncio.sleep(0)
+            group.release()
+
+        tasks = [asyncio.create_task(request(name)) for name in ("a", "b", "c")]
+        await settle()
+        group.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c"]
+        assert group.in_flight == 0
+    asyncio.run(main())
+
+
+def test_cancel_while_queued_leaves_the_queue():
+    async def main():
+        group = AdmissionGroup("test", concurrency=1, queue=4, max_wait=5)
+        assert await group.acquire() is None
+        waiter = asyncio.create_task(group.acquire())
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert len(group.waiters) == 0
+        group.release()
+        assert group.in_flight == 0
+    asyncio.run(main())
+
+
+def test_cancel_after_handoff_passes_the_slot_on():
+    async def main():
+        group = AdmissionGroup("test", concurrency=1, queue=4, max_wait=5)
+        assert await group.acquire() is None
+        first = asyncio.create_task(group.acquire())
+        second = asyncio.create_task(group.acquire())
+        await settle()
+        # Место передано first, но задача отменена раньше, чем успела его забрать
+        group.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second is None
+        assert group.in_flight == 1
+        group.release()
+        assert group.in_flight == 0
+    asyncio.run(main())
+
+
+def test_route_groups():
+    assert route_group("GET", "/health") == admission.EXEMPT
+    assert route_group("GET", "/users/1/banks/2/accounts/acc-1/transactions") == "bank"
+    assert route_group("GET", "/users/1/export") == "export"
+    assert route_group("GET", "/users/1/connections") == "local"
+    assert route_group("POST", "/users/1/connections") == "bank"
+    assert route_group("OPTIONS", "/users/1/export") == admission.EXEMPT
+
+
+def test_middleware_rejects_with_503_and_retry_after(monkeypatch):
+    group = AdmissionGroup("local", concurrency=1, queue=0, max_wait=2.5)
+    monkeypatch.setitem(admission.GROUPS, "local", group)
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    messages = []
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await gate.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        middleware = AdmissionMiddleware(app)
+        scope = {"type": "http", "method": "GET", "path": "/users/1/connections", "headers": []}
+        running = asyncio.create_task(middleware(scope, receive, send))
+        await settle()
+        assert group.in_flight == 1
+        await middleware(dict(scope), receive, send)
+        gate.set()
+        await running
+        assert group.in_flight == 0
+
+    asyncio.run(main())
+    rejected_start, rejected_body = messages[0], messages[1]
+    assert rejected_start["status"] == 503
+    assert (b"retry-after", b"3") in rejected_start["headers"]
+    assert json.loads(rejected_body["body"]) == {"detail": "Server is busy, please retry later."}
+    assert messages[2]["status"] == 200
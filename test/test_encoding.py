@@ -0,0 +1,177 @@
+# finance-app-master/test/test_encoding.py
+"""Сжатие ответов: _CompressingSender и CompressionMiddleware с поддельным ASGI send."""
+import asyncio
+import gzip
+import zlib
+
+from starlette.datastructures import Headers
+
+from encoding import (
+    COMPRESSION_THREAD_THRESHOLD, CompressionMiddleware, _CompressingSender, choose_encoding, parse_qvalues,
+)
+
+MIN_SIZE = 1024
+LARGE_BODY = b'{"items": [' + b",".join(b'{"id": %d, "name": "item"}' % i for i in range(500)) + b"]}"
+SMALL_BODY = b'{"ok": true}'
+
+
+def start_message(content_type="application/json", content_length=None, status=200, extra=()):
+    headers = [(b"content-type", content_type.encode())]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    headers.extend(extra)
+    return {"type": "http.response.start", "status": status, "headers": headers}
+
+
+def body_message(body, more_body=False):
+    return {"type": "http.response.body", "body": body, "more_body": more_body}
+
+
+class FakeSend:
+    def __init__(self):
+        self.messages = []
+
+    async def __call__(self, message):
+        self.messages.append(message)
+
+    @property
+    def headers(self) -> Headers:
+        return Headers(raw=self.messages[0]["headers"])
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(m.get("body", b"") for m in self.messages[1:])
+
+
+def run(sender, *messages):
+    async def main():
+        for message in messages:
+            await sender(message)
+    asyncio.run(main())
+
+
+def test_small_body_is_sent_as_is():
+    send = FakeSend()
+    run(_CompressingSender(send, "gzip", MIN_SIZE), start_message(), body_message(SMALL_BODY))
+    assert "content-encoding" not in send.headers
+    assert send.body == SMALL_BODY
+    assert "Accept-Encoding" in send.headers["vary"]
+
+
+def test_small_content_length_passes_through_at_start():
+    send = FakeSend()
+    sender = _CompressingSender(send, "gzip", MIN_SIZE)
+    run(sender, start_message(content_length=len(SMALL_BODY)))
+    # Заголовки ушли сразу, не дожидаясь тела
+    assert len(send.messages) == 1
+    assert sender.passthrough
+
+
+def test_large_body_is_compressed_with_content_length():
+    send = FakeSend()
+    run(
+        _CompressingSender(send, "gzip", MIN_SIZE),
+        start_message(content_length=len(LARGE_BODY)), body_message(LARGE_BODY),
+    )
+    assert send.headers["content-encoding"] == "gzip"
+    assert int(send.headers["content-length"]) == len(send.body)
+    assert len(send.body) < len(LARGE_BODY)
+    assert gzip.decompress(send.body) == LARGE_BODY
+
+
+def test_body_above_thread_threshold_is_compressed_off_the_loop():
+    body = b'{"row": "value"},' * (COMPRESSION_THREAD_THRESHOLD // 16 + 1)
+    send = FakeSend()
+    run(_CompressingSender(send, "gzip", MIN_SIZE), start_message(), body_message(body))
+    assert send.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(send.body) == body
+
+
+def test_streaming_chunks_are_flushed_as_they_arrive():
+    send = FakeSend()
+    sender = _CompressingSender(send, "gzip", MIN_SIZE)
+    chunks = [b"id,name\n", b"1,first\n" * 50, b"2,second\n" * 50]
+
+    async def main():
+        await sender(start_message(content_type="text/csv"))
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        received = b""
+        for index, chunk in enumerate(chunks, start=1):
+            await sender(body_message(chunk, more_body=True))
+            # Каждая часть уходит сразу и распаковывается без ожидания конца потока
+            received += decompressor.decompress(send.messages[-1]["body"])
+            assert received == b"".join(chunks[:index])
+        await sender(body_message(b""))
+
+    asyncio.run(main())
+    assert send.headers["content-encoding"] == "gzip"
+    assert "content-length" not in send.headers
+    assert send.messages[-1]["more_body"] is False
+    assert gzip.decompress(send.body) == b"".join(chunks)
+
+
+def test_non_compressible_type_passes_through():
+    send = FakeSend()
+    run(
+        _CompressingSender(send, "gzip", MIN_SIZE),
+        start_message(content_type="image/png"), body_message(LARGE_BODY),
+    )
+    assert "content-encoding" not in send.headers
+    assert "vary" not in send.headers
+    assert send.body == LARGE_BODY
+
+
+def test_already_encoded_response_passes_through():
+    send = FakeSend()
+    run(
+        _CompressingSender(send, "gzip", MIN_SIZE),
+        start_message(extra=[(b"content-encoding", b"br")]), body_message(LARGE_BODY),
+    )
+    assert send.headers["content-encoding"] == "br"
+    assert send.body == LARGE_BODY
+
+
+def test_no_content_status_passes_through():
+    send = FakeSend()
+    run(_CompressingSender(send, "gzip", MIN_SIZE), start_message(status=204), body_message(b""))
+    assert "content-encoding" not in send.headers
+
+
+def make_app(body, content_type=b"application/json"):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+def http_scope(accept_encoding=None):
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    return {"type": "http", "method": "GET", "path": "/", "headers": headers}
+
+
+async def _receive():
+    return {"type": "http.request", "body": b""}
+
+
+def test_middleware_compresses_when_client_accepts_gzip():
+    send = FakeSend()
+    asyncio.run(CompressionMiddleware(make_app(LARGE_BODY), minimum_size=MIN_SIZE)(
+        http_scope("gzip, deflate"), _receive, send
+    ))
+    assert send.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(send.body) == LARGE_BODY
+
+
+def test_middleware_leaves_response_without_accept_encoding():
+    send = FakeSend()
+    asyncio.run(CompressionMiddleware(make_app(LARGE_BODY), minimum_size=MIN_SIZE)(http_scope(), _receive, send))
+    assert "content-encoding" not in send.headers
+    assert send.body == LARGE_BODY
+
+
+def test_encoding_negotiation():
+    assert parse_qvalues("gzip, br;q=0.8, zstd;q=bad") == {"gzip": 1.0, "br": 0.8, "zstd": 0.0}
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("") is None
+    assert choose_encoding("*") is not None
+    assert choose_encoding("identity, gzip;q=0.5") == "gzip"
@@ -0,0 +1,35 @@
+# finance-app-master/test/test_events_api.py
+"""WebSocket событий: передача токена и маскирование его в журналах доступа."""
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import events_api
+from outbound_logging import AccessLogRedactFilter
+
+
+def make_client(monkeypatch, seen):
+    monkeypatch.setattr(events_api, "_authorize", lambda token, user_id: seen.append(token) or token == "good")
+    app = FastAPI()
+    app.include_router(events_api.router)
+    return TestClient(app)
+
+
+def test_token_in_subprotocol_is_not_echoed(monkeypatch):
+    seen = []
+    client = make_client(monkeypatch, seen)
+    with client.websocket_connect("/users/1/events", subprotocols=["bearer", "good"]) as websocket:
+        assert websocket.accepted_subprotocol == "bearer"
+    with client.websocket_connect("/users/1/events?token=good") as websocket:
+        assert websocket.accepted_subprotocol is None
+    assert seen == ["good", "good"]
+
+
+def test_access_log_record_is_redacted():
+    record = logging.LogRecord(
+        "uvicorn.error", logging.INFO, __file__, 0, '%s - "WebSocket %s" [accepted]',
+        ("127.0.0.1:5000", "/users/1/events?token=secret.jwt&x=1"), None,
+    )
+    assert AccessLogRedactFilter().filter(record)
+    assert record.getMessage() == '127.0.0.1:5000 - "WebSocket /users/1/events?token=***&x=1" [accepted]'
@@ -0,0 +1,24 @@
+# finance-app-master/test/test_rate_limit.py
+"""Лимитер запросов в банк: отказ по истечении ожидания в очереди."""
+import asyncio
+
+import httpx
+import pytest
+
+from rate_limit import BankRateLimited, BankRateLimiter, TokenBucket
+
+
+def test_queued_request_times_out_with_bank_rate_limited():
+    async def main():
+        limiter = BankRateLimiter("testbank")
+        limiter.bank_bucket = TokenBucket(rate=0.01, capacity=1)
+        await limiter.acquire("accounts", "1", max_wait=0.05)
+        with pytest.raises(BankRateLimited) as raised:
+            await limiter.acquire("balances", "1", max_wait=0.05)
+        assert limiter.queued == 0
+        return raised.value
+
+    error = asyncio.run(main())
+    # Обработчики сбоев запроса в банк (httpx.RequestError) получают и отказ лимитера
+    assert isinstance(error, httpx.RequestError)
+    assert error.retry_after >= 1